@@ -0,0 +1,53 @@
+import os
+from datetime import timedelta
+
+import async_db
+import schedule
+
+# Done tasks move to the archive (/history) this many days after completion; empty disables it.
+# Tasks that still have reminders stay until the reminders end
+ARCHIVE_AFTER_DAYS = os.getenv("ARCHIVE_AFTER_DAYS", "30")
+ARCHIVE_AFTER_DAYS = float(ARCHIVE_AFTER_DAYS) if ARCHIVE_AFTER_DAYS else None
+INTERVAL = 3600  # seconds between archiving rounds
+# Tasks moved, search index pages merged and free pages returned to the filesystem per
+# transaction, so a round never holds the write lock long enough to stall the handlers
+BATCH = 500
+MERGE_PAGES = 64
+VACUUM_PAGES = 1000
+
+
+class Archiver: # Moves old done tasks out of the hot tasks table, then shrinks the database file
+    def __init__(self, after_days=ARCHIVE_AFTER_DAYS, batch=BATCH, merge_pages=MERGE_PAGES, vacuum_pages=VACUUM_PAGES):
+        self.after_days = after_days
+        self.batch = batch
+        self.merge_pages = merge_pages
+        self.vacuum_pages = vacuum_pages
+
+        # Counters
+        self.archived = 0
+        self.reclaimed = 0
+
+    def start(self, job_queue): # First round a minute after startup, then every INTERVAL
+        job_queue.run_repeating(self.run, interval=INTERVAL, first=60, name="archive")
+
+    async def run(self, context=None): # One round; returns (tasks archived, pages reclaimed)
+        archived = reclaimed = 0
+        if self.after_days is not None:
+            done_before = schedule.format_utc(schedule.utcnow() - timedelta(days=self.after_days))
+            while True:
+                count = await async_db.archive_done_tasks(done_before, self.batch)
+                archived += count
+                if count < self.batch:
+                    break
+        # Every moved or deleted task left a tombstone in the search index
+        while await async_db.compact_search_index(self.merge_pages):
+            pass
+        # Pages freed by archiving, /clear and finished reminders alike
+        while True:
+            pages = await async_db.reclaim_space(self.vacuum_pages)
+            reclaimed += pages
+            if pages < self.vacuum_pages:
+                break
+        self.archived += archived
+        self.reclaimed += reclaimed
+        return archived, reclaimed
@@ -0,0 +1,201 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial, wraps
+
+import db
+import metrics
+from pool import READER_COUNT, group_commit
+
+# Reads run concurrently on a thread pool, each borrowing a pooled reader connection.
+# Writes are queued to one dedicated thread per shard so they never block the event
+# loop and always reach the database in the order the handlers issued them; a
+# user's writes all go to the thread of the shard that owns the user.
+_readers = ThreadPoolExecutor(max_workers=READER_COUNT * db.SHARDS, thread_name_prefix="db-read")
+_lanes = {}  # shard -> (queue, writer thread)
+_writer_lock = threading.Lock()
+
+# Group commit, off unless DB_GROUP_COMMIT_MS is set: a writer thread then runs the
+# writes waiting in its queue, up to DB_GROUP_COMMIT_OPS of them, in one transaction,
+# first waiting up to DB_GROUP_COMMIT_MS for more to arrive (0: only what is queued).
+# Every caller's await still resolves only once its own write is committed.
+GROUP_COMMIT_MS = float(os.environ["DB_GROUP_COMMIT_MS"]) if os.getenv("DB_GROUP_COMMIT_MS") else None
+GROUP_COMMIT_OPS = int(os.getenv("DB_GROUP_COMMIT_OPS", "100"))
+
+_NOTHING = object()  # no write left over from collecting a group
+
+
+def _run(item): # One write in its own transaction
+    future, func, args, kwargs, _ = item
+    if not future.set_running_or_notify_cancel():
+        return
+    try:
+        future.set_result(func(*args, **kwargs))
+    except BaseException as exc:
+        future.set_exception(exc)
+
+
+def _collect(writes, first): # (group starting with first, the next item that does not belong in it)
+    group = [first]
+    deadline = time.monotonic() + GROUP_COMMIT_MS / 1000
+    while len(group) < GROUP_COMMIT_OPS:
+        try:
+            item = writes.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            return group, _NOTHING
+        if item is None or not item[4]:
+            return group, item
+        group.append(item)
+    return group, _NOTHING
+
+
+def _run_group(group): # Several writes in one transaction; a write that raises is rolled back alone
+    started = [item for item in group if item[0].set_running_or_notify_cancel()]
+    outcomes = []
+    try:
+        with group_commit():
+            for future, func, args, kwargs, _ in started:
+                try:
+                    outcomes.append((func(*args, **kwargs), None))
+                except Exception as exc:
+                    outcomes.append((None, exc))
+    except BaseException as exc:
+        for future, *_ in started:
+            future.set_exception(exc)
+        return
+    metrics.db_group_commit_writes.observe(None, len(started))
+    for (future, *_), (result, exc) in zip(started, outcomes):
+        if exc is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exc)
+
+
+def _writer_loop(writes): # Drain one write queue until the shutdown sentinel arrives
+    item = writes.get()
+    while item is not None:
+        # Only per-user writes are grouped; the rest touch every shard and run on their own
+        if GROUP_COMMIT_MS is None or not item[4]:
+            _run(item)
+            item = writes.get()
+            continue
+        group, item = _collect(writes, item)
+        _run_group(group)
+        if item is _NOTHING:
+            item = writes.get()
+
+
+def _lane(shard): # Write queue for a shard, starting its thread on first use
+    lane = _lanes.get(shard)
+    if lane is not None and lane[1].is_alive():
+        return lane[0]
+    with _writer_lock:
+        lane = _lanes.get(shard)
+        if lane is None or not lane[1].is_alive():
+            writes = queue.Queue()
+            writer = threading.Thread(target=_writer_loop, args=(writes,), name=f"db-write-{shard}", daemon=True)
+            writer.start()
+            lane = _lanes[shard] = (writes, writer)
+        return lane[0]
+
+
+def pending_writes(): # Number of writes waiting for the writer threads
+    return sum(writes.qsize() for writes, _ in list(_lanes.values()))
+
+
+def close(): # Finish queued writes and stop the worker threads
+    with _writer_lock:
+        for writes, writer in _lanes.values():
+            writes.put(None)
+        for writes, writer in _lanes.values():
+            writer.join()
+        _lanes.clear()
+    _readers.shutdown(wait=True)
+
+
+def _read(func):
+    timed = metrics.timed_query(func)
+
+    @wraps(func)
+    async def call(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_readers, partial(timed, *args, **kwargs))
+    return call
+
+
+def _stream(func):
+    # func is a generator of row chunks; each chunk is pulled on a reader thread
+    timed = metrics.timed_stream(func)
+
+    @wraps(func)
+    async def call(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        chunks = timed(*args, **kwargs)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(_readers, next, chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            await loop.run_in_executor(_readers, chunks.close)
+    return call
+
+
+def _write(func, per_user=True):
+    # per_user functions take the user id first and run on that user's shard thread
+    timed = metrics.timed_query(func)
+
+    @wraps(func)
+    async def call(*args, **kwargs):
+        future = Future()
+        _lane(db.shard_of(args[0]) if per_user else 0).put((future, timed, args, kwargs, per_user))
+        return await asyncio.wrap_future(future)
+    return call
+
+
+get_user_tasks = _read(db.get_user_tasks)
+get_user_reminders = _read(db.get_user_reminders)
+get_task_page = _read(db.get_task_page)
+get_reminder_page = _read(db.get_reminder_page)
+search_tasks = _read(db.search_tasks)
+has_tasks = _read(db.has_tasks)
+get_task_by_number = _read(db.get_task_by_number)
+get_all_reminders = _read(db.get_all_reminders)
+iter_due_reminders = _stream(db.iter_due_reminders)
+get_user_timezone = _read(db.get_user_timezone)
+get_stats = _read(db.get_stats)
+get_archive_page = _read(db.get_archive_page)
+get_user_stats = _read(db.get_user_stats)
+# A full recount on a reader thread; it only takes the write lock if there is drift to repair
+check_stats = _read(db.check_stats)
+
+add_task = _write(db.add_task)
+add_tasks = _write(db.add_tasks)
+update_task_status = _write(db.update_task_status)
+update_task_text = _write(db.update_task_text)
+delete_task = _write(db.delete_task)
+clear_all_tasks = _write(db.clear_all_tasks)
+complete_task_by_number = _write(db.complete_task_by_number)
+edit_task_by_number = _write(db.edit_task_by_number)
+delete_task_by_number = _write(db.delete_task_by_number)
+complete_tasks_by_number = _write(db.complete_tasks_by_number)
+delete_tasks_by_number = _write(db.delete_tasks_by_number)
+add_reminder = _write(db.add_reminder)
+add_reminder_by_number = _write(db.add_reminder_by_number)
+update_reminder_days = _write(db.update_reminder_days)
+delete_reminder = _write(db.delete_reminder)
+delete_reminder_by_number = _write(db.delete_reminder_by_number)
+clear_all_reminders = _write(db.clear_all_reminders)
+set_user_timezone = _write(db.set_user_timezone)
+advance_reminders = _write(db.advance_reminders, per_user=False)
+add_dead_letter = _write(db.add_dead_letter)
+archive_tasks = _write(db.archive_tasks)
+archive_done_tasks = _write(db.archive_done_tasks, per_user=False)
+compact_search_index = _write(db.compact_search_index, per_user=False)
+reclaim_space = _write(db.reclaim_space, per_user=False)
+renew_leases = _write(db.renew_leases, per_user=False)
+release_leases = _write(db.release_leases, per_user=False)
@@ -0,0 +1,17 @@
+from backends.base import Backend
+from backends.memory import MemoryBackend
+from backends.sharded import ShardedBackend
+from backends.sqlite import SQLiteBackend
+
+
+def open_backend(kind, path, shards=1): # Backend selected by DB_BACKEND / DB_SHARDS
+    if kind == "memory":
+        return MemoryBackend()
+    if kind != "sqlite":
+        raise ValueError(f"Unknown DB_BACKEND {kind!r} (expected 'sqlite' or 'memory')")
+    if shards > 1:
+        return ShardedBackend(path, shards)
+    return SQLiteBackend(path)
+
+
+__all__ = ["Backend", "MemoryBackend", "SQLiteBackend", "ShardedBackend", "open_backend"]
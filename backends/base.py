@@ -0,0 +1,170 @@
+import re
+
+
+def user_partition(user_id, partition_count): # Reminder partition of a user, as SQL abs(CAST(user_id AS INTEGER)) % n
+    number = re.match(r"\s*[+-]?\d+", user_id)
+    return abs(int(number.group())) % partition_count if number else 0
+
+
+def due_chunks(rows, chunk_size): # About chunk_size rows at a time, never splitting one user's fire time
+    # Rows arrive ordered by (next_fire_at, user_id), so each digest the dispatcher builds is complete
+    chunk, last = [], None
+    for row in rows:
+        key = (row["next_fire_at"], row["user_id"])
+        if len(chunk) >= chunk_size and key != last:
+            yield chunk
+            chunk = []
+        chunk.append(row)
+        last = key
+    if chunk:
+        yield chunk
+
+
+class Backend: # Storage interface behind db.py; db.py adds the per-user cache on top
+    shards = 1  # independent write domains; async_db runs one writer thread per shard
+
+    def shard_of(self, user_id): # Index of the shard holding a user's rows
+        return 0
+
+    def init(self): # Create or upgrade the schema
+        pass
+
+    def close(self): # Release connections and threads
+        pass
+
+    # Tasks, in creation order per user
+    def get_user_tasks(self, user_id): # [{"id", "task", "done"}]
+        raise NotImplementedError
+
+    def add_task(self, user_id, task_text): # Returns the new task's integer id
+        raise NotImplementedError
+
+    def add_tasks(self, user_id, task_texts): # In that order, in one transaction; returns their ids
+        raise NotImplementedError
+
+    def update_task_status(self, user_id, task_id, done=True):
+        raise NotImplementedError
+
+    def update_task_text(self, user_id, task_id, new_text):
+        raise NotImplementedError
+
+    def delete_task(self, user_id, task_id): # Also deletes the task's reminders
+        raise NotImplementedError
+
+    def clear_all_tasks(self, user_id): # Also deletes the user's reminders
+        raise NotImplementedError
+
+    def has_tasks(self, user_id):
+        raise NotImplementedError
+
+    def get_task_by_number(self, user_id, number): # The number-th (1-based) task, or None
+        raise NotImplementedError
+
+    def complete_task_by_number(self, user_id, number): # Returns the task, or None if out of range
+        raise NotImplementedError
+
+    def edit_task_by_number(self, user_id, number, new_text): # Returns the old task, or None
+        raise NotImplementedError
+
+    def delete_task_by_number(self, user_id, number): # Returns (task, reminders removed), or None
+        raise NotImplementedError
+
+    def complete_tasks_by_number(self, user_id, numbers): # {number: task before} for the numbers in range
+        raise NotImplementedError
+
+    def delete_tasks_by_number(self, user_id, numbers): # ({number: task}, reminders removed) for the numbers in range
+        raise NotImplementedError
+
+    def get_task_page(self, user_id, cursor=None, backwards=False, limit=20):
+        # {"start", "tasks": [{..., "cursor": (created_at, rowid)}], "has_prev", "has_next"}
+        raise NotImplementedError
+
+    def search_tasks(self, user_id, query, limit=20):
+        # Best matches first, each word matching as a prefix: [{"number", "id", "task", "done"}]
+        raise NotImplementedError
+
+    # Reminders, in creation order per user
+    def get_user_reminders(self, user_id): # [{"task_id", "time", "days_left"}]
+        raise NotImplementedError
+
+    def get_reminder_page(self, user_id, cursor=None, backwards=False, limit=20):
+        # {"start", "reminders": [{..., "task_text", "cursor": reminder id}], "has_prev", "has_next"}
+        raise NotImplementedError
+
+    def add_reminder(self, user_id, task_id, time_str, days): # Fires next at time_str in the user's timezone
+        raise NotImplementedError
+
+    def add_reminder_by_number(self, user_id, number, time_str, days): # Returns the task, or None
+        raise NotImplementedError
+
+    def update_reminder_days(self, user_id, task_id, time_str, new_days):
+        raise NotImplementedError
+
+    def delete_reminder(self, user_id, task_id, time_str):
+        raise NotImplementedError
+
+    def delete_reminder_by_number(self, user_id, number): # Returns {"task_id", "time", "task_text"}, or None
+        raise NotImplementedError
+
+    def clear_all_reminders(self, user_id):
+        raise NotImplementedError
+
+    def get_user_timezone(self, user_id): # IANA name set with /timezone, or None
+        raise NotImplementedError
+
+    def set_user_timezone(self, user_id, timezone_name): # Also moves the user's reminders; returns how many
+        raise NotImplementedError
+
+    # Across all users
+    def get_all_reminders(self): # [{"user_id", "task_id", "time", "days_left", "task_text"}]
+        raise NotImplementedError
+
+    def iter_due_reminders(self, until, after=None, chunk_size=500, partitions=None, partition_count=1):
+        # Chunks of reminders with after < next_fire_at <= until (UTC timestamps; no lower bound if after
+        # is None), each with "next_fire_at", ordered by (next_fire_at, user_id) and never splitting one
+        # user's fire time across chunks; only user_partition() in partitions if given
+        raise NotImplementedError
+
+    def advance_reminders(self, reminder_ids, fired_at):
+        # Count a day off each, drop finished ones, move the rest to their next fire time after fired_at;
+        # returns affected user ids
+        raise NotImplementedError
+
+    def add_dead_letter(self, chat_id, text, error):
+        raise NotImplementedError
+
+    # Done tasks leave the hot tasks table for the archive; a task with reminders stays until they end
+    def archive_tasks(self, user_id): # Archive all of the user's done tasks now; returns how many
+        raise NotImplementedError
+
+    def archive_done_tasks(self, done_before, limit=500):
+        # Archive up to limit tasks done at or before done_before (UTC timestamp), oldest first, in one
+        # transaction; returns the user id of each
+        raise NotImplementedError
+
+    def get_archive_page(self, user_id, cursor=None, backwards=False, limit=20):
+        # Newest first: {"start", "tasks": [{"task", "done_at", "cursor": archive id}], "has_prev", "has_next"}
+        raise NotImplementedError
+
+    def compact_search_index(self, pages): # Merge about pages of the search index, dropping deleted titles; False once done
+        raise NotImplementedError
+
+    def reclaim_space(self, pages): # Return up to pages free pages to the filesystem; returns how many
+        raise NotImplementedError
+
+    def get_stats(self): # {"users", "tasks", "done", "reminders"} across all users
+        raise NotImplementedError
+
+    def get_user_stats(self, user_id): # {"tasks", "done", "reminders"} of one user
+        raise NotImplementedError
+
+    def check_stats(self): # Recount from scratch and repair the stored counts if they drifted; returns how many did
+        raise NotImplementedError
+
+    # Reminder partition leases shared by worker processes
+    def renew_leases(self, worker_id, partition_count, ttl, busy=()):
+        # Heartbeat, then keep/claim/release partitions towards a fair share; returns the partitions held
+        raise NotImplementedError
+
+    def release_leases(self, worker_id): # Hand every partition back at once on a clean shutdown
+        raise NotImplementedError
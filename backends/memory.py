@@ -0,0 +1,382 @@
+import itertools
+import re
+import threading
+import unicodedata
+from datetime import datetime, timezone
+
+import schedule
+from backends.base import Backend, due_chunks, user_partition
+
+
+def _now(): # Same format and clock as SQLite's CURRENT_TIMESTAMP
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _fold(text): # Case- and accent-insensitive form, like the FTS5 unicode61 tokenizer
+    return "".join(c for c in unicodedata.normalize("NFKD", text.casefold()) if not unicodedata.combining(c))
+
+
+def _public(task):
+    return {"id": task["id"], "task": task["task"], "done": task["done"]}
+
+
+def _complete(task): # Mark done, keeping the first completion time as SQLite does
+    task["done"] = True
+    task["done_at"] = task["done_at"] or _now()
+
+
+class MemoryBackend(Backend): # Plain dicts behind one lock; for tests and throwaway runs
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rowids = itertools.count(1)
+        self._reminder_ids = itertools.count(1)
+        self._tasks = {}      # user_id -> tasks in creation order
+        self._reminders = {}  # reminder id -> reminder, in creation order
+        self._timezones = {}  # user_id -> /timezone
+        self._archive = {}    # user_id -> archived tasks, oldest first
+        self._archive_ids = itertools.count(1)
+        self.dead_letters = []
+        self._leases = {}  # partition -> owner; one process, so no expiry needed
+
+    def _task_at(self, user_id, number):
+        tasks = self._tasks.get(user_id, [])
+        return tasks[number - 1] if 1 <= number <= len(tasks) else None
+
+    def _drop_tasks(self, user_id, task_ids): # Remove tasks and cascade to their reminders
+        self._tasks[user_id] = [t for t in self._tasks.get(user_id, []) if t["id"] not in task_ids]
+        for rid in [rid for rid, r in self._reminders.items() if r["task_id"] in task_ids]:
+            del self._reminders[rid]
+
+    def _user_reminders(self, user_id):
+        return [r for r in self._reminders.values() if r["user_id"] == user_id]
+
+    def _task_text(self, user_id, task_id):
+        return next((t["task"] for t in self._tasks.get(user_id, []) if t["id"] == task_id), None)
+
+    def get_user_tasks(self, user_id):
+        with self._lock:
+            return [_public(t) for t in self._tasks.get(user_id, [])]
+
+    def _append_task(self, user_id, task_text): # Ids come from the rowid counter, as in SQLite
+        task_id = next(self._rowids)
+        self._tasks.setdefault(user_id, []).append(
+            {"id": task_id, "task": task_text, "done": False, "done_at": None, "cursor": (_now(), task_id)})
+        return task_id
+
+    def add_task(self, user_id, task_text):
+        with self._lock:
+            return self._append_task(user_id, task_text)
+
+    def add_tasks(self, user_id, task_texts):
+        with self._lock:
+            return [self._append_task(user_id, task_text) for task_text in task_texts]
+
+    def update_task_status(self, user_id, task_id, done=True):
+        with self._lock:
+            for task in self._tasks.get(user_id, []):
+                if task["id"] == task_id:
+                    if done:
+                        _complete(task)
+                    else:
+                        task["done"], task["done_at"] = False, None
+
+    def update_task_text(self, user_id, task_id, new_text):
+        with self._lock:
+            for task in self._tasks.get(user_id, []):
+                if task["id"] == task_id:
+                    task["task"] = new_text
+
+    def delete_task(self, user_id, task_id):
+        with self._lock:
+            self._drop_tasks(user_id, {task_id})
+
+    def clear_all_tasks(self, user_id):
+        with self._lock:
+            self._drop_tasks(user_id, {t["id"] for t in self._tasks.get(user_id, [])})
+
+    def has_tasks(self, user_id):
+        with self._lock:
+            return bool(self._tasks.get(user_id))
+
+    def get_task_by_number(self, user_id, number):
+        with self._lock:
+            task = self._task_at(user_id, number)
+            return _public(task) if task else None
+
+    def complete_task_by_number(self, user_id, number):
+        with self._lock:
+            task = self._task_at(user_id, number)
+            if task is None:
+                return None
+            before = _public(task)
+            _complete(task)
+            return before
+
+    def edit_task_by_number(self, user_id, number, new_text):
+        with self._lock:
+            task = self._task_at(user_id, number)
+            if task is None:
+                return None
+            before = _public(task)
+            task["task"] = new_text
+            return before
+
+    def delete_task_by_number(self, user_id, number):
+        with self._lock:
+            task = self._task_at(user_id, number)
+            if task is None:
+                return None
+            reminders = sum(1 for r in self._reminders.values() if r["task_id"] == task["id"])
+            self._drop_tasks(user_id, {task["id"]})
+            return _public(task), reminders
+
+    def _tasks_at(self, user_id, numbers):
+        tasks = {}
+        for number in numbers:
+            task = self._task_at(user_id, number)
+            if task is not None:
+                tasks[number] = task
+        return tasks
+
+    def complete_tasks_by_number(self, user_id, numbers):
+        with self._lock:
+            tasks = self._tasks_at(user_id, numbers)
+            before = {number: _public(task) for number, task in tasks.items()}
+            for task in tasks.values():
+                _complete(task)
+            return before
+
+    def delete_tasks_by_number(self, user_id, numbers):
+        with self._lock:
+            tasks = self._tasks_at(user_id, numbers)
+            ids = {task["id"] for task in tasks.values()}
+            reminders = sum(1 for r in self._reminders.values() if r["task_id"] in ids)
+            self._drop_tasks(user_id, ids)
+            return {number: _public(task) for number, task in tasks.items()}, reminders
+
+    def get_task_page(self, user_id, cursor=None, backwards=False, limit=20):
+        with self._lock:
+            tasks = self._tasks.get(user_id, [])
+            if cursor is None:
+                index = len(tasks) if backwards else 0
+            elif backwards:
+                index = sum(1 for t in tasks if t["cursor"] < cursor)
+            else:
+                index = sum(1 for t in tasks if t["cursor"] <= cursor)
+            first = max(0, index - limit) if backwards else index
+            rows = tasks[first:first + limit]
+            if not rows:
+                return {"start": 1, "tasks": [], "has_prev": False, "has_next": False}
+            return {"start": first + 1, "tasks": [dict(_public(t), cursor=t["cursor"]) for t in rows],
+                    "has_prev": first > 0, "has_next": first + len(rows) < len(tasks)}
+
+    def search_tasks(self, user_id, query, limit=20):
+        # Every word must start some word of the title; fewer extra words ranks higher
+        words = [_fold(word) for word in query.split()]
+        with self._lock:
+            hits = []
+            for number, task in enumerate(self._tasks.get(user_id, []), 1):
+                title = re.findall(r"\w+", _fold(task["task"]))
+                if words and all(any(w.startswith(word) for w in title) for word in words):
+                    hits.append((len(title), number, task))
+            hits.sort(key=lambda hit: hit[:2])
+            return [dict(_public(task), number=number) for _, number, task in hits[:limit]]
+
+    def get_user_reminders(self, user_id):
+        with self._lock:
+            return [{"task_id": r["task_id"], "time": r["time"], "days_left": r["days_left"]}
+                    for r in self._user_reminders(user_id)]
+
+    def get_reminder_page(self, user_id, cursor=None, backwards=False, limit=20):
+        with self._lock:
+            reminders = self._user_reminders(user_id)
+            if cursor is None:
+                index = len(reminders) if backwards else 0
+            elif backwards:
+                index = sum(1 for r in reminders if r["id"] < cursor)
+            else:
+                index = sum(1 for r in reminders if r["id"] <= cursor)
+            first = max(0, index - limit) if backwards else index
+            rows = reminders[first:first + limit]
+            if not rows:
+                return {"start": 1, "reminders": [], "has_prev": False, "has_next": False}
+            page = [{"task_id": r["task_id"], "time": r["time"], "days_left": r["days_left"],
+                     "task_text": self._task_text(user_id, r["task_id"]), "cursor": r["id"]} for r in rows]
+            return {"start": first + 1, "reminders": page,
+                    "has_prev": first > 0, "has_next": first + len(rows) < len(reminders)}
+
+    def _insert_reminder(self, user_id, task_id, time_str, days):
+        rid = next(self._reminder_ids)
+        next_fire_at = schedule.next_fire_at(time_str, self._timezones.get(user_id), schedule.utcnow())
+        self._reminders[rid] = {"id": rid, "user_id": user_id, "task_id": task_id, "time": time_str,
+                                "days_left": days, "next_fire_at": next_fire_at, "last_fired_at": None}
+
+    def add_reminder(self, user_id, task_id, time_str, days):
+        with self._lock:
+            self._insert_reminder(user_id, task_id, time_str, days)
+
+    def add_reminder_by_number(self, user_id, number, time_str, days):
+        with self._lock:
+            task = self._task_at(user_id, number)
+            if task is None:
+                return None
+            self._insert_reminder(user_id, task["id"], time_str, days)
+            return _public(task)
+
+    def update_reminder_days(self, user_id, task_id, time_str, new_days):
+        with self._lock:
+            for r in self._user_reminders(user_id):
+                if r["task_id"] == task_id and r["time"] == time_str:
+                    r["days_left"] = new_days
+
+    def delete_reminder(self, user_id, task_id, time_str):
+        with self._lock:
+            for r in self._user_reminders(user_id):
+                if r["task_id"] == task_id and r["time"] == time_str:
+                    del self._reminders[r["id"]]
+
+    def delete_reminder_by_number(self, user_id, number):
+        with self._lock:
+            reminders = self._user_reminders(user_id)
+            if not 1 <= number <= len(reminders):
+                return None
+            r = self._reminders.pop(reminders[number - 1]["id"])
+            return {"task_id": r["task_id"], "time": r["time"], "task_text": self._task_text(user_id, r["task_id"])}
+
+    def clear_all_reminders(self, user_id):
+        with self._lock:
+            for r in self._user_reminders(user_id):
+                del self._reminders[r["id"]]
+
+    def _joined(self): # Reminders whose task still exists, as the SQL JOIN returns them
+        rows = []
+        for r in self._reminders.values():
+            text = self._task_text(r["user_id"], r["task_id"])
+            if text is not None:
+                rows.append(dict(r, task_text=text))
+        return rows
+
+    def get_all_reminders(self):
+        with self._lock:
+            return [{k: r[k] for k in ("user_id", "task_id", "time", "days_left", "task_text")}
+                    for r in self._joined()]
+
+    def iter_due_reminders(self, until, after=None, chunk_size=500, partitions=None, partition_count=1):
+        with self._lock:
+            rows = [r for r in self._joined()
+                    if r["next_fire_at"] <= until and (after is None or r["next_fire_at"] > after)]
+        if partitions is not None:
+            rows = [r for r in rows if user_partition(r["user_id"], partition_count) in partitions]
+        rows.sort(key=lambda r: (r["next_fire_at"], r["user_id"], r["id"]))
+        yield from due_chunks(rows, chunk_size)
+
+    def advance_reminders(self, reminder_ids, fired_at):
+        after = schedule.parse_utc(fired_at)
+        users = set()
+        with self._lock:
+            for rid in reminder_ids:
+                r = self._reminders.get(rid)
+                if r is None:
+                    continue
+                users.add(r["user_id"])
+                r["days_left"] -= 1
+                if r["days_left"] <= 0:
+                    del self._reminders[rid]
+                else:
+                    r["next_fire_at"] = schedule.next_fire_at(r["time"], self._timezones.get(r["user_id"]), after)
+                    r["last_fired_at"] = fired_at
+        return list(users)
+
+    def get_user_timezone(self, user_id):
+        with self._lock:
+            return self._timezones.get(user_id)
+
+    def set_user_timezone(self, user_id, timezone_name):
+        now = schedule.utcnow()
+        with self._lock:
+            self._timezones[user_id] = timezone_name
+            reminders = self._user_reminders(user_id)
+            for r in reminders:
+                r["next_fire_at"] = schedule.next_fire_at(r["time"], timezone_name, now)
+            return len(reminders)
+
+    def add_dead_letter(self, chat_id, text, error):
+        with self._lock:
+            self.dead_letters.append((chat_id, text, error, _now()))
+
+    def _archivable(self, task):
+        return task["done"] and not any(r["task_id"] == task["id"] for r in self._reminders.values())
+
+    def _move_to_archive(self, user_id, tasks):
+        for task in tasks:
+            self._archive.setdefault(user_id, []).append(
+                {"id": next(self._archive_ids), "task": task["task"], "done_at": task["done_at"]})
+        ids = {task["id"] for task in tasks}
+        self._tasks[user_id] = [t for t in self._tasks.get(user_id, []) if t["id"] not in ids]
+
+    def archive_tasks(self, user_id):
+        with self._lock:
+            tasks = sorted((t for t in self._tasks.get(user_id, []) if self._archivable(t)),
+                           key=lambda t: (t["done_at"], t["id"]))
+            self._move_to_archive(user_id, tasks)
+            return len(tasks)
+
+    def archive_done_tasks(self, done_before, limit=500):
+        with self._lock:
+            tasks = sorted(((user_id, t) for user_id, rows in self._tasks.items() for t in rows
+                            if self._archivable(t) and t["done_at"] <= done_before),
+                           key=lambda item: item[1]["done_at"])[:limit]
+            for user_id, task in tasks:
+                self._move_to_archive(user_id, [task])
+            return [user_id for user_id, _ in tasks]
+
+    def get_archive_page(self, user_id, cursor=None, backwards=False, limit=20):
+        with self._lock:
+            archive = self._archive.get(user_id, [])[::-1]  # newest first
+            if cursor is None:
+                index = len(archive) if backwards else 0
+            elif backwards:
+                index = sum(1 for t in archive if t["id"] > cursor)
+            else:
+                index = sum(1 for t in archive if t["id"] >= cursor)
+            first = max(0, index - limit) if backwards else index
+            rows = archive[first:index] if backwards else archive[first:first + limit]
+            if not rows:
+                return {"start": 1, "tasks": [], "has_prev": False, "has_next": False}
+            page = [{"task": t["task"], "done_at": t["done_at"], "cursor": t["id"]} for t in rows]
+            return {"start": first + 1, "tasks": page,
+                    "has_prev": first > 0, "has_next": first + len(rows) < len(archive)}
+
+    def compact_search_index(self, pages): # Search scans the titles directly
+        return False
+
+    def reclaim_space(self, pages): # Nothing on disk
+        return 0
+
+    def get_stats(self): # Counted on the spot; nothing here outgrows a throwaway run
+        with self._lock:
+            tasks = [rows for rows in self._tasks.values() if rows]
+            return {"users": len(tasks), "tasks": sum(map(len, tasks)),
+                    "done": sum(t["done"] for rows in tasks for t in rows), "reminders": len(self._reminders)}
+
+    def get_user_stats(self, user_id):
+        with self._lock:
+            tasks = self._tasks.get(user_id, [])
+            return {"tasks": len(tasks), "done": sum(t["done"] for t in tasks),
+                    "reminders": len(self._user_reminders(user_id))}
+
+    def check_stats(self): # No stored counts to drift
+        return 0
+
+    def renew_leases(self, worker_id, partition_count, ttl, busy=()):
+        with self._lock:
+            for p in range(partition_count):
+                if self._leases.get(p) is None:
+                    self._leases[p] = worker_id
+            return sorted(p for p, owner in self._leases.items() if owner == worker_id)
+
+    def release_leases(self, worker_id):
+        with self._lock:
+            for p, owner in self._leases.items():
+                if owner == worker_id:
+                    self._leases[p] = None
@@ -0,0 +1,125 @@
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from backends.base import Backend
+from backends.sqlite import SQLiteBackend
+
+# Per-user calls are forwarded unchanged to the shard that owns the user
+PER_USER = (
+    "get_user_tasks", "add_task", "add_tasks", "update_task_status", "update_task_text", "delete_task",
+    "clear_all_tasks", "has_tasks", "get_task_by_number", "complete_task_by_number",
+    "edit_task_by_number", "delete_task_by_number", "complete_tasks_by_number", "delete_tasks_by_number",
+    "get_task_page", "search_tasks", "get_user_reminders",
+    "add_reminder", "add_reminder_by_number", "update_reminder_days", "delete_reminder",
+    "delete_reminder_by_number", "clear_all_reminders", "get_user_timezone", "set_user_timezone", "add_dead_letter", "get_user_stats",
+    "archive_tasks", "get_archive_page",
+)
+
+
+def shard_paths(path, shards): # tasks.db -> tasks.0.db, tasks.1.db, ...
+    root, ext = os.path.splitext(path)
+    return [f"{root}.{i}{ext}" for i in range(shards)]
+
+
+class ShardedBackend(Backend): # Users spread over N SQLite files, each with its own write lock
+    def __init__(self, path, shards):
+        self.shards = shards
+        self.backends = [SQLiteBackend(p) for p in shard_paths(path, shards)]
+        self._executor = ThreadPoolExecutor(max_workers=shards, thread_name_prefix="db-shard")
+
+    def shard_of(self, user_id): # Stable across processes, unlike hash()
+        return zlib.crc32(str(user_id).encode()) % self.shards
+
+    def _each(self, method, *args): # Run a method on every shard in parallel, results in shard order
+        return list(self._executor.map(lambda backend: getattr(backend, method)(*args), self.backends))
+
+    # Reminder ids are only unique within a shard, so callers see local_id * shards + shard
+    def _global_id(self, shard, reminder_id):
+        return reminder_id * self.shards + shard
+
+    def _local_id(self, reminder_id):
+        return divmod(reminder_id, self.shards)  # (local id, shard)
+
+    def init(self):
+        self._each("init")
+
+    def close(self):
+        self._each("close")
+        self._executor.shutdown(wait=True)
+
+    def get_reminder_page(self, user_id, cursor=None, backwards=False, limit=20):
+        shard = self.shard_of(user_id)
+        if cursor is not None:
+            cursor = self._local_id(cursor)[0]
+        page = self.backends[shard].get_reminder_page(user_id, cursor, backwards, limit)
+        for rem in page["reminders"]:
+            rem["cursor"] = self._global_id(shard, rem["cursor"])
+        return page
+
+    def get_all_reminders(self):
+        return [rem for rows in self._each("get_all_reminders") for rem in rows]
+
+    def iter_due_reminders(self, until, after=None, chunk_size=500, partitions=None, partition_count=1):
+        # Pull the next chunk from every shard at once, so slow shards overlap. A user lives in
+        # one shard, so no chunk splits a user's fire time here either.
+        streams = {shard: backend.iter_due_reminders(until, after, chunk_size, partitions, partition_count)
+                   for shard, backend in enumerate(self.backends)}
+        try:
+            while streams:
+                pulls = {shard: self._executor.submit(next, stream, None) for shard, stream in streams.items()}
+                # Wait for every pull before yielding, so no stream is still running if the caller stops early
+                chunks = {shard: pull.result() for shard, pull in pulls.items()}
+                for shard, chunk in chunks.items():
+                    if chunk is None:
+                        del streams[shard]
+                        continue
+                    for rem in chunk:
+                        rem["id"] = self._global_id(shard, rem["id"])
+                    yield chunk
+        finally:
+            for stream in streams.values():
+                stream.close()
+
+    def advance_reminders(self, reminder_ids, fired_at):
+        by_shard = {}
+        for reminder_id in reminder_ids:
+            local, shard = self._local_id(reminder_id)
+            by_shard.setdefault(shard, []).append(local)
+        calls = [self._executor.submit(self.backends[shard].advance_reminders, ids, fired_at)
+                 for shard, ids in by_shard.items()]
+        return [user_id for call in calls for user_id in call.result()]
+
+    def get_stats(self):
+        stats = self._each("get_stats")
+        return {name: sum(shard[name] for shard in stats) for name in stats[0]}
+
+    def check_stats(self):
+        return sum(self._each("check_stats"))
+
+    def archive_done_tasks(self, done_before, limit=500): # Up to limit per shard
+        return [user_id for rows in self._each("archive_done_tasks", done_before, limit) for user_id in rows]
+
+    def compact_search_index(self, pages): # Up to pages per shard
+        return any(self._each("compact_search_index", pages))
+
+    def reclaim_space(self, pages): # Up to pages per shard
+        return sum(self._each("reclaim_space", pages))
+
+    # Leases coordinate the whole deployment, so they all live in the first shard
+    def renew_leases(self, worker_id, partition_count, ttl, busy=()):
+        return self.backends[0].renew_leases(worker_id, partition_count, ttl, busy)
+
+    def release_leases(self, worker_id):
+        self.backends[0].release_leases(worker_id)
+
+
+def _per_user(name):
+    def method(self, user_id, *args, **kwargs):
+        return getattr(self.backends[self.shard_of(user_id)], name)(user_id, *args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+for _name in PER_USER:
+    setattr(ShardedBackend, _name, _per_user(_name))
@@ -0,0 +1,506 @@
+import json
+import math
+import sqlite3
+import time
+
+import migrations
+import schedule
+from backends.base import Backend, due_chunks
+from pool import READER_COUNT, ConnectionPool
+
+
+# Marking a task done again keeps its first completion time, which archiving goes by
+_COMPLETE_TASK = "UPDATE tasks SET done = 1, done_at = ifnull(done_at, CURRENT_TIMESTAMP) WHERE id = ?"
+
+
+def _task_at(conn, user_id, number): # The number-th (1-based) task in creation order, or None
+    if number < 1:
+        return None
+    row = conn.execute("""SELECT id, task, done FROM tasks WHERE user_id = ?
+                          ORDER BY created_at, rowid LIMIT 1 OFFSET ?""", (user_id, number - 1)).fetchone()
+    return {"id": row[0], "task": row[1], "done": bool(row[2])} if row else None
+
+
+def _tasks_at(conn, user_id, numbers): # {number: task} for the numbers (1-based, creation order) that exist
+    if not numbers:
+        return {}
+    if len(numbers) == 1:
+        task = _task_at(conn, user_id, numbers[0])
+        return {numbers[0]: task} if task else {}
+    # One index range scan up to the highest number, instead of one OFFSET query per number
+    rows = conn.execute("""SELECT id, task, done FROM tasks WHERE user_id = ?
+                           ORDER BY created_at, rowid LIMIT ?""", (user_id, max(numbers))).fetchall()
+    return {n: {"id": rows[n - 1][0], "task": rows[n - 1][1], "done": bool(rows[n - 1][2])}
+            for n in sorted(numbers) if 1 <= n <= len(rows)}
+
+
+def _match_expression(user_id, query): # FTS5 query: the user's own tasks containing every word (as a prefix)
+    words = " ".join('"' + word.replace('"', '""') + '"*' for word in query.split())
+    # The words are held to the task column; user_id is indexed too and would match them
+    return f'user_id:"{user_id}" AND task:({words})'
+
+
+def _user_timezone(conn, user_id): # The user's /timezone, or None for the default
+    row = conn.execute("SELECT timezone FROM user_settings WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else None
+
+
+def _insert_reminder(conn, user_id, task_id, time_str, days):
+    next_fire_at = schedule.next_fire_at(time_str, _user_timezone(conn, user_id), schedule.utcnow())
+    conn.execute("INSERT INTO reminders (user_id, task_id, time, days_left, next_fire_at) VALUES (?, ?, ?, ?, ?)",
+                 (user_id, task_id, time_str, days, next_fire_at))
+
+
+def _move_to_archive(conn, task_ids): # Copy tasks to task_archive in the given order, then drop them from tasks
+    if not task_ids:
+        return
+    ids = json.dumps(task_ids)
+    conn.execute("""INSERT INTO task_archive (user_id, task, created_at, done_at)
+                    SELECT t.user_id, t.task, t.created_at, t.done_at
+                    FROM json_each(?) AS v JOIN tasks t ON t.id = v.value ORDER BY v.key""", (ids,))
+    conn.execute("DELETE FROM tasks WHERE id IN (SELECT value FROM json_each(?))", (ids,))
+
+
+class SQLiteBackend(Backend): # One SQLite file behind a pooled writer and readers
+    def __init__(self, path, readers=READER_COUNT):
+        self.path = path
+        self.pool = ConnectionPool(path, readers)
+
+    def init(self):
+        with self.pool.maintenance() as conn:
+            migrations.migrate(conn)
+            # Freed pages are handed back by reclaim_space() instead of piling up in the file. Turning
+            # this on for an existing file takes one VACUUM, so it can't be a migration step
+            while True:
+                # Read under the write lock, so a process starting alongside one that is converting
+                # the file waits for it and then finds nothing left to do
+                migrations.begin_immediate(conn)
+                mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+                conn.rollback()
+                if mode == 2:
+                    break
+                try:
+                    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                    conn.execute("VACUUM")
+                except sqlite3.OperationalError as exc:
+                    if not migrations.is_busy(exc):
+                        raise
+
+    def close(self):
+        self.pool.close()
+
+    def get_user_tasks(self, user_id):
+        with self.pool.read() as conn:
+            rows = conn.execute("SELECT id, task, done FROM tasks WHERE user_id = ? ORDER BY created_at, rowid",
+                                (user_id,)).fetchall()
+        return [{"id": row[0], "task": row[1], "done": bool(row[2])} for row in rows]
+
+    def add_task(self, user_id, task_text):
+        with self.pool.write() as conn:
+            return conn.execute("INSERT INTO tasks (user_id, task) VALUES (?, ?)", (user_id, task_text)).lastrowid
+
+    def add_tasks(self, user_id, task_texts):
+        with self.pool.write() as conn:
+            # One statement per row for its lastrowid; still a single transaction
+            return [conn.execute("INSERT INTO tasks (user_id, task) VALUES (?, ?)", (user_id, task_text)).lastrowid
+                    for task_text in task_texts]
+
+    def update_task_status(self, user_id, task_id, done=True):
+        with self.pool.write() as conn:
+            conn.execute("""UPDATE tasks SET done = ?, done_at = CASE WHEN ? THEN ifnull(done_at, CURRENT_TIMESTAMP) END
+                            WHERE user_id = ? AND id = ?""", (int(done), int(done), user_id, task_id))
+
+    def update_task_text(self, user_id, task_id, new_text):
+        with self.pool.write() as conn:
+            conn.execute("UPDATE tasks SET task = ? WHERE user_id = ? AND id = ?", (new_text, user_id, task_id))
+
+    def delete_task(self, user_id, task_id):
+        with self.pool.write() as conn:
+            conn.execute("DELETE FROM tasks WHERE user_id = ? AND id = ?", (user_id, task_id))
+
+    def clear_all_tasks(self, user_id):
+        with self.pool.write() as conn:
+            conn.execute("DELETE FROM tasks WHERE user_id = ?", (user_id,))
+
+    def has_tasks(self, user_id):
+        with self.pool.read() as conn:
+            return conn.execute("SELECT EXISTS (SELECT 1 FROM tasks WHERE user_id = ?)", (user_id,)).fetchone()[0] == 1
+
+    def get_task_by_number(self, user_id, number):
+        with self.pool.read() as conn:
+            return _task_at(conn, user_id, number)
+
+    def complete_task_by_number(self, user_id, number):
+        with self.pool.write() as conn:
+            task = _task_at(conn, user_id, number)
+            if task is not None:
+                conn.execute(_COMPLETE_TASK, (task["id"],))
+        return task
+
+    def edit_task_by_number(self, user_id, number, new_text):
+        with self.pool.write() as conn:
+            task = _task_at(conn, user_id, number)
+            if task is not None:
+                conn.execute("UPDATE tasks SET task = ? WHERE id = ?", (new_text, task["id"]))
+        return task
+
+    def delete_task_by_number(self, user_id, number):
+        with self.pool.write() as conn:
+            task = _task_at(conn, user_id, number)
+            if task is None:
+                return None
+            reminders = conn.execute("SELECT COUNT(*) FROM reminders WHERE task_id = ?", (task["id"],)).fetchone()[0]
+            conn.execute("DELETE FROM tasks WHERE id = ?", (task["id"],))
+        return task, reminders
+
+    def complete_tasks_by_number(self, user_id, numbers):
+        with self.pool.write() as conn:
+            tasks = _tasks_at(conn, user_id, numbers)
+            conn.executemany(_COMPLETE_TASK, [(task["id"],) for task in tasks.values()])
+        return tasks
+
+    def delete_tasks_by_number(self, user_id, numbers):
+        with self.pool.write() as conn:
+            tasks = _tasks_at(conn, user_id, numbers)
+            ids = [task["id"] for task in tasks.values()]
+            placeholders = ", ".join("?" * len(ids))
+            reminders = conn.execute(f"SELECT COUNT(*) FROM reminders WHERE task_id IN ({placeholders})",
+                                     ids).fetchone()[0] if ids else 0
+            # Their reminders go in the same transaction, through ON DELETE CASCADE
+            conn.executemany("DELETE FROM tasks WHERE id = ?", [(task_id,) for task_id in ids])
+        return tasks, reminders
+
+    def get_task_page(self, user_id, cursor=None, backwards=False, limit=20):
+        # cursor is the (created_at, rowid) of the task the page starts after (or before, going backwards)
+        where, params = "user_id = ?", [user_id]
+        if cursor is not None:
+            op = "<" if backwards else ">"
+            where += f" AND created_at {op}= ? AND (created_at {op} ? OR rowid {op} ?)"
+            params += [cursor[0], cursor[0], cursor[1]]
+        order = "DESC" if backwards else "ASC"
+
+        with self.pool.read() as conn:
+            rows = conn.execute(f"""SELECT rowid, created_at, id, task, done FROM tasks WHERE {where}
+                                    ORDER BY created_at {order}, rowid {order} LIMIT ?""",
+                                params + [limit + 1]).fetchall()
+            more = len(rows) > limit
+            rows = rows[:limit]
+            if backwards:
+                rows.reverse()
+            if not rows:
+                return {"start": 1, "tasks": [], "has_prev": False, "has_next": False}
+
+            # Number of the first task, counted on the index rather than carried in the button
+            first, last = rows[0], rows[-1]
+            start = conn.execute("""SELECT COUNT(*) FROM tasks WHERE user_id = ?
+                                    AND created_at <= ? AND (created_at < ? OR rowid < ?)""",
+                                 (user_id, first[1], first[1], first[0])).fetchone()[0] + 1
+            has_next = more if not backwards else conn.execute(
+                """SELECT EXISTS (SELECT 1 FROM tasks WHERE user_id = ?
+                                  AND created_at >= ? AND (created_at > ? OR rowid > ?))""",
+                (user_id, last[1], last[1], last[0])).fetchone()[0] == 1
+
+        tasks = [{"id": row[2], "task": row[3], "done": bool(row[4]), "cursor": (row[1], row[0])} for row in rows]
+        return {"start": start, "tasks": tasks, "has_prev": start > 1, "has_next": has_next}
+
+    def search_tasks(self, user_id, query, limit=20):
+        with self.pool.read() as conn:
+            # Ranked on the title only; the user_id column just narrows the postings walked
+            rows = conn.execute("""SELECT t.rowid, t.created_at, t.id, t.task, t.done
+                                   FROM tasks_fts f
+                                   JOIN tasks t ON t.rowid = f.rowid
+                                   WHERE tasks_fts MATCH ?
+                                   ORDER BY bm25(tasks_fts, 0.0, 1.0) LIMIT ?""",
+                                (_match_expression(user_id, query), limit)).fetchall()
+            # Numbered as /list shows them, so the results work with /done and /edit: one walk of
+            # the covering index up to the last hit rather than a COUNT per hit
+            numbers, wanted = {}, {row[0] for row in rows}
+            if wanted:
+                last = max((row[1], row[0]) for row in rows)
+                for number, (rowid,) in enumerate(conn.execute(
+                        """SELECT rowid FROM tasks WHERE user_id = ? AND created_at <= ?
+                           ORDER BY created_at, rowid""", (user_id, last[0])), 1):
+                    if rowid in wanted:
+                        numbers[rowid] = number
+                        if len(numbers) == len(wanted):
+                            break
+            return [{"number": numbers[row[0]], "id": row[2], "task": row[3], "done": bool(row[4])}
+                    for row in rows]
+
+    def get_user_reminders(self, user_id):
+        with self.pool.read() as conn:
+            rows = conn.execute("SELECT task_id, time, days_left FROM reminders WHERE user_id = ? ORDER BY id",
+                                (user_id,)).fetchall()
+        return [{"task_id": row[0], "time": row[1], "days_left": row[2]} for row in rows]
+
+    def get_reminder_page(self, user_id, cursor=None, backwards=False, limit=20):
+        # cursor is the reminder id the page starts after (or before, going backwards)
+        where, params = "r.user_id = ?", [user_id]
+        if cursor is not None:
+            where += " AND r.id < ?" if backwards else " AND r.id > ?"
+            params.append(cursor)
+        order = "DESC" if backwards else "ASC"
+
+        with self.pool.read() as conn:
+            rows = conn.execute(f"""SELECT r.id, r.task_id, r.time, r.days_left, t.task
+                                    FROM reminders r
+                                    LEFT JOIN tasks t ON t.id = r.task_id
+                                    WHERE {where} ORDER BY r.id {order} LIMIT ?""",
+                                params + [limit + 1]).fetchall()
+            more = len(rows) > limit
+            rows = rows[:limit]
+            if backwards:
+                rows.reverse()
+            if not rows:
+                return {"start": 1, "reminders": [], "has_prev": False, "has_next": False}
+
+            start = conn.execute("SELECT COUNT(*) FROM reminders WHERE user_id = ? AND id < ?",
+                                 (user_id, rows[0][0])).fetchone()[0] + 1
+            has_next = more if not backwards else conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM reminders WHERE user_id = ? AND id > ?)",
+                (user_id, rows[-1][0])).fetchone()[0] == 1
+
+        reminders = [{"task_id": row[1], "time": row[2], "days_left": row[3], "task_text": row[4],
+                      "cursor": row[0]} for row in rows]
+        return {"start": start, "reminders": reminders, "has_prev": start > 1, "has_next": has_next}
+
+    def add_reminder(self, user_id, task_id, time_str, days):
+        with self.pool.write() as conn:
+            _insert_reminder(conn, user_id, task_id, time_str, days)
+
+    def add_reminder_by_number(self, user_id, number, time_str, days):
+        with self.pool.write() as conn:
+            task = _task_at(conn, user_id, number)
+            if task is not None:
+                _insert_reminder(conn, user_id, task["id"], time_str, days)
+        return task
+
+    def update_reminder_days(self, user_id, task_id, time_str, new_days):
+        with self.pool.write() as conn:
+            conn.execute("UPDATE reminders SET days_left = ? WHERE user_id = ? AND task_id = ? AND time = ?",
+                         (new_days, user_id, task_id, time_str))
+
+    def delete_reminder(self, user_id, task_id, time_str):
+        with self.pool.write() as conn:
+            conn.execute("DELETE FROM reminders WHERE user_id = ? AND task_id = ? AND time = ?",
+                         (user_id, task_id, time_str))
+
+    def delete_reminder_by_number(self, user_id, number):
+        if number < 1:
+            return None
+        with self.pool.write() as conn:
+            row = conn.execute("""SELECT r.id, r.task_id, r.time, t.task
+                                  FROM reminders r
+                                  LEFT JOIN tasks t ON t.id = r.task_id
+                                  WHERE r.user_id = ? ORDER BY r.id LIMIT 1 OFFSET ?""",
+                               (user_id, number - 1)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM reminders WHERE id = ?", (row[0],))
+        return {"task_id": row[1], "time": row[2], "task_text": row[3]}
+
+    def clear_all_reminders(self, user_id):
+        with self.pool.write() as conn:
+            conn.execute("DELETE FROM reminders WHERE user_id = ?", (user_id,))
+
+    def get_all_reminders(self):
+        with self.pool.read() as conn:
+            rows = conn.execute("""SELECT r.user_id, r.task_id, r.time, r.days_left, t.task
+                                   FROM reminders r
+                                   JOIN tasks t ON r.task_id = t.id""").fetchall()
+        return [{"user_id": row[0], "task_id": row[1], "time": row[2],
+                 "days_left": row[3], "task_text": row[4]} for row in rows]
+
+    def iter_due_reminders(self, until, after=None, chunk_size=500, partitions=None, partition_count=1):
+        # One range scan on idx_reminders_due, already in (next_fire_at, user_id) order
+        where, params = "r.next_fire_at <= ?", [until]
+        if after is not None:
+            where += " AND r.next_fire_at > ?"
+            params.append(after)
+        if partitions is not None:
+            where += f" AND abs(CAST(r.user_id AS INTEGER)) % ? IN ({', '.join('?' * len(partitions))})"
+            params += [partition_count, *partitions]
+        with self.pool.read() as conn:
+            cursor = conn.execute(f"""SELECT r.id, r.user_id, r.task_id, r.time, r.days_left, t.task, r.next_fire_at
+                                      FROM reminders r
+                                      JOIN tasks t ON r.task_id = t.id
+                                      WHERE {where}
+                                      ORDER BY r.next_fire_at, r.user_id, r.id""", params)
+            yield from due_chunks(({"id": row[0], "user_id": row[1], "task_id": row[2], "time": row[3],
+                                    "days_left": row[4], "task_text": row[5], "next_fire_at": row[6]}
+                                   for row in cursor), chunk_size)
+
+    def advance_reminders(self, reminder_ids, fired_at):
+        after = schedule.parse_utc(fired_at)
+        placeholders = ", ".join("?" * len(reminder_ids))
+        with self.pool.write() as conn:
+            rows = conn.execute(f"""SELECT r.id, r.user_id, r.time, r.days_left, s.timezone
+                                    FROM reminders r
+                                    LEFT JOIN user_settings s ON s.user_id = r.user_id
+                                    WHERE r.id IN ({placeholders})""", list(reminder_ids)).fetchall()
+            finished = [row[0] for row in rows if row[3] <= 1]
+            # However late this send was (or however long the bot was down), the next one
+            # is the reminder's first HH:MM after now, and only one day is counted off
+            rescheduled = [[row[0], schedule.next_fire_at(row[2], row[4], after)] for row in rows if row[3] > 1]
+            # One statement each for the whole batch, the ids (and new fire times) passed as JSON
+            conn.execute("DELETE FROM reminders WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(finished),))
+            conn.execute("""UPDATE reminders SET days_left = days_left - 1,
+                                next_fire_at = json_extract(v.value, '$[1]'), last_fired_at = ?
+                            FROM json_each(?) AS v WHERE reminders.id = json_extract(v.value, '$[0]')""",
+                         (fired_at, json.dumps(rescheduled)))
+        return list({row[1] for row in rows})
+
+    def add_dead_letter(self, chat_id, text, error):
+        with self.pool.write() as conn:
+            conn.execute("INSERT INTO dead_letters (chat_id, text, error) VALUES (?, ?, ?)", (chat_id, text, error))
+
+    def get_user_timezone(self, user_id):
+        with self.pool.read() as conn:
+            return _user_timezone(conn, user_id)
+
+    def set_user_timezone(self, user_id, timezone_name):
+        now = schedule.utcnow()
+        with self.pool.write() as conn:
+            conn.execute("""INSERT INTO user_settings (user_id, timezone) VALUES (?, ?)
+                            ON CONFLICT (user_id) DO UPDATE SET timezone = excluded.timezone""",
+                         (user_id, timezone_name))
+            # Same wall-clock times, new instants
+            rows = conn.execute("SELECT id, time FROM reminders WHERE user_id = ?", (user_id,)).fetchall()
+            conn.executemany("UPDATE reminders SET next_fire_at = ? WHERE id = ?",
+                             [(schedule.next_fire_at(hhmm, timezone_name, now), reminder_id)
+                              for reminder_id, hhmm in rows])
+        return len(rows)
+
+    def archive_tasks(self, user_id):
+        with self.pool.write() as conn:
+            ids = [row[0] for row in conn.execute(
+                """SELECT id FROM tasks WHERE user_id = ? AND done
+                   AND NOT EXISTS (SELECT 1 FROM reminders WHERE task_id = tasks.id)
+                   ORDER BY done_at, id""", (user_id,))]
+            _move_to_archive(conn, ids)
+        return len(ids)
+
+    def archive_done_tasks(self, done_before, limit=500):
+        with self.pool.write() as conn:
+            rows = conn.execute("""SELECT id, user_id FROM tasks WHERE done AND done_at <= ?
+                                   AND NOT EXISTS (SELECT 1 FROM reminders WHERE task_id = tasks.id)
+                                   ORDER BY done_at LIMIT ?""", (done_before, limit)).fetchall()
+            _move_to_archive(conn, [row[0] for row in rows])
+        return [row[1] for row in rows]
+
+    def get_archive_page(self, user_id, cursor=None, backwards=False, limit=20):
+        # Newest first: "next" goes to older entries (smaller ids), backwards to newer ones
+        where, params = "user_id = ?", [user_id]
+        if cursor is not None:
+            where += " AND id > ?" if backwards else " AND id < ?"
+            params.append(cursor)
+        order = "ASC" if backwards else "DESC"
+
+        with self.pool.read() as conn:
+            rows = conn.execute(f"""SELECT id, task, done_at FROM task_archive
+                                    WHERE {where} ORDER BY id {order} LIMIT ?""", params + [limit + 1]).fetchall()
+            more = len(rows) > limit
+            rows = rows[:limit]
+            if backwards:
+                rows.reverse()
+            if not rows:
+                return {"start": 1, "tasks": [], "has_prev": False, "has_next": False}
+
+            start = conn.execute("SELECT COUNT(*) FROM task_archive WHERE user_id = ? AND id > ?",
+                                 (user_id, rows[0][0])).fetchone()[0] + 1
+            has_next = more if not backwards else conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM task_archive WHERE user_id = ? AND id < ?)",
+                (user_id, rows[-1][0])).fetchone()[0] == 1
+
+        tasks = [{"task": row[1], "done_at": row[2], "cursor": row[0]} for row in rows]
+        return {"start": start, "tasks": tasks, "has_prev": start > 1, "has_next": has_next}
+
+    def compact_search_index(self, pages):
+        with self.pool.write() as conn:
+            # Deleting a task only adds a tombstone to tasks_fts; merging segments drops both. A
+            # negative count merges whatever segments there are, not only full levels. FTS5 writes
+            # at most one row when it found nothing to merge
+            before = conn.total_changes
+            conn.execute("INSERT INTO tasks_fts (tasks_fts, rank) VALUES ('merge', ?)", (-pages,))
+            return conn.total_changes - before > 1
+
+    def reclaim_space(self, pages):
+        with self.pool.write() as conn:
+            free = min(pages, conn.execute("PRAGMA freelist_count").fetchone()[0])
+            # The pragma frees one page per step, and sqlite3 steps a statement without result
+            # columns only once, so it runs once per page (executescript would commit a group)
+            for _ in range(free):
+                conn.execute("PRAGMA incremental_vacuum(1)")
+        return free
+
+    def get_stats(self):
+        with self.pool.read() as conn:
+            row = conn.execute("SELECT users, tasks, done, reminders FROM stats").fetchone() or (0, 0, 0, 0)
+        return dict(zip(("users", "tasks", "done", "reminders"), row))
+
+    def get_user_stats(self, user_id):
+        with self.pool.read() as conn:
+            row = conn.execute("SELECT tasks, done, reminders FROM user_stats WHERE user_id = ?",
+                               (user_id,)).fetchone() or (0, 0, 0)
+        return dict(zip(("tasks", "done", "reminders"), row))
+
+    def check_stats(self):
+        # Compared on a read snapshot, so writers only wait if there is something to repair
+        with self.pool.read() as conn:
+            drifted = conn.execute(f"""
+                WITH fresh AS ({migrations.FRESH_USER_STATS}),
+                     stored AS (SELECT user_id, tasks, done, reminders FROM user_stats
+                                WHERE tasks != 0 OR done != 0 OR reminders != 0)
+                SELECT (SELECT COUNT(*) FROM (SELECT user_id FROM (SELECT * FROM fresh EXCEPT SELECT * FROM stored)
+                                              UNION
+                                              SELECT user_id FROM (SELECT * FROM stored EXCEPT SELECT * FROM fresh)))
+                     + NOT EXISTS (SELECT 1 FROM stats s, (SELECT COUNT(*) FILTER (WHERE tasks > 0) AS users,
+                                                                  ifnull(SUM(tasks), 0) AS tasks,
+                                                                  ifnull(SUM(done), 0) AS done,
+                                                                  ifnull(SUM(reminders), 0) AS reminders
+                                                           FROM fresh) f
+                                   WHERE s.users = f.users AND s.tasks = f.tasks AND s.done = f.done
+                                     AND s.reminders = f.reminders)""").fetchone()[0]
+        if drifted:
+            with self.pool.write() as conn:
+                migrations.rebuild_stats(conn)
+        return drifted
+
+    def renew_leases(self, worker_id, partition_count, ttl, busy=()):
+        now = time.time()
+        with self.pool.write() as conn:
+            # The write transaction serializes this whole exchange across processes
+            conn.execute("""INSERT INTO lease_workers (worker, heartbeat_at) VALUES (?, ?)
+                            ON CONFLICT (worker) DO UPDATE SET heartbeat_at = excluded.heartbeat_at""",
+                         (worker_id, now))
+            conn.execute("DELETE FROM lease_workers WHERE heartbeat_at < ?", (now - ttl,))
+            workers = conn.execute("SELECT COUNT(*) FROM lease_workers").fetchone()[0]
+            share = math.ceil(partition_count / workers)
+
+            conn.executemany("INSERT OR IGNORE INTO leases (partition) VALUES (?)",
+                             [(p,) for p in range(partition_count)])
+            conn.execute("UPDATE leases SET expires_at = ? WHERE owner = ?", (now + ttl, worker_id))
+            owned = [row[0] for row in conn.execute(
+                "SELECT partition FROM leases WHERE owner = ? AND partition < ? ORDER BY partition",
+                (worker_id, partition_count))]
+
+            if len(owned) > share:
+                # Give back the surplus so newly joined workers can pick it up, but never mid-dispatch
+                surplus = [p for p in reversed(owned) if p not in busy][:len(owned) - share]
+                conn.executemany("UPDATE leases SET owner = NULL, expires_at = 0 WHERE partition = ?",
+                                 [(p,) for p in surplus])
+            elif len(owned) < share:
+                free = [row[0] for row in conn.execute(
+                    """SELECT partition FROM leases WHERE partition < ? AND (owner IS NULL OR expires_at < ?)
+                       ORDER BY partition LIMIT ?""", (partition_count, now, share - len(owned)))]
+                conn.executemany("UPDATE leases SET owner = ?, expires_at = ? WHERE partition = ?",
+                                 [(worker_id, now + ttl, p) for p in free])
+
+            rows = conn.execute("SELECT partition FROM leases WHERE owner = ? AND partition < ? ORDER BY partition",
+                                (worker_id, partition_count)).fetchall()
+        return [partition for (partition,) in rows]
+
+    def release_leases(self, worker_id):
+        with self.pool.write() as conn:
+            conn.execute("UPDATE leases SET owner = NULL, expires_at = 0 WHERE owner = ?", (worker_id,))
+            conn.execute("DELETE FROM lease_workers WHERE worker = ?", (worker_id,))
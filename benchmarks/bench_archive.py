@@ -0,0 +1,93 @@
+# Hot working set and file size before and after archiving old done tasks.
+#
+#   python -m benchmarks.bench_archive [--users 2000] [--tasks-per-user 500] [--done 0.9] [--sample 200]
+#
+# Seeds --users users with --tasks-per-user tasks each, a --done share of them
+# completed 60 days ago, then measures the per-user reads and the ordinal
+# write that every /list, /done and /remove pays for, plus the size of the tasks
+# table, its indexes and the search index. One Archiver round (30-day cutoff)
+# then moves the old done tasks to task_archive and hands the freed pages back;
+# the same numbers are taken again. Reads go straight to the backend, so the
+# per-user cache does not hide the difference.
+import argparse
+import asyncio
+import os
+import random
+import time
+
+import async_db
+import db
+from archive import Archiver
+from benchmarks.common import report, temp_db
+
+HOT = ["tasks", "idx_tasks_user_created", "idx_tasks_done_at", "tasks_fts_data", "task_archive"]
+DONE_AT = "2000-01-01 00:00:00"
+
+
+def seed(users, per_user, done_share, rng):
+    with db.get_pool().write() as conn:
+        conn.executemany("INSERT INTO tasks (user_id, task, done, done_at) VALUES (?, ?, ?, ?)",
+                         ((str(i % users), f"task {i} for the weekly review", done, DONE_AT if done else None)
+                          for i in range(users * per_user) for done in [rng.random() < done_share]))
+
+
+def sizes(): # MB per object and the whole file, checkpointed so the file size is current
+    with db.get_pool().write() as conn:
+        conn.commit()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        pages = dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+    return [pages.get(name, 0) for name in HOT] + [free, os.path.getsize(db.DB_FILE)]
+
+
+def per_user_ms(fn, user_ids): # Average milliseconds of fn(user_id)
+    start = time.perf_counter()
+    for user_id in user_ids:
+        fn(user_id)
+    return (time.perf_counter() - start) * 1000 / len(user_ids)
+
+
+def timings(user_ids):
+    backend = db.get_backend()
+    last = {user_id: len(backend.get_user_tasks(user_id)) for user_id in user_ids}
+    return [
+        per_user_ms(backend.get_user_tasks, user_ids),
+        per_user_ms(lambda user_id: backend.get_task_page(user_id, limit=20), user_ids),
+        per_user_ms(lambda user_id: backend.edit_task_by_number(user_id, last[user_id], "renamed"), user_ids),
+        sum(last.values()) / len(last),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--tasks-per-user", type=int, default=500)
+    parser.add_argument("--done", type=float, default=0.9)
+    parser.add_argument("--sample", type=int, default=200)
+    args = parser.parse_args()
+    rng = random.Random(24)
+    sample = [str(u) for u in rng.sample(range(args.users), args.sample)]
+
+    with temp_db():
+        seed(args.users, args.tasks_per_user, args.done, rng)
+        before_sizes, before_times = sizes(), timings(sample)
+        start = time.perf_counter()
+        archived, reclaimed = asyncio.run(Archiver(after_days=30).run())
+        archive_s = time.perf_counter() - start
+        after_sizes, after_times = sizes(), timings(sample)
+        assert db.check_stats() == 0
+    async_db.close()
+
+    mb = lambda size: f"{size / 1e6:.1f}"
+    rows = [(name, mb(old), mb(new)) for name, old, new in zip(HOT + ["free pages", "whole file"],
+                                                               before_sizes, after_sizes)]
+    report(f"MB, {args.users * args.tasks_per_user:,} tasks ({archived:,} archived and {reclaimed:,} pages "
+           f"reclaimed in {archive_s:.1f}s)", ["before", "after"], rows)
+    names = ["get_user_tasks", "/list first page", "/edit last task", "tasks per user"]
+    rows = [(name, f"{old:.2f} ms" if i < 3 else f"{old:.0f}", f"{new:.2f} ms" if i < 3 else f"{new:.0f}")
+            for i, (name, old, new) in enumerate(zip(names, before_times, after_times))]
+    report(f"per user, average of {args.sample}", ["before", "after"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# Per-user task cache: hit rate, speedup and a staleness check.
+#
+#   python -m benchmarks.bench_cache [--users 200] [--ops 20000] [--threads 4] [--shared-users 4] [--gap 0.001]
+#
+# Runs a random mix of list/add/done/edit/delete/reminder operations from several
+# threads, with the cache disabled and then enabled. With the cache on, every
+# read is compared against a direct query, so any stale ordinal fails the run.
+# A second check has one writer thread (as async_db runs a shard's writes) and
+# --threads reader threads share a few users, with every cache patch held back
+# --gap seconds after its commit so reads keep landing in between, and the
+# writer evicting the user now and then; once they stop, each cached list must
+# match the database.
+import argparse
+import random
+import threading
+import time
+
+import cache
+import db
+from benchmarks.common import report, temp_db
+
+
+def fresh_tasks(user_id): # Bypass the cache
+    with db.get_pool().read() as conn:
+        rows = conn.execute("SELECT id, task, done FROM tasks WHERE user_id = ? ORDER BY created_at, rowid",
+                            (user_id,)).fetchall()
+    return [{"id": r[0], "task": r[1], "done": bool(r[2])} for r in rows]
+
+
+def fresh_reminders(user_id):
+    with db.get_pool().read() as conn:
+        rows = conn.execute("SELECT task_id, time, days_left FROM reminders WHERE user_id = ? ORDER BY id",
+                            (user_id,)).fetchall()
+    return [{"task_id": r[0], "time": r[1], "days_left": r[2]} for r in rows]
+
+
+def worker(worker_id, users, ops, check, errors):
+    rng = random.Random(worker_id)
+    # Each thread owns a disjoint set of users, so a read-after-write must see the write
+    owned = [str(u) for u in range(worker_id, users, 4)]
+    for i in range(ops):
+        user_id = rng.choice(owned)
+        tasks = db.get_user_tasks(user_id)
+        if check and tasks != fresh_tasks(user_id):
+            errors.append(("tasks", user_id, i))
+        roll = rng.random()
+        if roll < 0.6 or not tasks:
+            if roll < 0.1 or not tasks:
+                db.add_task(user_id, f"task {i}")
+            reminders = db.get_user_reminders(user_id)
+            if check and reminders != fresh_reminders(user_id):
+                errors.append(("reminders", user_id, i))
+            continue
+        task = rng.choice(tasks)
+        if roll < 0.75:
+            db.update_task_status(user_id, task["id"], done=not task["done"])
+        elif roll < 0.85:
+            db.update_task_text(user_id, task["id"], f"edited {i}")
+        elif roll < 0.93:
+            db.add_reminder(user_id, task["id"], f"{i % 24:02d}:00", 3)
+        elif roll < 0.97:
+            db.update_reminder_days(user_id, task["id"], f"{i % 24:02d}:00", 2)
+        else:
+            db.delete_task(user_id, task["id"])
+
+
+def run(users, ops, threads, max_rows, check):
+    with temp_db():
+        db.cache.max_rows = max_rows
+        errors = []
+        pool = [threading.Thread(target=worker, args=(w, users, ops // threads, check, errors))
+                for w in range(threads)]
+        start = time.perf_counter()
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - start
+        stats = db.cache.stats()
+    db.cache.max_rows = cache.MAX_ROWS
+    return ops / elapsed, stats, errors
+
+
+def shared_writer(users, ops):
+    rng = random.Random(8)
+    for i in range(ops):
+        user_id = str(rng.randrange(users))
+        tasks = db.get_user_tasks(user_id)
+        if rng.random() < 0.3: # As if evicted, so readers race to cache it again around the write
+            db.cache.invalidate(("tasks", user_id))
+            db.cache.invalidate(("reminders", user_id))
+        roll = rng.random()
+        if roll < 0.5 or not tasks:
+            db.add_task(user_id, f"shared {i}")
+        elif roll < 0.7:
+            db.add_reminder(user_id, rng.choice(tasks)["id"], f"{i % 24:02d}:00", 3)
+        elif roll < 0.9:
+            db.update_task_status(user_id, rng.choice(tasks)["id"], done=True)
+        else:
+            db.delete_task(user_id, rng.choice(tasks)["id"])
+
+
+def shared_reader(users, stop):
+    rng = random.Random()
+    while not stop.is_set():
+        user_id = str(rng.randrange(users))
+        db.get_user_tasks(user_id)
+        db.get_user_reminders(user_id)
+
+
+def run_shared(users, ops, threads, gap): # Stale users left in the cache after readers and writers shared them
+    patch = db.cache.patch
+
+    def late_patch(*args): # Widen the window between a commit and its patch
+        time.sleep(gap)
+        patch(*args)
+
+    with temp_db():
+        db.cache.patch = late_patch
+        stop = threading.Event()
+        writer = threading.Thread(target=shared_writer, args=(users, ops))
+        readers = [threading.Thread(target=shared_reader, args=(users, stop)) for _ in range(threads)]
+        try:
+            for t in [writer] + readers:
+                t.start()
+            writer.join()
+        finally:
+            stop.set()
+            for t in readers:
+                t.join()
+            del db.cache.patch
+        return [user_id for user_id in map(str, range(users))
+                if db.get_user_tasks(user_id) != fresh_tasks(user_id)
+                or db.get_user_reminders(user_id) != fresh_reminders(user_id)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--shared-users", type=int, default=4)
+    parser.add_argument("--gap", type=float, default=0.001)
+    args = parser.parse_args()
+
+    rows = []
+    for name, max_rows in (("no cache", 0), ("cache", cache.MAX_ROWS)):
+        ops_s, stats, _ = run(args.users, args.ops, args.threads, max_rows, check=False)
+        lookups = stats["hits"] + stats["misses"]
+        rows.append((name, ops_s, f"{stats['hits'] / lookups:.0%}" if lookups else "-"))
+    report("mixed workload", ["ops/sec", "hit rate"], rows)
+
+    _, stats, errors = run(args.users, args.ops, args.threads, cache.MAX_ROWS, check=True)
+    print(f"\n  staleness check: {len(errors)} stale read(s), cache {stats}")
+    if errors:
+        raise SystemExit(f"stale reads: {errors[:5]}")
+
+    stale = run_shared(args.shared_users, args.ops // 10, args.threads, args.gap)
+    print(f"  shared users check: {len(stale)} of {args.shared_users} user(s) stale in the cache")
+    if stale:
+        raise SystemExit(f"stale cached users: {stale}")
+
+
+if __name__ == "__main__":
+    main()
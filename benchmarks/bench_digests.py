@@ -0,0 +1,91 @@
+# Bot API calls for one busy reminder minute, per reminder against per-user digests.
+#
+#   python -m benchmarks.bench_digests [--users 2000] [--per-user 1 3 10]
+#
+# Seeds --users users with --per-user reminders each, all firing at the same
+# minute, and runs one dispatch through a real Outbox (unthrottled) into a
+# RecordingBot that counts sendMessage calls. "per reminder" is the previous
+# delivery, one message per reminder; "digest" is the current one. Both must
+# count a day off every reminder, which is checked afterwards. The drain column
+# is how long those calls take at the outbox's GLOBAL_RATE.
+import argparse
+import asyncio
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from functools import partial
+
+import async_db
+import db
+import schedule
+from benchmarks.common import report, temp_db
+from benchmarks.synthetic import RecordingBot
+from dispatcher import ReminderDispatcher, record_lag, reminder_text
+from outbox import GLOBAL_RATE, Outbox
+
+FIRE_AT = "2030-01-01 09:00:00"
+
+
+class PerReminderDispatcher(ReminderDispatcher): # Delivery as it was before digests
+    async def _deliver(self, due, fired_at):
+        sends = []
+        for rem in due:
+            future = self.outbox.send(rem["user_id"], reminder_text(rem))
+            future.add_done_callback(partial(record_lag, schedule.parse_utc(rem["next_fire_at"]).timestamp()))
+            sends.append(future)
+        results = await asyncio.gather(*sends, return_exceptions=True)
+        finished = [rem["id"] for rem, result in zip(due, results) if isinstance(result, bool)]
+        if finished:
+            await async_db.advance_reminders(finished, fired_at)
+
+
+def seed(users, per_user):
+    with db.get_pool().write() as conn:
+        for u in range(users):
+            for i in range(per_user):
+                task_id = conn.execute("INSERT INTO tasks (user_id, task) VALUES (?, ?)",
+                                       (str(u + 1), f"task {i} of user {u + 1}")).lastrowid
+                conn.execute("""INSERT INTO reminders (user_id, task_id, time, days_left, next_fire_at)
+                                VALUES (?, ?, '09:00', 7, ?)""", (str(u + 1), task_id, FIRE_AT))
+
+
+async def dispatch(dispatcher_class): # (sendMessage calls, most calls to one chat, seconds)
+    bot = RecordingBot()
+    outbox = Outbox(bot, rate=1_000_000, per_chat_interval=0)
+    outbox.start()
+    dispatcher = dispatcher_class(clock=lambda: datetime(2030, 1, 1, 9, 0, 30, tzinfo=timezone.utc))
+    dispatcher.outbox = outbox
+    start = time.perf_counter()
+    deliveries = await dispatcher._dispatch(None, schedule.format_utc(dispatcher.clock()))
+    await asyncio.gather(*deliveries)
+    elapsed = time.perf_counter() - start
+    await outbox.close()
+    chats = Counter(kwargs["chat_id"] for method, kwargs in bot.calls if method == "sendMessage")
+    return sum(chats.values()), max(chats.values()), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--per-user", type=int, nargs="+", default=[1, 3, 10])
+    args = parser.parse_args()
+
+    rows = []
+    for per_user in args.per_user:
+        for label, dispatcher_class in (("per reminder", PerReminderDispatcher), ("digest", ReminderDispatcher)):
+            with temp_db():
+                seed(args.users, per_user)
+                calls, most, elapsed = asyncio.run(dispatch(dispatcher_class))
+                with db.get_pool().read() as conn:
+                    advanced = conn.execute("SELECT COUNT(*) FROM reminders WHERE days_left = 6").fetchone()[0]
+            assert advanced == args.users * per_user, (label, advanced)
+            rows.append((f"{per_user}/user, {label}", args.users * per_user, calls, most,
+                         f"{elapsed:.2f}s", f"{calls / GLOBAL_RATE:.0f}s"))
+    async_db.close()
+
+    report(f"one minute's reminders for {args.users:,} users",
+           ["reminders", "sendMessage", "max per chat", "dispatch", f"drain @{GLOBAL_RATE}/s"], rows)
+
+
+if __name__ == "__main__":
+    main()
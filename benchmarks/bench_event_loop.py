@@ -0,0 +1,88 @@
+# Event-loop latency while the database writer is saturated.
+#
+#   python -m benchmarks.bench_event_loop [--writes 5000] [--concurrency 50] [--max-extra-ms 5]
+#
+# A ticker coroutine sleeps 1 ms in a loop and records how late it wakes up.
+# "blocking" issues the writes with the synchronous db.* calls from coroutines
+# (what the handlers used to do); "async_db" awaits the queued writer instead.
+# With async_db the ticker lag should stay flat even though the writer is busy:
+# the run fails if its p99 is more than --max-extra-ms above the idle p99.
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+import async_db
+import db
+from benchmarks.common import report, temp_db
+
+TICK = 0.001
+
+
+async def ticker(lags, stop): # Record how late each 1 ms sleep wakes up
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def blocking_writer(worker, writes):
+    for i in range(writes):
+        db.add_task(str(worker), "bench")
+        await asyncio.sleep(0)
+
+
+async def async_writer(worker, writes):
+    for i in range(writes):
+        await async_db.add_task(str(worker), "bench")
+
+
+async def run(writer, writes, concurrency): # Return (sorted lags, elapsed seconds)
+    lags, stop = [], asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(writer(w, writes // concurrency) for w in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick
+    return sorted(lags), elapsed
+
+
+def summarize(lags): # p50 / p99 / max lag in microseconds
+    ms = [lag * 1e6 for lag in lags] or [0]
+    p99 = ms[min(len(ms) - 1, int(len(ms) * 0.99))]
+    return statistics.median(ms), p99, ms[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writes", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--synchronous", default="FULL", help="writer PRAGMA synchronous (FULL = fsync per commit)")
+    parser.add_argument("--max-extra-ms", type=float, default=5.0,
+                        help="allowed async_db p99 lag above the idle p99")
+    args = parser.parse_args()
+
+    rows = []
+    with temp_db():
+        with db.get_pool().write() as conn:
+            conn.execute(f"PRAGMA synchronous = {args.synchronous}")
+        idle, _ = asyncio.run(run(lambda w, n: asyncio.sleep(0.5), 0, 1))
+        rows.append(("idle", *summarize(idle), len(idle), 0))
+        for name, writer in (("blocking", blocking_writer), ("async_db", async_writer)):
+            lags, elapsed = asyncio.run(run(writer, args.writes, args.concurrency))
+            rows.append((name, *summarize(lags), len(lags), args.writes / elapsed))
+        async_db.close()
+
+    report("event-loop lag (µs) while writing", ["p50", "p99", "max", "ticks", "writes/sec"], rows)
+
+    extra_ms = (rows[2][2] - rows[0][2]) / 1000
+    if extra_ms > args.max_extra_ms:
+        print(f"\n  async_db p99 lag is {extra_ms:.2f} ms above idle, over the {args.max_extra_ms:g} ms allowed")
+        sys.exit(1)
+    print(f"\n  async_db p99 lag is {extra_ms:.2f} ms above idle, within {args.max_extra_ms:g} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Write throughput and commit latency with and without group commit.
+#
+#   python -m benchmarks.bench_group_commit [--delays off 0 1 2 5] [--ops 100] [--users 1000]
+#                                           [--writes 20000] [--concurrency 200] [--synchronous NORMAL]
+#
+# Each run issues --writes mutations through async_db from --concurrency
+# coroutines (a task insert followed by marking it done, like /add then
+# /done), first with every write in its own transaction ("off"), then with
+# DB_GROUP_COMMIT_MS set to each delay and DB_GROUP_COMMIT_OPS to --ops.
+# Latency is the time a caller waits for its write to be committed.
+import argparse
+import asyncio
+import statistics
+import time
+
+import async_db
+import db
+import metrics
+from benchmarks.bench_shards import set_synchronous
+from benchmarks.common import report, temp_db
+
+
+async def writer(worker, users, writes, latencies):
+    for i in range(writes // 2):
+        user_id = str((worker * 7919 + i) % users)
+        start = time.perf_counter()
+        task_id = await async_db.add_task(user_id, "bench")
+        latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        await async_db.update_task_status(user_id, task_id, True)
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(users, writes, concurrency): # (elapsed seconds, per-write latencies)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(writer(w, users, writes // concurrency, latencies) for w in range(concurrency)))
+    return time.perf_counter() - start, latencies
+
+
+def mean_group_size(): # Average writes per group commit so far, from the metrics histogram
+    series = metrics.db_group_commit_writes._series.get(None)
+    return series[1] / sum(series[0]) if series else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--delays", nargs="+", default=["off", "0", "1", "2", "5"],
+                        help="DB_GROUP_COMMIT_MS values to try ('off' disables group commit)")
+    parser.add_argument("--ops", type=int, default=100, help="DB_GROUP_COMMIT_OPS")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--writes", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--synchronous", default="NORMAL", help="writer PRAGMA synchronous (FULL = fsync per commit)")
+    args = parser.parse_args()
+
+    async_db.GROUP_COMMIT_OPS = args.ops
+    rows, baseline = [], None
+    for delay in args.delays:
+        async_db.GROUP_COMMIT_MS = None if delay == "off" else float(delay)
+        metrics.db_group_commit_writes._series.clear()
+        with temp_db():
+            set_synchronous(args.synchronous)
+            elapsed, latencies = asyncio.run(run(args.users, args.writes, args.concurrency))
+            assert db.get_stats()["tasks"] == len(latencies) // 2
+        rate = len(latencies) / elapsed
+        baseline = baseline or rate
+        latencies.sort()
+        rows.append((f"{delay} ms" if delay != "off" else "off", rate, f"{rate / baseline:.2f}x",
+                     f"{mean_group_size():.1f}", f"{statistics.median(latencies) * 1000:.2f}",
+                     f"{latencies[int(len(latencies) * 0.95)] * 1000:.2f}"))
+    async_db.close()
+
+    report(f"writes/sec and commit latency, group of up to {args.ops}, synchronous={args.synchronous}",
+           ["writes/sec", "speedup", "writes/commit", "p50 ms", "p95 ms"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# In-process load test of the bot.py handlers against a temporary tasks.db.
+#
+#   python -m benchmarks.bench_handlers [--users 200] [--tasks 30] [--concurrency 50]
+#                                       [--bot-latency 0] [--output results.json]
+#                                       [--compare baseline.json] [--threshold 0.5]
+#
+# Every simulated user runs the same script in order: /add each task, /list and
+# the "next" page button, /reminder on a few tasks, /done half of them, /remove
+# the last quarter, then the "clear all reminders" button. Up to --concurrency
+# users run at once. Latency is recorded per handler and per db.* function (time
+# spent on the database thread, without queueing). --output writes the numbers as
+# JSON so runs on different commits can be diffed; --compare fails the run when
+# any p95 is more than --threshold slower than the baseline file.
+import argparse
+import asyncio
+import inspect
+import json
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import async_db
+import bot
+import db
+from benchmarks.common import report, temp_db
+from benchmarks.synthetic import RecordingBot, callback, command
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def summarize(samples, elapsed): # count, calls/sec and latency percentiles in ms
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "per_sec": len(ordered) / elapsed,
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p95_ms": percentile(ordered, 0.95) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+    }
+
+
+def timed(func, samples): # Wrap a db.* function so each call's duration lands in samples
+    def call(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+    return call
+
+
+def instrument(db_samples): # Re-point every async_db wrapper at a timed copy of its db function
+    factories = (async_db._read, async_db._stream, async_db._write)
+    originals = {}
+    for name, wrapper in list(vars(async_db).items()):
+        func = getattr(wrapper, "__wrapped__", None)
+        if func is None or getattr(db, name, None) is not func:
+            continue
+        samples = db_samples.setdefault(name, [])
+        if inspect.isgeneratorfunction(func):
+            target = func  # chunks are pulled lazily; the stream itself is not timed
+        else:
+            target = timed(func, samples)
+        # Same factory as the original, recognised by its inner code object
+        factory = next(f for f in factories if f(func).__code__ is wrapper.__code__)
+        originals[name] = wrapper
+        setattr(async_db, name, factory(target))
+    return originals
+
+
+async def run_user(user_id, args, telegram, handler_samples):
+    async def call(handler, update_context):
+        start = time.perf_counter()
+        await handler(*update_context)
+        handler_samples.setdefault(handler.__name__, []).append(time.perf_counter() - start)
+
+    for i in range(args.tasks):
+        await call(bot.add_task, command(telegram, user_id, f"/add benchmark task {i} for user {user_id}"))
+
+    await call(bot.list_tasks, command(telegram, user_id, "/list"))
+    for data in telegram.buttons(user_id):
+        if data.startswith("tasks:next:"):
+            await call(bot.button_callback, callback(telegram, user_id, data))
+
+    for number in range(1, min(args.tasks, args.reminders) + 1):
+        await call(bot.reminder, command(telegram, user_id, f"/reminder {number} {9 + number % 12:02d}:30 3"))
+    for number in range(1, args.tasks // 2 + 1):
+        await call(bot.done_task, command(telegram, user_id, f"/done {number}"))
+    for number in range(args.tasks, args.tasks - args.tasks // 4, -1):
+        await call(bot.remove_task, command(telegram, user_id, f"/remove {number}"))
+
+    await call(bot.button_callback, callback(telegram, user_id, "clear_all_reminders"))
+
+
+async def run(args, handler_samples): # Return elapsed seconds
+    telegram = RecordingBot(args.bot_latency / 1000)
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def limited(user_id):
+        async with slots:
+            await run_user(user_id, args, telegram, handler_samples)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(limited(1000 + u) for u in range(args.users)))
+    return time.perf_counter() - start
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold): # Return a list of p95 regressions beyond threshold
+    regressions = []
+    for section in ("handlers", "db"):
+        for name, current in results[section].items():
+            before = baseline.get(section, {}).get(name)
+            if not before or not before["p95_ms"]:
+                continue
+            change = current["p95_ms"] / before["p95_ms"] - 1
+            if change > threshold:
+                regressions.append((f"{section}.{name}", before["p95_ms"], current["p95_ms"], f"{change:+.0%}"))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--tasks", type=int, default=30, help="tasks added per user")
+    parser.add_argument("--reminders", type=int, default=3, help="reminders set per user")
+    parser.add_argument("--concurrency", type=int, default=50, help="users running at the same time")
+    parser.add_argument("--bot-latency", type=float, default=0.0, help="simulated Bot API round trip (ms)")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --output run")
+    parser.add_argument("--threshold", type=float, default=0.5, help="allowed p95 slowdown vs the baseline")
+    args = parser.parse_args()
+
+    handler_samples, db_samples = {}, {}
+    with temp_db():
+        originals = instrument(db_samples)
+        try:
+            elapsed = asyncio.run(run(args, handler_samples))
+        finally:
+            vars(async_db).update(originals)
+            async_db.close()
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "args": vars(args),
+        },
+        "total": {"handler_calls": sum(map(len, handler_samples.values())), "elapsed_s": elapsed,
+                  "per_sec": sum(map(len, handler_samples.values())) / elapsed},
+        "handlers": {name: summarize(s, elapsed) for name, s in sorted(handler_samples.items())},
+        "db": {name: summarize(s, elapsed) for name, s in sorted(db_samples.items()) if s},
+    }
+
+    headers = ["calls", "calls/sec", "p50 ms", "p95 ms", "p99 ms"]
+    for section in ("handlers", "db"):
+        rows = [(name, r["count"], r["per_sec"], f"{r['p50_ms']:.3f}", f"{r['p95_ms']:.3f}", f"{r['p99_ms']:.3f}")
+                for name, r in results[section].items()]
+        report(f"{section} ({args.users} users x {args.tasks} tasks, concurrency {args.concurrency})", headers, rows)
+    print(f"\n  {results['total']['handler_calls']:,} handler calls in {elapsed:.2f}s "
+          f"({results['total']['per_sec']:,.0f}/sec)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"  results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            report(f"p95 regressions over {args.threshold:.0%}", ["baseline ms", "current ms", "change"],
+                   [(name, f"{a:.3f}", f"{b:.3f}", c) for name, a, b, c in regressions])
+            sys.exit(1)
+        print(f"  no p95 regressions over {args.threshold:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# Query timings before and after the index migration.
+#
+#   python -m benchmarks.bench_indexes [--tasks 1000000] [--users 10000] [--queries 50]
+#
+# Builds a schema-version-1 database (tables only, no secondary indexes), times
+# the per-user queries, applies the migrations up to the integer task keys in
+# place and times them again on the same data (bench_task_keys covers the keys).
+import argparse
+import random
+import time
+
+import db
+import migrations
+from benchmarks.common import report, temp_db
+
+
+def seed(tasks, users): # Bulk-load tasks with one reminder for every tenth task
+    with db.get_pool().write() as conn:
+        conn.executemany(
+            "INSERT INTO tasks (id, user_id, task, created_at) VALUES (?, ?, ?, datetime('now', ?))",
+            ((f"{i:08x}", str(i % users), f"task {i}", f"-{tasks - i} seconds") for i in range(tasks)))
+        conn.executemany(
+            "INSERT INTO reminders (user_id, task_id, time, days_left) VALUES (?, ?, ?, ?)",
+            ((str(i % users), f"{i:08x}", f"{i % 24:02d}:{i % 60:02d}", 7) for i in range(0, tasks, 10)))
+
+
+def timed(fn, args_list): # Mean milliseconds per call
+    start = time.perf_counter()
+    for args in args_list:
+        fn(*args)
+    return (time.perf_counter() - start) * 1000 / len(args_list)
+
+
+def run_queries(users, tasks, queries, rng): # Time each query against random users/tasks
+    user_ids = [(str(rng.randrange(users)),) for _ in range(queries)]
+    # Delete tasks that carry reminders so the ON DELETE CASCADE has work to do
+    victims = [(str(i % users), f"{i:08x}") for i in rng.sample(range(0, tasks, 10), queries)]
+    return [
+        timed(db.get_user_tasks, user_ids),
+        timed(db.get_user_reminders, user_ids),
+        timed(db.delete_task, victims),
+        timed(db.get_all_reminders, [()]),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+    rng = random.Random(1)
+
+    with temp_db(init=False):
+        with db.get_pool().maintenance() as conn:
+            migrations.migrate(conn, target=1)
+        seed(args.tasks, args.users)
+
+        before = run_queries(args.users, args.tasks, args.queries, rng)
+        start = time.perf_counter()
+        with db.get_pool().maintenance() as conn:
+            migrations.migrate(conn, target=7)
+        migrate_s = time.perf_counter() - start
+        after = run_queries(args.users, args.tasks, args.queries, rng)
+
+    names = ["get_user_tasks", "get_user_reminders", "delete_task (cascade)", "get_all_reminders"]
+    rows = [(name, f"{b:.3f}", f"{a:.3f}", f"{b / a:.0f}x") for name, b, a in zip(names, before, after)]
+    report(f"ms per call at {args.tasks:,} tasks (migration took {migrate_s:.1f}s)",
+           ["no index", "indexed", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    main()
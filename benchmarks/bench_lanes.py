@@ -0,0 +1,147 @@
+# Update latency under mixed load: one update at a time against per-user lanes.
+#
+#   python -m benchmarks.bench_lanes [--light-users 300] [--heavy-users 10] [--heavy-tasks 20000]
+#                                    [--flood 200] [--rate 150] [--rtt 0.05] [--workers 1 4 16 64]
+#
+# Runs the real bot handlers against the local fake Bot API (--rtt seconds per
+# call). Each light user sends "/add a", "/add b", "/add c", "/done 1",
+# "/remove 1", "/list", interleaved with everyone else's at --rate updates per
+# second; heavy users own --heavy-tasks tasks each and send one /clear; one
+# user sends --flood /list commands at once at the start. Latency runs from
+# putting an update on application.update_queue to its reply reaching the fake
+# server. Every light user must end with tasks b, c not done, which only holds
+# if their updates ran in the order sent. --workers 1 is the default
+# sequential processing, anything higher uses lanes.UserLanes.
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import defaultdict, deque
+
+from telegram import Update
+
+import async_db
+import bot
+import db
+import lanes
+from benchmarks.common import report, temp_db
+from benchmarks.fake_bot_api import FakeBotAPI, command_update
+
+LIGHT_COMMANDS = ["/add a", "/add b", "/add c", "/done 1", "/remove 1", "/list"]
+FLOOD_USER = 1
+HEAVY_BASE = 1000
+LIGHT_BASE = 100_000
+
+
+def seed(heavy_users, heavy_tasks):
+    with db.get_pool().write() as conn:
+        for u in range(heavy_users):
+            conn.executemany("INSERT INTO tasks (user_id, task) VALUES (?, ?)",
+                             ((str(HEAVY_BASE + u), f"chore {i}") for i in range(heavy_tasks)))
+
+
+def plan(light_users, heavy_users, rng): # [(user_id, text)] in arrival order, each user's commands in order
+    turns = [LIGHT_BASE + u for u in range(light_users) for _ in LIGHT_COMMANDS]
+    rng.shuffle(turns)
+    sent = defaultdict(int)
+    events = []
+    for user_id in turns:
+        events.append((user_id, LIGHT_COMMANDS[sent[user_id]]))
+        sent[user_id] += 1
+    for u in range(heavy_users):
+        events.insert(rng.randrange(len(events)), (HEAVY_BASE + u, "/clear"))
+    return events
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run(workers, events, flood, rtt, rate):
+    api = FakeBotAPI(rtt)
+    await api.start()
+    pushed = defaultdict(deque)  # chat_id -> put times of its updates still waiting for a reply
+    latencies = {"light": [], "heavy": []}
+    expected = len(events)
+    done = asyncio.Event()
+
+    def on_send(chat_id, text):
+        chat_id = int(chat_id)
+        if chat_id == FLOOD_USER:
+            return
+        kind = "heavy" if chat_id < LIGHT_BASE else "light"
+        latencies[kind].append(time.monotonic() - pushed[chat_id].popleft())
+        if len(latencies["light"]) + len(latencies["heavy"]) == expected:
+            done.set()
+
+    api.on_send = on_send
+    lanes.WORKERS = workers
+    application = bot.build_application("0:bench", base_url=api.base_url)
+    update_id = 0
+
+    async def put(user_id, text):
+        nonlocal update_id
+        update_id += 1
+        pushed[user_id].append(time.monotonic())
+        await application.update_queue.put(Update.de_json(command_update(update_id, user_id, text), application.bot))
+
+    async with application:
+        await application.start()
+        start = time.monotonic()
+        for _ in range(flood):
+            await put(FLOOD_USER, "/list")
+        for user_id, text in events:
+            await put(user_id, text)
+            await asyncio.sleep(1 / rate)
+        await asyncio.wait_for(done.wait(), timeout=600)
+        elapsed = time.monotonic() - start
+        await application.stop()
+        processor = application.update_processor
+        if isinstance(processor, lanes.UserLanes):
+            await processor.join()
+    await api.close()
+    dropped = processor.dropped if isinstance(processor, lanes.UserLanes) else 0
+    return latencies, elapsed, dropped
+
+
+def ordered(light_users): # Light users whose tasks ended up as the command order implies
+    good = 0
+    for u in range(light_users):
+        tasks = db.get_user_tasks(str(LIGHT_BASE + u))
+        good += [(t["task"], t["done"]) for t in tasks] == [("b", 0), ("c", 0)]
+    return good
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--light-users", type=int, default=300)
+    parser.add_argument("--heavy-users", type=int, default=10)
+    parser.add_argument("--heavy-tasks", type=int, default=20_000)
+    parser.add_argument("--flood", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=150)
+    parser.add_argument("--rtt", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+    events = plan(args.light_users, args.heavy_users, random.Random(22))
+
+    rows = []
+    for workers in args.workers:
+        with temp_db():
+            seed(args.heavy_users, args.heavy_tasks)
+            latencies, elapsed, dropped = asyncio.run(run(workers, events, args.flood, args.rtt, args.rate))
+            good = ordered(args.light_users)
+        light, heavy = latencies["light"], latencies["heavy"]
+        ms = lambda seconds: f"{seconds * 1000:.0f} ms"
+        rows.append(("sequential" if workers == 1 else f"lanes, {workers} workers",
+                     ms(statistics.median(light)), ms(percentile(light, 0.99)), ms(max(light)),
+                     ms(max(heavy)), f"{elapsed:.1f}s", dropped, f"{good}/{args.light_users}"))
+    async_db.close()
+
+    report(f"{len(events):,} updates at {args.rate:g}/s + {args.flood} from one user, rtt {args.rtt * 1000:.0f} ms",
+           ["light p50", "light p99", "light max", "/clear max", "all replied", "flood dropped", "in order"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# Several worker processes sharing one database through reminder leases.
+#
+#   python -m benchmarks.bench_leases [--workers 3] [--reminders 3000] [--minutes 40]
+#                                     [--minute-seconds 0.5] [--ttl 2] [--kill-after 8]
+#
+# Every worker is a separate process running ReminderDispatcher with a
+# LeaseManager against the same tasks.db, on a shared clock where one minute
+# passes every --minute-seconds. Reminders are spread over the simulated
+# window. After --kill-after seconds the first worker is SIGKILLed (no lease
+# release), so its partitions must fail over once its leases expire; the rest
+# are stopped with SIGTERM at the end. Each send is logged per worker, and
+# every reminder that came due before the stop must have been sent exactly
+# once across all workers.
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+from collections import Counter
+from datetime import timedelta
+
+import schedule
+from benchmarks.common import report, temp_db
+from dispatcher import DIGEST_HEADER
+
+
+class RecordingOutbox: # Delivers instantly and appends "task text" lines to a per-worker log
+    depth = 0
+
+    def __init__(self, log):
+        self.log = log
+
+    def send(self, chat_id, text):
+        if text.startswith(DIGEST_HEADER):  # "• r12 (999 day(s) remaining)" per reminder
+            names = [line[2:].rsplit(" (", 1)[0] for line in text.split("\n")[1:]]
+        else:
+            names = [text.split("Reminder: ", 1)[1].split("\n", 1)[0]]
+        self.log.write("".join(name + "\n" for name in names))
+        self.log.flush()
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(True)
+        return future
+
+
+def worker(index, db_file, log_path, start_real, start_sim, minute_seconds, ttl, partitions):
+    import db
+    from dispatcher import ReminderDispatcher
+    from leases import LeaseManager
+
+    db.DB_FILE = db_file
+    db.CACHE_REMINDERS = False
+
+    def clock():
+        return start_sim + timedelta(minutes=(time.time() - start_real) / minute_seconds)
+
+    async def run():
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        leases = LeaseManager(f"worker-{index}", partitions, ttl)
+        dispatcher = ReminderDispatcher(leases, clock)
+        with open(log_path, "a") as log:
+            dispatcher.outbox = RecordingOutbox(log)
+            next_beat = 0.0
+            while not stop.is_set():
+                if time.monotonic() >= next_beat:
+                    await leases.heartbeat()
+                    next_beat = time.monotonic() + ttl / 3
+                await dispatcher.tick(None)
+                try:
+                    await asyncio.wait_for(stop.wait(), minute_seconds / 4)
+                except asyncio.TimeoutError:
+                    pass
+            await asyncio.gather(*dispatcher._tasks)
+            await leases.release()
+
+    asyncio.run(run())
+
+
+def seed(reminders, start_sim, minutes): # One task per reminder, named after it, due inside the window
+    import db
+    due_at = {}
+    with db.get_pool().write() as conn:
+        for i in range(reminders):
+            due = start_sim + timedelta(minutes=1 + i % minutes)
+            due_at[f"r{i}"] = schedule.format_utc(due)
+            task_id = conn.execute("INSERT INTO tasks (user_id, task) VALUES (?, ?)", (str(i % 500), f"r{i}")).lastrowid
+            conn.execute("""INSERT INTO reminders (user_id, task_id, time, days_left, next_fire_at)
+                            VALUES (?, ?, ?, ?, ?)""",
+                         (str(i % 500), task_id, due.strftime("%H:%M"), 1000, due_at[f"r{i}"]))
+    return due_at
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--reminders", type=int, default=3000)
+    parser.add_argument("--minutes", type=int, default=40, help="simulated minutes the reminders are spread over")
+    parser.add_argument("--minute-seconds", type=float, default=0.5, help="real seconds per simulated minute")
+    parser.add_argument("--ttl", type=float, default=2.0, help="lease TTL in real seconds")
+    parser.add_argument("--partitions", type=int, default=16)
+    parser.add_argument("--kill-after", type=float, default=8.0, help="seconds before worker 0 is killed")
+    args = parser.parse_args()
+
+    import db
+    with temp_db() as db_file:
+        start_sim = schedule.utcnow().replace(second=0, microsecond=0)
+        due_at = seed(args.reminders, start_sim, args.minutes)
+        db.close_db()
+
+        logs = [f"{db_file}.worker{i}.log" for i in range(args.workers)]
+        start_real = time.time()
+        ctx = multiprocessing.get_context("spawn")
+        procs = [ctx.Process(target=worker, args=(i, db_file, logs[i], start_real, start_sim, args.minute_seconds,
+                                                  args.ttl, args.partitions)) for i in range(args.workers)]
+        for proc in procs:
+            proc.start()
+
+        run_for = (args.minutes + 2) * args.minute_seconds
+        time.sleep(args.kill_after)
+        os.kill(procs[0].pid, signal.SIGKILL)
+        time.sleep(max(0.0, run_for - (time.time() - start_real)))
+        stop_sim = schedule.format_utc(start_sim + timedelta(minutes=(time.time() - start_real) / args.minute_seconds))
+        for proc in procs[1:]:
+            proc.terminate()
+        for proc in procs:
+            proc.join()
+
+        sends = [Counter(open(log).read().split()) for log in logs]
+        total = sum(sends, Counter())
+        with db.get_pool().read() as conn:
+            next_fire = dict(conn.execute(
+                "SELECT t.task, r.next_fire_at FROM reminders r JOIN tasks t ON t.id = r.task_id").fetchall())
+
+    due, missing, duplicated, unmoved = 0, 0, 0, 0
+    for name, fire_at in due_at.items():
+        if fire_at <= stop_sim:
+            due += 1
+            missing += total[name] == 0
+        duplicated += total[name] > 1
+        unmoved += total[name] > 0 and next_fire[name] == fire_at  # sent, but the send was never written back
+
+    rows = [(f"worker {i}" + (" (killed)" if i == 0 else ""), sum(c.values())) for i, c in enumerate(sends)]
+    rows += [("due", due), ("missing", missing), ("sent more than once", duplicated),
+             ("sent, not rescheduled", unmoved)]
+    report(f"{args.reminders} reminders, {args.workers} workers, worker 0 killed after {args.kill_after:.0f}s",
+           ["count"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Reminder burst against a fake Bot API that enforces Telegram's flood limits.
+#
+#   python -m benchmarks.bench_outbox [--messages 600] [--chats 400] [--blocked 5]
+#
+# FakeBot raises RetryAfter when more than 30 messages/s go out overall or when a
+# chat gets a second message within a second, and Forbidden for blocked chats.
+# "direct" fires every send_message at once, like the old per-reminder jobs;
+# "outbox" pushes the same burst through the rate-limited Outbox.
+import argparse
+import asyncio
+import time
+from collections import deque
+
+from telegram.error import Forbidden, RetryAfter
+
+from benchmarks.common import report
+from outbox import Outbox
+
+
+class FakeBot: # Records sends and enforces global / per-chat flood limits
+    def __init__(self, global_rate=30, blocked=()):
+        self.global_rate = global_rate
+        self.blocked = set(blocked)
+        self.delivered = 0
+        self.flood_errors = 0
+        self._recent = deque()
+        self._chat_last = {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0.005)  # network round trip
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > 1:
+            self._recent.popleft()
+        if chat_id in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        if len(self._recent) >= self.global_rate or now - self._chat_last.get(chat_id, -1) < 1:
+            self.flood_errors += 1
+            raise RetryAfter(1)
+        self._recent.append(now)
+        self._chat_last[chat_id] = now
+        self.delivered += 1
+
+
+def burst(messages, chats): # (chat_id, text) pairs, some chats receiving several
+    return [(str(i % chats), f"reminder {i}") for i in range(messages)]
+
+
+async def run_direct(bot, items):
+    start = time.perf_counter()
+    results = await asyncio.gather(*(bot.send_message(chat_id=c, text=t) for c, t in items),
+                                   return_exceptions=True)
+    lost = sum(isinstance(r, Exception) for r in results)
+    return time.perf_counter() - start, lost, 0
+
+
+async def run_outbox(bot, items):
+    dead = []
+
+    async def dead_letter(chat_id, text, error):
+        dead.append(chat_id)
+
+    outbox = Outbox(bot, dead_letter=dead_letter)
+    outbox.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(outbox.send(c, t) for c, t in items))
+    elapsed = time.perf_counter() - start
+    await outbox.close()
+    return elapsed, len(dead), outbox.retried, outbox.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=600)
+    parser.add_argument("--chats", type=int, default=400)
+    parser.add_argument("--blocked", type=int, default=5)
+    args = parser.parse_args()
+    items = burst(args.messages, args.chats)
+    blocked = [str(i) for i in range(args.blocked)]
+
+    direct_bot = FakeBot(blocked=blocked)
+    elapsed, lost, retried = asyncio.run(run_direct(direct_bot, items))
+    rows = [("direct", direct_bot.delivered, lost, direct_bot.flood_errors, retried, f"{elapsed:.1f}s")]
+
+    outbox_bot = FakeBot(blocked=blocked)
+    elapsed, dead, retried, stats = asyncio.run(run_outbox(outbox_bot, items))
+    rows.append(("outbox", outbox_bot.delivered, dead, outbox_bot.flood_errors, retried, f"{elapsed:.1f}s"))
+
+    report(f"{args.messages} messages to {args.chats} chats ({args.blocked} blocked)",
+           ["delivered", "lost/dead", "flood errs", "retries", "elapsed"], rows)
+    print(f"\n  outbox latency: avg {stats['latency_avg']:.2f}s, max {stats['latency_max']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
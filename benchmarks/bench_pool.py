@@ -0,0 +1,83 @@
+# Before/after microbenchmark for the pooled connection layer.
+#
+#   python -m benchmarks.bench_pool [--users 50] [--tasks 20] [--ops 2000]
+#
+# "before" replays the original connect-per-call implementation of each db.*
+# function against the same database file; "after" calls the current db module.
+import argparse
+import sqlite3
+
+import db
+from benchmarks.common import measure, report, temp_db
+
+
+def _legacy(sql, fetch=False): # Original pattern: connect, PRAGMA, run, commit, close
+    def call(*params):
+        conn = sqlite3.connect(db.DB_FILE)
+        conn.execute("PRAGMA foreign_keys = ON")
+        c = conn.cursor()
+        c.execute(sql, params)
+        rows = c.fetchall() if fetch else None
+        conn.commit()
+        conn.close()
+        return rows
+    return call
+
+
+legacy_get_user_tasks = _legacy("SELECT id, task, done FROM tasks WHERE user_id = ? ORDER BY created_at", fetch=True)
+legacy_get_user_reminders = _legacy("SELECT task_id, time, days_left FROM reminders WHERE user_id = ?", fetch=True)
+legacy_add_task = _legacy("INSERT INTO tasks (user_id, task) VALUES (?, ?)")
+legacy_update_task_status = _legacy("UPDATE tasks SET done = ? WHERE user_id = ? AND id = ?")
+legacy_update_reminder_days = _legacy(
+    "UPDATE reminders SET days_left = ? WHERE user_id = ? AND task_id = ? AND time = ?")
+
+
+def seed(users, tasks_per_user): # Fill the database through the current db module; returns each user's task ids
+    ids = {}
+    for u in range(users):
+        ids[str(u)] = [db.add_task(str(u), f"task {t}") for t in range(tasks_per_user)]
+        db.add_reminder(str(u), ids[str(u)][0], "09:00", 7)
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--ops", type=int, default=2000)
+    args = parser.parse_args()
+    users, ops = args.users, args.ops
+
+    with temp_db():
+        ids = seed(users, args.tasks)
+        user = lambda i: str(i % users)
+
+        cases = [
+            ("get_user_tasks",
+             lambda i: legacy_get_user_tasks(user(i)),
+             lambda i: db.get_user_tasks(user(i))),
+            ("get_user_reminders",
+             lambda i: legacy_get_user_reminders(user(i)),
+             lambda i: db.get_user_reminders(user(i))),
+            ("add_task",
+             lambda i: legacy_add_task(user(i), "bench"),
+             lambda i: db.add_task(user(i), "bench")),
+            ("update_task_status",
+             lambda i: legacy_update_task_status(i % 2, user(i), ids[user(i)][1]),
+             lambda i: db.update_task_status(user(i), ids[user(i)][1], done=bool(i % 2))),
+            ("update_reminder_days",
+             lambda i: legacy_update_reminder_days(i % 7 + 1, user(i), ids[user(i)][0], "09:00"),
+             lambda i: db.update_reminder_days(user(i), ids[user(i)][0], "09:00", i % 7 + 1)),
+        ]
+
+        rows = []
+        for name, before, after in cases:
+            before_ops = measure(before, ops)
+            after_ops = measure(after, ops)
+            rows.append((name, before_ops, after_ops, f"{after_ops / before_ops:.1f}x"))
+
+    report("ops/sec", ["before", "after", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    main()
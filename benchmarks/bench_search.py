@@ -0,0 +1,109 @@
+# /search through the FTS5 index against LIKE scans.
+#
+#   python -m benchmarks.bench_search [--tasks 1000000] [--users 10000] [--heavy 50000] [--queries 200]
+#
+# Seeds --tasks titles of 3-8 words from a fixed vocabulary, spread over
+# --users users plus one heavy user holding --heavy of them, then times a
+# one-word search three ways: db.search_tasks (FTS5 match on the user's
+# postings, ranked, with /list numbers), a LIKE filter on the user's rows
+# (index on user_id, then the user's titles in /list order) and a LIKE
+# over the whole table (what a search without the user filter costs).
+# Also reports what keeping the index in step costs per insert, with and without
+# the prefix indexes.
+import argparse
+import random
+import time
+
+import db
+from benchmarks.common import measure, report, temp_db
+
+LIMIT = 20
+
+
+def vocabulary(rng, size=5000): # Pronounceable pseudo-words, so prefixes are shared like real ones
+    syllables = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "shi", "pe", "dra", "gul", "fen", "tor", "bas"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def seed(tasks, users, heavy, words, rng): # Returns the heavy user's id
+    rows, every = [], tasks // heavy if heavy else 0
+    for i in range(tasks):
+        # The heavy user's tasks are spread through the table, as they would be added over time
+        user_id = "heavy" if every and i % every == 0 else str(i % users)
+        rows.append((user_id, " ".join(rng.choices(words, k=rng.randint(3, 8)))))
+    with db.get_pool().write() as conn:
+        conn.executemany("INSERT INTO tasks (user_id, task) VALUES (?, ?)", rows)
+    return "heavy"
+
+
+def timed(fn, args_list): # Mean milliseconds per call
+    start = time.perf_counter()
+    for args in args_list:
+        fn(*args)
+    return (time.perf_counter() - start) * 1000 / len(args_list)
+
+
+def like_user(user_id, word):
+    with db.get_pool().read() as conn:
+        return conn.execute("""SELECT id, task, done FROM tasks WHERE user_id = ? AND task LIKE ?
+                               ORDER BY created_at, rowid LIMIT ?""", (user_id, f"%{word}%", LIMIT)).fetchall()
+
+
+def like_all(user_id, word): # The unary + keeps SQLite off the user_id index, so every row is read
+    with db.get_pool().read() as conn:
+        return conn.execute("SELECT id, task, done FROM tasks WHERE +user_id = ? AND task LIKE ? LIMIT ?",
+                            (user_id, f"%{word}%", LIMIT)).fetchall()
+
+
+def insert_rate(fts, prefix=True, count=20000): # add_task calls per second with or without the index triggers
+    with temp_db():
+        with db.get_pool().write() as conn:
+            if not fts:
+                for trigger in ("insert", "delete", "update"):
+                    conn.execute(f"DROP TRIGGER tasks_fts_{trigger}")
+            elif not prefix:
+                # Same index without the 2-5 letter prefix indexes; the triggers only name the table
+                conn.execute("DROP TABLE tasks_fts")
+                conn.execute("""CREATE VIRTUAL TABLE tasks_fts USING fts5(
+                                    user_id, task, content='tasks', content_rowid='rowid',
+                                    tokenize='unicode61 remove_diacritics 2')""")
+        return measure(lambda i: db.add_task(str(i % 1000), f"task number {i} to do"), count)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--heavy", type=int, default=50_000, help="tasks owned by one heavy user")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(19)
+    words = vocabulary(rng)
+    rows = []
+    with temp_db():
+        start = time.perf_counter()
+        heavy = seed(args.tasks, args.users, args.heavy, words, rng)
+        print(f"seeded {args.tasks:,} tasks with the FTS index in {time.perf_counter() - start:.1f}s")
+
+        for label, user_ids in (("typical user", [str(rng.randrange(args.users)) for _ in range(args.queries)]),
+                                ("heavy user", [heavy] * args.queries)):
+            # Whole words and the 3-5 letter prefixes someone types before finishing a word
+            queries = [(user_id, rng.choice(words)[:rng.choice([3, 4, 5, None])]) for user_id in user_ids]
+            fts = timed(lambda u, w: db.search_tasks(u, w, LIMIT), queries)
+            scoped = timed(like_user, queries)
+            scan = timed(like_all, queries[:max(1, args.queries // 20)])
+            rows.append((label, f"{fts:.3f}", f"{scoped:.3f}", f"{scan:.1f}"))
+
+    report(f"one-word search, ms per query ({args.tasks:,} tasks)",
+           ["FTS5 /search", "LIKE, user rows", "LIKE, all rows"], rows)
+    report("add_task calls/sec", ["calls/sec"], [("without FTS index", insert_rate(False)),
+                                                  ("FTS index, no prefix indexes", insert_rate(True, False)),
+                                                  ("FTS index, prefix='2 3 4 5'", insert_rate(True))])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Write throughput as the number of SQLite shards grows.
+#
+#   python -m benchmarks.bench_shards [--shards 1 2 4 8] [--users 1000] [--writes 20000]
+#                                     [--concurrency 200] [--synchronous NORMAL]
+#
+# Each run spreads --users over N database files and issues --writes task inserts
+# through async_db from --concurrency coroutines, so every shard gets its own
+# writer thread. With --synchronous FULL each commit waits for an fsync, which
+# is where separate write locks pay off most.
+import argparse
+import asyncio
+import time
+
+import async_db
+import db
+from benchmarks.common import report, temp_db
+
+
+async def writer(worker, users, writes):
+    for i in range(writes):
+        user_id = str((worker * 7919 + i) % users)
+        await async_db.add_task(user_id, "bench")
+
+
+async def run(users, writes, concurrency): # Return elapsed seconds
+    start = time.perf_counter()
+    await asyncio.gather(*(writer(w, users, writes // concurrency) for w in range(concurrency)))
+    return time.perf_counter() - start
+
+
+def set_synchronous(mode): # Apply PRAGMA synchronous to every shard's writer connection
+    backend = db.get_backend()
+    for shard in getattr(backend, "backends", [backend]):
+        with shard.pool.write() as conn:
+            conn.execute(f"PRAGMA synchronous = {mode}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--writes", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--synchronous", default="NORMAL", help="writer PRAGMA synchronous (FULL = fsync per commit)")
+    args = parser.parse_args()
+
+    rows, baseline = [], None
+    for shards in args.shards:
+        with temp_db(shards=shards):
+            set_synchronous(args.synchronous)
+            elapsed = asyncio.run(run(args.users, args.writes, args.concurrency))
+            assert db.get_stats()["tasks"] == args.writes // args.concurrency * args.concurrency
+        rate = args.writes / elapsed
+        baseline = baseline or rate
+        rows.append((f"{shards} shard(s)", rate, f"{rate / baseline:.2f}x"))
+    async_db.close()
+
+    report(f"task inserts/sec, synchronous={args.synchronous}", ["writes/sec", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Startup time and peak memory with a large reminders table.
+#
+#   python -m benchmarks.bench_startup [--sizes 100000 1000000] [--legacy-limit 100000]
+#
+# "legacy" replays the old boot path: get_all_reminders() into a list, then one
+# strptime and one job_queue.run_once job per reminder before polling can start.
+# "current" is what main() does now: migrate, start the per-minute dispatcher
+# and read the stats; the first tick then streams one minute's reminders.
+# The legacy path slows down super-linearly in APScheduler, so sizes above
+# --legacy-limit only run the current path.
+import argparse
+import asyncio
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from telegram.ext import Application
+
+import async_db
+import db
+from benchmarks.common import report, temp_db
+from dispatcher import CHUNK_SIZE, ReminderDispatcher
+
+
+def seed(count, users=10_000): # One task and one reminder per row, spread over the day
+    with db.get_pool().write() as conn:
+        conn.executemany("INSERT INTO tasks (id, user_id, task) VALUES (?, ?, ?)",
+                         ((i + 1, str(i % users), f"task {i}") for i in range(count)))
+        conn.executemany(
+            "INSERT INTO reminders (user_id, task_id, time, days_left, next_fire_at) VALUES (?, ?, ?, ?, ?)",
+            ((str(i % users), i + 1, f"{i % 24:02d}:{i % 60:02d}", 7, f"2030-01-01 {i % 24:02d}:{i % 60:02d}:00")
+             for i in range(count)))
+
+
+async def noop(context):
+    pass
+
+
+def legacy_startup(application):
+    for rem in db.get_all_reminders():
+        now = datetime.now()
+        rem_time = datetime.strptime(rem["time"], "%H:%M").time()
+        target = datetime.combine(now.date(), rem_time)
+        if target < now:
+            target += timedelta(days=1)
+        application.job_queue.run_once(noop, when=(target - now).total_seconds(), data=rem,
+                                       name=f"{rem['user_id']}_{rem['task_id']}_{rem['time'].replace(':', '')}")
+
+
+def current_startup(application):
+    db.init_db()
+    ReminderDispatcher().start(application.job_queue, outbox=None)
+    db.get_stats()
+
+
+async def first_tick(): # Stream the busiest minute the way a dispatcher tick does
+    rows = 0
+    async for chunk in async_db.iter_due_reminders("2030-01-01 09:09:00", "2030-01-01 09:08:00", CHUNK_SIZE):
+        rows += len(chunk)
+    return rows
+
+
+def measure(fn): # (seconds, peak MiB) for one call
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--legacy-limit", type=int, default=100_000)
+    args = parser.parse_args()
+
+    rows = []
+    for size in args.sizes:
+        with temp_db():
+            seed(size)
+            if size <= args.legacy_limit:
+                legacy_app = Application.builder().token("0:bench").build()
+                elapsed, peak, _ = measure(lambda: legacy_startup(legacy_app))
+                rows.append((f"legacy @ {size:,}", f"{elapsed:.2f}s", f"{peak:.0f} MiB", "-"))
+
+            current_app = Application.builder().token("0:bench").build()
+            elapsed, peak, _ = measure(lambda: current_startup(current_app))
+            tick_s, tick_peak, due = measure(lambda: asyncio.run(first_tick()))
+            rows.append((f"current @ {size:,}", f"{elapsed:.2f}s", f"{peak:.0f} MiB",
+                         f"{due:,} in {tick_s:.2f}s"))
+
+    report("time before polling can start", ["startup", "peak mem", "first tick"], rows)
+
+
+if __name__ == "__main__":
+    main()
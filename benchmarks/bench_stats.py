@@ -0,0 +1,106 @@
+# Startup stats from full scans against trigger-maintained counters.
+#
+#   python -m benchmarks.bench_stats [--tasks 1000000] [--users 10000] [--reminder-every 5] [--ops 2000]
+#
+# Builds a schema-version-9 database (before the counters existed), applies
+# migration 10 in place, then compares reading the stats the old way (COUNT
+# DISTINCT plus two COUNT(*) scans) with reading the counters, times one
+# check_stats() recount, and measures what keeping the counters costs the
+# writes by running the same single-row writes with and without the
+# counter triggers. Every timed write is its own transaction.
+import argparse
+import random
+import time
+
+import db
+import migrations
+from benchmarks.common import measure, report, temp_db
+
+LEGACY_STATS = ("SELECT COUNT(DISTINCT user_id) FROM tasks", "SELECT COUNT(*) FROM tasks", "SELECT COUNT(*) FROM reminders")
+
+
+def seed(tasks, users, reminder_every):
+    with db.get_pool().write() as conn:
+        conn.executemany("INSERT INTO tasks (user_id, task) VALUES (?, ?)",
+                         ((str(i % users), f"task {i}") for i in range(tasks)))
+        conn.executemany(
+            "INSERT INTO reminders (user_id, task_id, time, days_left, next_fire_at) VALUES (?, ?, ?, ?, ?)",
+            ((str(i % users), i + 1, f"{i % 24:02d}:{i % 60:02d}", 7, f"2030-01-01 {i % 24:02d}:{i % 60:02d}:00")
+             for i in range(0, tasks, reminder_every)))
+
+
+def legacy_stats():
+    with db.get_pool().read() as conn:
+        return tuple(conn.execute(sql).fetchone()[0] for sql in LEGACY_STATS)
+
+
+def best_ms(fn, repeat=5): # Fastest of a few calls, in milliseconds
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times)
+
+
+def write(sql, params): # One statement in its own transaction, as the bot's handlers commit
+    with db.get_pool().write() as conn:
+        conn.execute(sql, params)
+
+
+def writes(victims, users, ops): # ops/sec of the single-row writes; victims are task ids that carry a reminder
+    with db.get_pool().write() as conn:
+        conn.commit()
+        # Otherwise one side pays for checkpointing what the other left in the WAL
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return [
+        measure(lambda i: write("INSERT INTO tasks (user_id, task) VALUES (?, ?)", (str(i % users), f"new {i}")), ops),
+        measure(lambda i: write("UPDATE tasks SET done = 1 WHERE id = ?", (victims[i],)), ops),
+        measure(lambda i: write("DELETE FROM tasks WHERE id = ?", (victims[ops + i],)), ops),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--reminder-every", type=int, default=5)
+    parser.add_argument("--ops", type=int, default=2000)
+    args = parser.parse_args()
+    rng = random.Random(23)
+
+    with temp_db(init=False):
+        with db.get_pool().maintenance() as conn:
+            migrations.migrate(conn, target=9)
+        seed(args.tasks, args.users, args.reminder_every)
+        start = time.perf_counter()
+        db.init_db()
+        migrate_s = time.perf_counter() - start
+
+        stats = db.get_stats()
+        assert legacy_stats() == (stats["users"], stats["tasks"], stats["reminders"]), (legacy_stats(), stats)
+        read_rows = [
+            ("startup stats, full scans", f"{best_ms(legacy_stats):.2f} ms"),
+            ("startup stats, counters", f"{best_ms(db.get_stats):.3f} ms"),
+            ("one user's counts", f"{best_ms(lambda: db.get_user_stats('42')):.3f} ms"),
+            ("check_stats() recount", f"{best_ms(db.check_stats, repeat=3):.0f} ms"),
+        ]
+
+        # Tasks that carry reminders, so the deletes cascade into the reminder counters too
+        victims = rng.sample(range(1, args.tasks + 1, args.reminder_every), 4 * args.ops)
+        with_counters = writes(victims[:2 * args.ops], args.users, args.ops)
+        with db.get_pool().write() as conn:
+            for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'stats_%'"
+                                        ).fetchall():
+                conn.execute(f"DROP TRIGGER {name}")
+        without_counters = writes(victims[2 * args.ops:], args.users, args.ops)
+
+    report(f"{args.tasks:,} tasks, {args.users:,} users (migration 10 took {migrate_s:.1f}s)", ["time"], read_rows)
+    names = ["add task", "mark done", "delete task (cascade)"]
+    rows = [(name, old, new, f"{new / old - 1:+.0%}")
+            for name, old, new in zip(names, without_counters, with_counters)]
+    report("writes, ops/sec", ["no counters", "counters", "change"], rows)
+
+
+if __name__ == "__main__":
+    main()
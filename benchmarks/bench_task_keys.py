@@ -0,0 +1,109 @@
+# Size and speed of random 8-char hex TEXT task keys against integer rowid keys.
+#
+#   python -m benchmarks.bench_task_keys [--tasks 1000000] [--users 10000] [--reminder-every 5] [--ops 2000]
+#
+# Builds a schema-version-7 database whose tasks carry uuid4().hex[:8]-style ids
+# (one reminder per --reminder-every tasks), measures it, applies migration 8 in
+# place and measures the same rows again. Sizes are taken after a VACUUM so both
+# sides are packed the same way; every timed write is its own transaction.
+import argparse
+import os
+import random
+import time
+
+import db
+import migrations
+from benchmarks.common import measure, report, temp_db
+
+OBJECTS = ["tasks", "sqlite_autoindex_tasks_1", "idx_tasks_user_created", "reminders", "idx_reminders_task"]
+
+
+def seed(tasks, users, reminder_every, spare, rng): # Old-style rows in creation order; returns spare unused ids
+    ids = set()
+    while len(ids) < tasks + spare:
+        ids.add(f"{rng.getrandbits(32):08x}")
+    ids = list(ids)
+    with db.get_pool().write() as conn:
+        conn.executemany("INSERT INTO tasks (id, user_id, task) VALUES (?, ?, ?)",
+                         ((ids[i], str(i % users), f"task {i}") for i in range(tasks)))
+        conn.executemany(
+            "INSERT INTO reminders (user_id, task_id, time, days_left, next_fire_at) VALUES (?, ?, ?, ?, ?)",
+            ((str(i % users), ids[i], f"{i % 24:02d}:{i % 60:02d}", 7, f"2030-01-01 {i % 24:02d}:{i % 60:02d}:00")
+             for i in range(0, tasks, reminder_every)))
+    # Drawn up front: at a million rows, a fresh random key collides often enough to fail a run
+    return ids[tasks:]
+
+
+def sizes(): # Bytes per table/index and for the whole file, after a VACUUM
+    with db.get_pool().write() as conn:
+        conn.commit()
+        conn.execute("VACUUM")
+        # Otherwise the first timed writes pay for checkpointing the whole rewritten file
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        pages = dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall())
+    return [pages.get(name, 0) for name in OBJECTS] + [os.path.getsize(db.DB_FILE)]
+
+
+def write(sql, params): # One statement in its own transaction, as the bot's handlers commit
+    with db.get_pool().write() as conn:
+        conn.execute(sql, params)
+
+
+def timings(victims, users, ops, new_task): # [(label, value)] for one schema; victims are (user_id, task_id)
+    start = time.perf_counter()
+    due = sum(len(chunk) for chunk in db.iter_due_reminders("2030-01-01 23:59:59"))
+    join_ms = (time.perf_counter() - start) * 1000
+    return [
+        measure(lambda i: new_task(str(i % users), f"new task {i}"), ops),
+        measure(lambda i: write("UPDATE tasks SET done = 1 WHERE user_id = ? AND id = ?", victims[i]), ops),
+        measure(lambda i: write("DELETE FROM tasks WHERE user_id = ? AND id = ?", victims[ops + i]), ops),
+        f"{join_ms:.0f} ms ({due:,})",
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--reminder-every", type=int, default=5)
+    parser.add_argument("--ops", type=int, default=2000)
+    args = parser.parse_args()
+    rng = random.Random(20)
+
+    with temp_db(init=False):
+        with db.get_pool().maintenance() as conn:
+            migrations.migrate(conn, target=7)
+        spare_ids = iter(seed(args.tasks, args.users, args.reminder_every, args.ops, rng))
+        # Tasks that carry reminders, so the deletes cascade; rowids are the new keys after
+        # migration 8. Each side gets its own, since the first side deletes some of them
+        rowids = rng.sample(range(1, args.tasks + 1, args.reminder_every), 4 * args.ops)
+        with db.get_pool().read() as conn:
+            by_rowid = dict((row[0], (row[1], row[2])) for row in conn.execute(
+                "SELECT rowid, user_id, id FROM tasks WHERE rowid IN (SELECT value FROM json_each(?))",
+                (str(rowids),)))
+        old_victims = [by_rowid[r] for r in rowids[:2 * args.ops]]
+        new_victims = [(by_rowid[r][0], r) for r in rowids[2 * args.ops:]]
+
+        old_sizes = sizes()
+        old_times = timings(old_victims, args.users, args.ops, lambda user_id, text: write(
+            "INSERT INTO tasks (id, user_id, task) VALUES (?, ?, ?)", (next(spare_ids), user_id, text)))
+
+        start = time.perf_counter()
+        db.init_db()
+        migrate_s = time.perf_counter() - start
+
+        new_sizes = sizes()
+        new_times = timings(new_victims, args.users, args.ops, lambda user_id, text: write(
+            "INSERT INTO tasks (user_id, task) VALUES (?, ?)", (user_id, text)))
+
+    mb = lambda size: f"{size / 1e6:.1f}"
+    rows = [(name, mb(old), mb(new), f"{(new - old) / old:+.0%}" if old else "")
+            for name, old, new in zip(OBJECTS + ["whole file"], old_sizes, new_sizes)]
+    report(f"MB at {args.tasks:,} tasks (migration 8 took {migrate_s:.1f}s)", ["hex TEXT", "integer", "change"], rows)
+    names = ["add_task", "update_task_status", "delete_task (cascade)", "due-reminder join"]
+    rows = [(name, old, new) for name, old, new in zip(names, old_times, new_times)]
+    report("ops/sec (join: one full pass)", ["hex TEXT", "integer"], rows)
+
+
+if __name__ == "__main__":
+    main()
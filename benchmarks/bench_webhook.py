@@ -0,0 +1,89 @@
+# End-to-end update latency: long polling vs. the embedded webhook server.
+#
+#   python -m benchmarks.bench_webhook [--updates 300] [--rate 15] [--rtt 0.05]
+#
+# Both modes run the real bot handlers against a local fake Bot API server
+# (benchmarks/fake_bot_api.py) that adds --rtt seconds of simulated network
+# round trip. Latency is measured from the moment an update is injected to the
+# moment the bot's reply reaches the fake server.
+import argparse
+import asyncio
+import statistics
+import time
+
+import bot
+from benchmarks.common import report, temp_db
+from benchmarks.fake_bot_api import FakeBotAPI, command_update
+from webhook import WebhookServer
+
+
+async def run_mode(mode, updates, rate, rtt, command):
+    api = FakeBotAPI(rtt)
+    await api.start()
+    pushed = {}
+    done = asyncio.Event()
+
+    def on_send(chat_id, text):
+        latencies.append(time.monotonic() - pushed[int(chat_id)])
+        if len(latencies) == updates:
+            done.set()
+
+    latencies = []
+    api.on_send = on_send
+
+    application = bot.build_application("0:bench", base_url=api.base_url)
+    allowed = bot.allowed_updates(application)
+    server = None
+    async with application:
+        if mode == "polling":
+            await application.updater.start_polling(poll_interval=0, allowed_updates=allowed)
+        else:
+            server = WebhookServer(application, path="/telegram", secret="bench-secret")
+            await server.start("127.0.0.1", 0)
+            port = server._server.sockets[0].getsockname()[1]
+            await application.bot.set_webhook(f"http://127.0.0.1:{port}/telegram", secret_token=server.secret,
+                                              allowed_updates=allowed)
+        await application.start()
+
+        for i in range(updates):
+            user_id = 1000 + i
+            pushed[user_id] = time.monotonic()
+            api.push(command_update(i + 1, user_id, command))
+            await asyncio.sleep(1 / rate)
+        await asyncio.wait_for(done.wait(), timeout=60)
+
+        if application.updater.running:
+            await application.updater.stop()
+        if server:
+            await server.close()
+        await application.stop()
+    await api.close()
+    return sorted(latencies)
+
+
+def summarize(latencies): # p50 / p95 / p99 / max in milliseconds
+    ms = [lat * 1000 for lat in latencies]
+    pick = lambda q: ms[min(len(ms) - 1, int(len(ms) * q))]
+    return f"{statistics.median(ms):.1f}", f"{pick(0.95):.1f}", f"{pick(0.99):.1f}", f"{ms[-1]:.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=15, help="updates per second")
+    parser.add_argument("--rtt", type=float, default=0.05, help="simulated network round trip (s)")
+    parser.add_argument("--command", default="/start")
+    args = parser.parse_args()
+
+    rows = []
+    with temp_db():
+        for mode in ("polling", "webhook"):
+            latencies = asyncio.run(run_mode(mode, args.updates, args.rate, args.rtt, args.command))
+            rows.append((mode, *summarize(latencies)))
+
+    report(f"update -> reply latency (ms), {args.updates} updates at {args.rate:g}/s, rtt {args.rtt * 1000:g} ms",
+           ["p50", "p95", "p99", "max"], rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+import db
+
+
+@contextmanager
+def temp_db(init=True, shards=1): # Point db.py at a fresh database file for the duration of a benchmark
+    old_file, old_shards = db.DB_FILE, db.SHARDS
+    with tempfile.TemporaryDirectory() as tmp:
+        db.close_db()
+        db.DB_FILE = os.path.join(tmp, "tasks.db")
+        db.SHARDS = shards
+        try:
+            if init:
+                db.init_db()
+            yield db.DB_FILE
+        finally:
+            db.close_db()
+            db.DB_FILE, db.SHARDS = old_file, old_shards
+
+
+def measure(fn, count): # Call fn(i) count times and return operations per second
+    start = time.perf_counter()
+    for i in range(count):
+        fn(i)
+    return count / (time.perf_counter() - start)
+
+
+def report(title, headers, rows): # Print an aligned table of (name, *values) rows
+    print(f"\n{title}")
+    print(f"  {'':<28}" + "".join(f"{h:>16}" for h in headers))
+    for name, *values in rows:
+        print(f"  {name:<28}" + "".join(f"{v:>16,.0f}" if isinstance(v, (int, float)) else f"{v:>16}"
+                                         for v in values))
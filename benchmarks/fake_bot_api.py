@@ -0,0 +1,131 @@
+# A local stand-in for api.telegram.org, enough for python-telegram-bot to run
+# against: getMe, getUpdates (long polling), setWebhook/deleteWebhook and
+# sendMessage. Updates are injected with push(); replies are recorded in sent.
+import asyncio
+import itertools
+import json
+import time
+from urllib.parse import parse_qsl
+
+from webhook import serve_http
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Havoc", "username": "havoc_bench_bot"}
+
+
+def command_update(update_id, user_id, text): # Update JSON for a private-chat command message
+    command = text.split()[0]
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
+
+
+class FakeBotAPI:
+    def __init__(self, rtt=0.0):
+        self.rtt = rtt          # simulated network round trip, half applied each way
+        self.sent = []          # (monotonic time, chat_id, text) of every sendMessage
+        self.webhook = None     # (url, secret) once setWebhook is called
+        self.on_send = None     # optional callback(chat_id, text)
+        self._updates = []
+        self._new_update = asyncio.Event()
+        self._message_ids = itertools.count(1)
+        self._deliveries = set()
+        self._server = None
+        self.port = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            lambda reader, writer: serve_http(reader, writer, self._respond), "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        # Release any long poll still parked in getUpdates before the loop goes away
+        self._new_update.set()
+        await asyncio.gather(*self._deliveries, return_exceptions=True)
+        await asyncio.sleep(self.rtt + 0.01)
+        self._server.close()
+        await self._server.wait_closed()
+
+    def push(self, update): # Deliver an update the way Telegram would in the current mode
+        if self.webhook:
+            delivery = asyncio.create_task(self._post_webhook(update))
+            self._deliveries.add(delivery)
+            delivery.add_done_callback(self._deliveries.discard)
+        else:
+            self._updates.append(update)
+            self._new_update.set()
+
+    async def _post_webhook(self, update):
+        await asyncio.sleep(self.rtt / 2)
+        url, secret = self.webhook
+        host_port, _, path = url.partition("//")[2].partition("/")
+        host, _, port = host_port.partition(":")
+        reader, writer = await asyncio.open_connection(host, int(port))
+        body = json.dumps(update).encode()
+        writer.write(f"POST /{path} HTTP/1.1\r\nHost: {host_port}\r\nContent-Type: application/json\r\n"
+                     f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+        await reader.read()
+        writer.close()
+
+    async def _respond(self, method, target, headers, body):
+        await asyncio.sleep(self.rtt / 2)
+        name = target.rsplit("/", 1)[-1]
+        if headers.get("content-type", "").startswith("application/json"):
+            params = json.loads(body or b"{}")
+        else:
+            params = {}
+            for key, value in parse_qsl(body.decode()):
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    params[key] = value
+
+        result = await getattr(self, f"_api_{name}", self._api_unknown)(params)
+        await asyncio.sleep(self.rtt / 2)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    async def _api_getMe(self, params):
+        return BOT_USER
+
+    async def _api_deleteWebhook(self, params):
+        self.webhook = None
+        return True
+
+    async def _api_setWebhook(self, params):
+        self.webhook = (params["url"], params.get("secret_token", ""))
+        return True
+
+    async def _api_getUpdates(self, params):
+        offset = int(params.get("offset", 0) or 0)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), float(params.get("timeout", 0) or 0))
+            except asyncio.TimeoutError:
+                pass
+        return list(self._updates)
+
+    async def _api_sendMessage(self, params):
+        chat_id, text = params["chat_id"], params["text"]
+        self.sent.append((time.monotonic(), chat_id, text))
+        if self.on_send:
+            self.on_send(chat_id, text)
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private"}, "text": text}
+
+    async def _api_unknown(self, params):
+        return True
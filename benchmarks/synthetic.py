@@ -0,0 +1,71 @@
+# Synthetic Telegram objects for driving bot.py handlers in-process.
+#
+# Updates are real telegram.Update instances bound to a RecordingBot, so
+# message.reply_text / query.answer / query.edit_message_text go through the
+# library's own code paths and end up in RecordingBot.calls instead of the network.
+import asyncio
+import itertools
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from telegram import CallbackQuery, Chat, Message, Update, User
+
+_ids = itertools.count(1)
+
+
+class RecordingBot: # Stand-in for telegram.Bot that records every API call
+    defaults = None
+
+    def __init__(self, latency=0.0):
+        self.latency = latency  # simulated Bot API round trip, in seconds
+        self.calls = []
+        self.last_markup = {}   # chat_id -> reply_markup of the last message sent or edited
+
+    async def _call(self, method, kwargs):
+        self.calls.append((method, kwargs))
+        if "chat_id" in kwargs:
+            self.last_markup[kwargs["chat_id"]] = kwargs.get("reply_markup")
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return True
+
+    async def send_message(self, **kwargs):
+        return await self._call("sendMessage", kwargs)
+
+    async def edit_message_text(self, **kwargs):
+        return await self._call("editMessageText", kwargs)
+
+    async def answer_callback_query(self, **kwargs):
+        return await self._call("answerCallbackQuery", kwargs)
+
+    def buttons(self, chat_id): # callback_data of every inline button on the chat's last message
+        markup = self.last_markup.get(chat_id)
+        if markup is None:
+            return []
+        return [button.callback_data for row in markup.inline_keyboard for button in row]
+
+
+def _message(bot, user_id, text):
+    user = User(id=user_id, first_name=f"user{user_id}", is_bot=False)
+    chat = Chat(id=user_id, type=Chat.PRIVATE)
+    message = Message(message_id=next(_ids), date=datetime.now(timezone.utc), chat=chat,
+                      from_user=user, text=text)
+    message.set_bot(bot)
+    return message, user
+
+
+def command(bot, user_id, text): # (update, context) for a command like "/done 3"
+    message, _ = _message(bot, user_id, text)
+    update = Update(update_id=next(_ids), message=message)
+    update.set_bot(bot)
+    return update, SimpleNamespace(args=text.split()[1:], bot=bot, bot_data={})
+
+
+def callback(bot, user_id, data): # (update, context) for an inline button press
+    message, user = _message(bot, user_id, "")
+    query = CallbackQuery(id=str(next(_ids)), from_user=user, chat_instance=str(user_id),
+                          message=message, data=data)
+    query.set_bot(bot)
+    update = Update(update_id=next(_ids), callback_query=query)
+    update.set_bot(bot)
+    return update, SimpleNamespace(args=None, bot=bot, bot_data={})
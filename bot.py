@@ -1,33 +1,155 @@
+import asyncio
 import os
-from datetime import datetime, timedelta
+import sys
+from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler
 from dotenv import load_dotenv
-import uuid
 import db
+import async_db
+import metrics
+from archive import Archiver
+from dispatcher import ReminderDispatcher, message_length
+from leases import LeaseManager
+from outbox import Outbox
+import lanes
+import lifecycle
+import schedule
+import webhook
 
 load_dotenv()
 
-def generate_unique_task_id():
-    return uuid.uuid4().hex[:8]
+# Sends reminders straight from the database once a minute, so nothing has to be
+# scheduled or cancelled per reminder. With REMINDER_LEASES=1 several processes can
+# share the database, each sending only the reminder partitions it holds a lease on.
+REMINDER_LEASES = os.getenv("REMINDER_LEASES") == "1"
+reminder_dispatcher = ReminderDispatcher(LeaseManager() if REMINDER_LEASES else None)
+# Moves done tasks to the /history archive once they are old, in the process that handles
+# updates, since its task cache is the one that has to hear about it
+archiver = Archiver()
+
+# /list, /history and /listreminders pages, and multi-task /remove replies, stay under Telegram's 4096-unit
+# message limit: PAGE_SIZE titles of at most MAX_LINE_LENGTH UTF-16 units each, plus numbering and header
+PAGE_SIZE = 20
+MAX_LINE_LENGTH = 150
+# Most tasks one multi-line /add creates, and one /done or /remove selection covers
+MAX_BATCH = 100
+# Largest SQLite integer; a bigger task or reminder number can't be bound to a query, and is out of range anyway
+MAX_NUMBER = 2 ** 63 - 1
+
+# Telegram user ids (comma-separated) that /stats also shows the totals across all users to
+ADMIN_USER_IDS = {user_id.strip() for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+# How often the stored task/reminder counters are recounted from scratch and repaired if off
+STATS_CHECK_INTERVAL = float(os.getenv("STATS_CHECK_HOURS", "24")) * 3600
+
+def shorten(text: str) -> str:
+    # Cut in UTF-16 units as Telegram counts them, so a title of emoji takes no more room than one of letters;
+    # a surrogate pair split by the cut is dropped whole
+    if message_length(text) <= MAX_LINE_LENGTH:
+        return text
+    return text.encode("utf-16-le")[:2 * (MAX_LINE_LENGTH - 1)].decode("utf-16-le", "ignore") + "…"
+
+def parse_selection(args: list) -> list:
+    # "1 3 5-9" (commas work too) -> sorted task numbers, or None if malformed or over MAX_BATCH
+    numbers = set()
+    for part in " ".join(args).replace(",", " ").split():
+        first, dash, last = part.partition("-")
+        if not first.isdigit() or (dash and not last.isdigit()):
+            return None
+        low, high = int(first), int(last) if dash else int(first)
+        if high < low or high - low >= MAX_BATCH:
+            return None
+        numbers.update(range(low, high + 1))
+        if len(numbers) > MAX_BATCH:
+            return None
+    return sorted(numbers) or None
+
+def storable(numbers: list) -> list:
+    # The numbers that can name a task at all; the rest are reported as out of range without a query
+    return [number for number in numbers if number <= MAX_NUMBER]
+
+def format_selection(numbers: list) -> str:
+    # [1, 3, 5, 6, 7] -> "1, 3, 5-7"
+    ranges = []
+    for number in sorted(numbers):
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ", ".join(str(low) if low == high else f"{low}-{high}" for low, high in ranges)
+
+def page_keyboard(kind: str, page: dict, first_cursor: str, last_cursor: str,
+                  clear_button: InlineKeyboardButton = None) -> InlineKeyboardMarkup:
+    # Prev/next buttons carry the keyset cursor of the first/last item on the page
+    nav = []
+    if page["has_prev"]:
+        nav.append(InlineKeyboardButton("◀️ prev", callback_data=f"{kind}:prev:{first_cursor}"))
+    if page["has_next"]:
+        nav.append(InlineKeyboardButton("next ▶️", callback_data=f"{kind}:next:{last_cursor}"))
+    keyboard = [nav] if nav else []
+    if clear_button is not None:
+        keyboard.append([clear_button])
+    return InlineKeyboardMarkup(keyboard)
+
+def render_task_page(page: dict) -> tuple:
+    lines = []
+    for idx, task in enumerate(page["tasks"], page["start"]):
+        status = "✅" if task["done"] else "🕓"
+        lines.append(f"{idx}. {status} {shorten(task['task'])}\n")
+    message = "🕓🧑🏻‍💻 Your Tasks:\n\n" + "".join(lines)
+
+    first, last = page["tasks"][0]["cursor"], page["tasks"][-1]["cursor"]
+    reply_markup = page_keyboard(
+        "tasks", page, f"{first[1]}:{first[0]}", f"{last[1]}:{last[0]}",
+        InlineKeyboardButton("🗑️ clear all tasks", callback_data="clear_all_tasks")
+    )
+    return message, reply_markup
+
+def render_history_page(page: dict) -> tuple:
+    lines = []
+    for idx, task in enumerate(page["tasks"], page["start"]):
+        done_on = f" ({task['done_at'][:10]})" if task["done_at"] else ""
+        lines.append(f"{idx}. ✅ {shorten(task['task'])}{done_on}\n")
+    message = "🗄️🧑🏻‍💻 Your Archived Tasks (newest first):\n\n" + "".join(lines)
+
+    reply_markup = page_keyboard("history", page, page["tasks"][0]["cursor"], page["tasks"][-1]["cursor"])
+    return message, reply_markup
+
+def render_reminder_page(page: dict) -> tuple:
+    lines = []
+    for idx, rem in enumerate(page["reminders"], page["start"]):
+        task_text = shorten(rem["task_text"]) if rem["task_text"] is not None else "(deleted task)"
+        lines.append(f"{idx}. {task_text} at {rem['time']} ({rem['days_left']} day(s) left)\n")
+    message = "⏰🧑🏻‍💻 Your reminders:\n\n" + "".join(lines)
+
+    reply_markup = page_keyboard(
+        "reminders", page, page["reminders"][0]["cursor"], page["reminders"][-1]["cursor"],
+        InlineKeyboardButton("🗑️ clear all reminders", callback_data="clear_all_reminders")
+    )
+    return message, reply_markup
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     welcome_message = (
         "👋🧑🏻‍💻 Welcome to Havoc Bot!\n\n"
         "📝 Task Commands:\n\n"
-        "/add <task> - Add a new task\n"
+        "/add <task> - Add a new task (one per line to add several)\n"
         "/list - Show all your tasks\n"
-        "/done <task_number> - Mark task as done\n"
-        "/remove <task_number> - Remove a task\n"
+        "/search <words> - Find tasks by title\n"
+        "/done <task_numbers> - Mark tasks as done, e.g. /done 1 3 5-9\n"
+        "/remove <task_numbers> - Remove tasks, e.g. /remove 2 4-6\n"
         "/edit <task_number> <new_task> - Edit a task\n"
-        "/clear - Delete all your tasks\n\n"
+        "/clear - Delete all your tasks\n"
+        "/archive - Move your done tasks to the archive\n"
+        "/history - Show your archived tasks\n\n"
 
         "⏰ Reminder Commands:\n\n"
         "/reminder <task_number> <HH:MM> <days_number> - Set daily reminder\n"
         "/listreminders - List all your reminders\n"
         "/removereminder <reminder_number> - Remove a reminder\n"
-        "/clearreminders - Clear all your reminders\n\n"
+        "/clearreminders - Clear all your reminders\n"
+        "/timezone <Area/City> - Set the timezone your reminder times are in\n\n"
 
+        "/stats - Show how many tasks and reminders you have\n"
         "/start - Show this message"
     )
     await update.message.reply_text(welcome_message)
@@ -39,100 +161,123 @@ async def add_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text("❌🧑🏻‍💻 Please provide a task! Usage: /add <task>")
         return
 
-    task_text = " ".join(context.args)
+    # One task per line, so a whole list can be pasted into a single /add
+    lines = update.message.text.split(None, 1)[1].splitlines()
+    task_texts = [" ".join(line.split()) for line in lines if line.strip()]
 
-    # Generate unique task ID
-    task_id = generate_unique_task_id()
+    if len(task_texts) > MAX_BATCH:
+        await update.message.reply_text(f"❌🧑🏻‍💻 Up to {MAX_BATCH} tasks per /add, please!")
+        return
+
+    if len(task_texts) == 1:
+        task_text = task_texts[0]
+        await async_db.add_task(user_id, task_text)
+        await update.message.reply_text(f"✅🧑🏻‍💻 Task added: {task_text}")
+        return
 
-    db.add_task(user_id, task_id, task_text)
-    await update.message.reply_text(f"✅🧑🏻‍💻 Task added: {task_text} (ID: {task_id})")
+    # All of them in one transaction
+    await async_db.add_tasks(user_id, task_texts)
+    await update.message.reply_text(f"✅🧑🏻‍💻 Added {len(task_texts)} tasks! Use /list to see them.")
 
 async def list_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
-    tasks = db.get_user_tasks(user_id)
+    page = await async_db.get_task_page(user_id, limit=PAGE_SIZE)
 
-    if not tasks:
+    if not page["tasks"]:
         await update.message.reply_text("📭🧑🏻‍💻 You have no tasks yet! Use /add to create one.")
         return
 
-    message = "🕓🧑🏻‍💻 Your Tasks:\n\n"
-    for idx, task in enumerate(tasks, 1):
-        status = "✅" if task["done"] else "🕓"
-        message += f"{idx}. {status} {task['task']}\n"
+    message, reply_markup = render_task_page(page)
+    await update.message.reply_text(message, reply_markup=reply_markup)
 
-    # Add inline button
-    keyboard = [[InlineKeyboardButton("🗑️ clear all tasks", callback_data="clear_all_tasks")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+async def search_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = str(update.effective_user.id)
 
-    await update.message.reply_text(message, reply_markup=reply_markup)
+    if not context.args:
+        await update.message.reply_text("❌🧑🏻‍💻 Please provide some words! Usage: /search <words>")
+        return
+
+    query = " ".join(context.args)
+    results = await async_db.search_tasks(user_id, query, PAGE_SIZE)
+
+    if not results:
+        await update.message.reply_text(f"🔎🧑🏻‍💻 No tasks match '{shorten(query)}'")
+        return
+
+    # Same numbers as /list, best match first
+    lines = []
+    for task in results:
+        status = "✅" if task["done"] else "🕓"
+        lines.append(f"{task['number']}. {status} {shorten(task['task'])}\n")
+
+    await update.message.reply_text(f"🔎🧑🏻‍💻 Tasks matching '{shorten(query)}':\n\n" + "".join(lines))
 
 async def done_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
-    tasks = db.get_user_tasks(user_id)
 
     # Check if user has any tasks
-    if not tasks:
+    if not await async_db.has_tasks(user_id):
         await update.message.reply_text("📭🧑🏻‍💻 You have no tasks to mark as done!")
         return
 
-    # Validate that a task number was provided
-    if not context.args or not context.args[0].isdigit():
-        await update.message.reply_text("❌🧑🏻‍💻 Usage: /done <task_number>")
+    # Validate that task numbers were provided ("3", "1 3 5-9")
+    numbers = parse_selection(context.args)
+    if numbers is None:
+        await update.message.reply_text(
+            f"❌🧑🏻‍💻 Usage: /done <task_numbers>, e.g. /done 1 3 5-9 (up to {MAX_BATCH})"
+        )
         return
 
-    task_num = int(context.args[0]) - 1
-
-    # Check if number is within range
-    if task_num < 0 or task_num >= len(tasks):
+    # Mark them done in one transaction; numbers out of range are left out of the result
+    completed = await async_db.complete_tasks_by_number(user_id, storable(numbers)) if storable(numbers) else {}
+    if not completed:
         await update.message.reply_text("❌🧑🏻‍💻 Invalid task number!")
         return
 
-    # Mark task as done
-    task_id = tasks[task_num]["id"]
-    db.update_task_status(user_id, task_id, done=True)
+    if len(numbers) == 1:
+        response = f"✅🧑🏻‍💻 Task {numbers[0]} marked as done!"
+    else:
+        response = f"✅🧑🏻‍💻 Tasks {format_selection(completed)} marked as done!"
+    invalid = [number for number in numbers if number not in completed]
+    if invalid:
+        response += f"\n(No task {shorten(format_selection(invalid))})"
 
-    await update.message.reply_text(f"✅🧑🏻‍💻 Task {task_num + 1} marked as done!")
+    await update.message.reply_text(response)
 
 async def remove_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
-    tasks = db.get_user_tasks(user_id)
 
     # Check if user has any tasks
-    if not tasks:
+    if not await async_db.has_tasks(user_id):
         await update.message.reply_text("📭🧑🏻‍💻 You have no tasks to remove!")
         return
 
-    # Validate that a task number was provided
-    if not context.args or not context.args[0].isdigit():
-        await update.message.reply_text("❌🧑🏻‍💻 Usage: /remove <task_number>")
+    # Validate that task numbers were provided ("3", "2 4-6")
+    numbers = parse_selection(context.args)
+    if numbers is None:
+        await update.message.reply_text(
+            f"❌🧑🏻‍💻 Usage: /remove <task_numbers>, e.g. /remove 2 4-6 (up to {MAX_BATCH})"
+        )
         return
 
-    task_num = int(context.args[0]) - 1
-
-    # Check if number is within range
-    if task_num < 0 or task_num >= len(tasks):
+    # Delete them in one transaction (cascades to their reminders); numbers out of range are left out
+    removed, reminders_count = (await async_db.delete_tasks_by_number(user_id, storable(numbers))
+                                if storable(numbers) else ({}, 0))
+    if not removed:
         await update.message.reply_text("❌🧑🏻‍💻 Invalid task number!")
         return
 
-    removed_task = tasks[task_num]
-    task_id = removed_task["id"]
-
-    # Get reminders before deletion to count them
-    reminders = db.get_user_reminders(user_id)
-    reminders_to_remove = [r for r in reminders if r["task_id"] == task_id]
-    reminders_count = len(reminders_to_remove)
-
-    # Cancel scheduled jobs
-    for rem in reminders_to_remove:
-        job_name = f"{user_id}_{task_id}_{rem['time'].replace(':', '')}"
-        for job in context.job_queue.jobs():
-            if job.name == job_name:
-                job.schedule_removal()
-
-    # Delete task (cascades to reminders in DB)
-    db.delete_task(user_id, task_id)
-
-    response = f"🗑️🧑🏻‍💻 Removed task: {removed_task['task']}"
+    if len(removed) == 1:
+        response = f"🗑️🧑🏻‍💻 Removed task: {next(iter(removed.values()))['task']}"
+    else:
+        # Listed like a /list page, so the reply stays under the message size limit
+        titles = [f"- {shorten(task['task'])}" for task in removed.values()]
+        if len(titles) > PAGE_SIZE:
+            titles[PAGE_SIZE:] = [f"… and {len(titles) - PAGE_SIZE} more"]
+        response = f"🗑️🧑🏻‍💻 Removed {len(removed)} tasks:\n" + "\n".join(titles)
+    invalid = [number for number in numbers if number not in removed]
+    if invalid:
+        response += f"\n(No task {format_selection(invalid)})"
     if reminders_count > 0:
         response += f"\n(Also removed {reminders_count} associated reminder(s))"
 
@@ -140,10 +285,9 @@ async def remove_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
 async def edit_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
-    tasks = db.get_user_tasks(user_id)
 
     # Check if user has any tasks
-    if not tasks:
+    if not await async_db.has_tasks(user_id):
         await update.message.reply_text("📭🧑🏻‍💻 You have no tasks to edit!")
         return
 
@@ -152,25 +296,22 @@ async def edit_task(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text("❌🧑🏻‍💻 Usage: /edit <task_number> <new_task>")
         return
 
-    task_num = int(context.args[0]) - 1
+    task_num = int(context.args[0])
     new_task_text = " ".join(context.args[1:])
 
-    # Check if number is within range
-    if task_num < 0 or task_num >= len(tasks):
+    # Replace old text with new one (None if the number is out of range)
+    task = await async_db.edit_task_by_number(user_id, task_num, new_task_text) if task_num <= MAX_NUMBER else None
+    if task is None:
         await update.message.reply_text("❌🧑🏻‍💻 Invalid task number!")
         return
 
-    # Replace old text with new one
-    task = tasks[task_num]
     old_task = task["task"]
 
-    db.update_task_text(user_id, task["id"], new_task_text)
-
-    await update.message.reply_text(f"✏️🧑🏻‍💻 Task {task_num + 1} updated:\n'{old_task}' ➝ '{new_task_text}'")
+    await update.message.reply_text(f"✏️🧑🏻‍💻 Task {task_num} updated:\n'{old_task}' ➝ '{new_task_text}'")
 
 async def clear_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
-    tasks = db.get_user_tasks(user_id)
+    tasks = await async_db.get_user_tasks(user_id)
 
     # Check if user has any tasks
     if not tasks:
@@ -180,18 +321,11 @@ async def clear_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     task_count = len(tasks)
 
     # Get reminders count before clearing
-    reminders = db.get_user_reminders(user_id)
+    reminders = await async_db.get_user_reminders(user_id)
     reminders_count = len(reminders)
 
-    # Cancel all scheduled jobs
-    for rem in reminders:
-        job_name = f"{user_id}_{rem['task_id']}_{rem['time'].replace(':', '')}"
-        for job in context.job_queue.jobs():
-            if job.name == job_name:
-                job.schedule_removal()
-
     # Clear all tasks (cascades to reminders)
-    db.clear_all_tasks(user_id)
+    await async_db.clear_all_tasks(user_id)
 
     response = f"🗑️🧑🏻‍💻 Cleared {task_count} task(s)!"
     if reminders_count > 0:
@@ -199,11 +333,32 @@ async def clear_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
     await update.message.reply_text(response)
 
+async def archive_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = str(update.effective_user.id)
+
+    # Done tasks that still have reminders stay until the reminders end
+    count = await async_db.archive_tasks(user_id)
+    if count == 0:
+        await update.message.reply_text("📭🧑🏻‍💻 You have no done tasks to archive (tasks with reminders stay)!")
+        return
+
+    await update.message.reply_text(f"🗄️🧑🏻‍💻 Archived {count} done task(s)! Use /history to see them.")
+
+async def history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = str(update.effective_user.id)
+    page = await async_db.get_archive_page(user_id, limit=PAGE_SIZE)
+
+    if not page["tasks"]:
+        await update.message.reply_text("📭🧑🏻‍💻 Your archive is empty! Done tasks move there with /archive.")
+        return
+
+    message, reply_markup = render_history_page(page)
+    await update.message.reply_text(message, reply_markup=reply_markup)
+
 async def reminder(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
-    tasks = db.get_user_tasks(user_id)
 
-    if not tasks:
+    if not await async_db.has_tasks(user_id):
         await update.message.reply_text("📭🧑🏻‍💻 You have no tasks!")
         return
 
@@ -211,104 +366,44 @@ async def reminder(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text("❌🧑🏻‍💻 Usage: /reminder <task_number> <HH:MM> <days>")
         return
 
-    task_index = int(context.args[0]) - 1
+    task_num = int(context.args[0])
     time_str = context.args[1]
     days = int(context.args[2])
-
-    if task_index < 0 or task_index >= len(tasks):
-        await update.message.reply_text("❌🧑🏻‍💻 Invalid task number!")
+    if days > MAX_NUMBER:
+        await update.message.reply_text("❌🧑🏻‍💻 Usage: /reminder <task_number> <HH:MM> <days>")
         return
 
-    task = tasks[task_index]
-    task_id = task["id"]
-
     try:
         reminder_time = datetime.strptime(time_str, "%H:%M").time()
     except ValueError:
         await update.message.reply_text("❌🧑🏻‍💻 Invalid time format! Use HH:MM")
         return
 
-    # Save reminder in DB
-    db.add_reminder(user_id, task_id, time_str, days)
-
-    # Schedule first reminder
-    now = datetime.now()
-    target = datetime.combine(now.date(), reminder_time)
-    if target < now:
-        target += timedelta(days=1)
-    delay = (target - now).total_seconds()
-
-    context.job_queue.run_once(
-        send_reminder,
-        when=delay,
-        data={"user_id": user_id, "task_id": task_id, "task_text": task["task"], "days_left": days, "time": time_str},
-        name=f"{user_id}_{task_id}_{time_str.replace(':', '')}"
-    )
+    # Save reminder in DB, zero-padded; it fires next at this wall-clock time in the user's timezone
+    time_str = reminder_time.strftime("%H:%M")
+    task = await async_db.add_reminder_by_number(user_id, task_num, time_str, days) if task_num <= MAX_NUMBER else None
+    if task is None:
+        await update.message.reply_text("❌🧑🏻‍💻 Invalid task number!")
+        return
 
     await update.message.reply_text(
         f"⏰🧑🏻‍💻 Reminder set for task '{task['task']}' at {time_str} for {days} day(s)!"
     )
 
-async def send_reminder(context: ContextTypes.DEFAULT_TYPE) -> None:
-    job = context.job
-    data = job.data
-    user_id = data["user_id"]
-    task_id = data["task_id"]
-    task_text = data["task_text"]
-    days_left = data["days_left"]
-    time_str = data["time"]
-
-    # Send the reminder
-    await context.bot.send_message(
-        chat_id=user_id,
-        text=f"⏰🧑🏻‍💻 Reminder: {task_text}\n({days_left} day(s) remaining)!"
-    )
-
-    # Update days_left in DB
-    new_days = days_left - 1
-    if new_days <= 0:
-        db.delete_reminder(user_id, task_id, time_str)
-    else:
-        db.update_reminder_days(user_id, task_id, time_str, new_days)
-
-    # Schedule next reminder if needed
-    if days_left > 1:
-        next_time = datetime.now() + timedelta(days=1)
-        reminder_dt = datetime.combine(next_time.date(), datetime.strptime(time_str, "%H:%M").time())
-        delay = (reminder_dt - datetime.now()).total_seconds()
-        context.job_queue.run_once(
-            send_reminder,
-            when=delay,
-            data={"user_id": user_id, "task_id": task_id, "task_text": task_text, "days_left": new_days,
-                  "time": time_str},
-            name=job.name
-        )
-
 async def list_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
-    reminders = db.get_user_reminders(user_id)
+    page = await async_db.get_reminder_page(user_id, limit=PAGE_SIZE)
 
-    if not reminders:
+    if not page["reminders"]:
         await update.message.reply_text("📭🧑🏻‍💻 You have no reminders set!")
         return
 
-    tasks = db.get_user_tasks(user_id)
-    message = "⏰🧑🏻‍💻 Your reminders:\n\n"
-
-    for idx, rem in enumerate(reminders, 1):
-        task = next((t for t in tasks if t["id"] == rem["task_id"]), None)
-        task_text = task["task"] if task else "(deleted task)"
-        message += f"{idx}. {task_text} at {rem['time']} ({rem['days_left']} day(s) left)\n"
-
-    # Add inline button
-    keyboard = [[InlineKeyboardButton("🗑️ clear all reminders", callback_data="clear_all_reminders")]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
+    message, reply_markup = render_reminder_page(page)
     await update.message.reply_text(message, reply_markup=reply_markup)
 
 async def remove_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
-    reminders = db.get_user_reminders(user_id)
+    reminders = await async_db.get_user_reminders(user_id)
 
     if not reminders:
         await update.message.reply_text("📭🧑🏻‍💻 You have no reminders to remove!")
@@ -318,48 +413,80 @@ async def remove_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await update.message.reply_text("❌🧑🏻‍💻 Usage: /removereminder <reminder_number>")
         return
 
-    rem_index = int(context.args[0]) - 1
+    # The task title comes back joined to the deleted row, so no task list lookup
+    number = int(context.args[0])
+    removed = await async_db.delete_reminder_by_number(user_id, number) if number <= MAX_NUMBER else None
 
-    if rem_index < 0 or rem_index >= len(reminders):
+    if removed is None:
         await update.message.reply_text("❌🧑🏻‍💻 Invalid reminder number!")
         return
 
-    removed = reminders[rem_index]
-
-    # Cancel scheduled job
-    job_name = f"{user_id}_{removed['task_id']}_{removed['time'].replace(':', '')}"
-    for job in context.job_queue.jobs():
-        if job.name == job_name:
-            job.schedule_removal()
-
-    db.delete_reminder(user_id, removed["task_id"], removed["time"])
-
-    tasks = db.get_user_tasks(user_id)
-    task = next((t for t in tasks if t["id"] == removed["task_id"]), None)
-    task_text = task["task"] if task else "(deleted task)"
+    task_text = removed["task_text"] or "(deleted task)"
 
     await update.message.reply_text(f"🗑️🧑🏻‍💻 Removed reminder for '{task_text}' at {removed['time']}")
 
 async def clear_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
-    reminders = db.get_user_reminders(user_id)
+    reminders = await async_db.get_user_reminders(user_id)
 
     if not reminders:
         await update.message.reply_text("📭🧑🏻‍💻 You have no reminders to clear!")
         return
 
-    # Cancel all scheduled jobs for this user
-    for rem in reminders:
-        job_name = f"{user_id}_{rem['task_id']}_{rem['time'].replace(':', '')}"
-        for job in context.job_queue.jobs():
-            if job.name == job_name:
-                job.schedule_removal()
-
     count = len(reminders)
-    db.clear_all_reminders(user_id)
+    await async_db.clear_all_reminders(user_id)
 
     await update.message.reply_text(f"🗑️🧑🏻‍💻 Cleared {count} reminder(s)!")
 
+async def set_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = str(update.effective_user.id)
+
+    if not context.args:
+        current = await async_db.get_user_timezone(user_id) or schedule.DEFAULT_TIMEZONE or "server time"
+        await update.message.reply_text(
+            f"🌍🧑🏻‍💻 Your reminders use: {current}\nUsage: /timezone <Area/City>, e.g. /timezone Europe/Berlin"
+        )
+        return
+
+    timezone_name = context.args[0]
+    if len(context.args) != 1 or not schedule.valid_timezone(timezone_name):
+        await update.message.reply_text("❌🧑🏻‍💻 Unknown timezone! Use a name like Europe/Berlin or America/New_York")
+        return
+
+    # Existing reminders keep their HH:MM, now in the new timezone
+    count = await async_db.set_user_timezone(user_id, timezone_name)
+
+    response = f"🌍🧑🏻‍💻 Timezone set to {timezone_name}"
+    if count > 0:
+        response += f"\n(Rescheduled {count} reminder(s))"
+
+    await update.message.reply_text(response)
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = str(update.effective_user.id)
+    mine = await async_db.get_user_stats(user_id)
+
+    message = (
+        "📊🧑🏻‍💻 Your Stats:\n\n"
+        f"📝 Tasks: {mine['tasks']} ({mine['done']} done)\n"
+        f"⏰ Reminders: {mine['reminders']}"
+    )
+    if user_id in ADMIN_USER_IDS:
+        total = await async_db.get_stats()
+        message += (
+            f"\n\n🌍 All Users: {total['users']}\n"
+            f"📝 Tasks: {total['tasks']} ({total['done']} done)\n"
+            f"⏰ Reminders: {total['reminders']}"
+        )
+
+    await update.message.reply_text(message)
+
+async def check_stats(context: ContextTypes.DEFAULT_TYPE) -> None:
+    # The counters are kept by triggers; recount now and then in case anything slipped past them
+    drifted = await async_db.check_stats()
+    if drifted:
+        print(f"⚠️ Repaired {drifted} drifted stats counter(s)")
+
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
@@ -367,24 +494,17 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = str(update.effective_user.id)
 
     if query.data == "clear_all_tasks":
-        tasks = db.get_user_tasks(user_id)
+        tasks = await async_db.get_user_tasks(user_id)
 
         if not tasks:
             await query.edit_message_text("📭🧑🏻‍💻 You have no tasks to clear!")
             return
 
         task_count = len(tasks)
-        reminders = db.get_user_reminders(user_id)
+        reminders = await async_db.get_user_reminders(user_id)
         reminders_count = len(reminders)
 
-        # Cancel all scheduled jobs
-        for rem in reminders:
-            job_name = f"{user_id}_{rem['task_id']}_{rem['time'].replace(':', '')}"
-            for job in context.job_queue.jobs():
-                if job.name == job_name:
-                    job.schedule_removal()
-
-        db.clear_all_tasks(user_id)
+        await async_db.clear_all_tasks(user_id)
 
         response = f"🗑️🧑🏻‍💻 Cleared {task_count} task(s)!"
         if reminders_count > 0:
@@ -393,75 +513,176 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.edit_message_text(response)
 
     elif query.data == "clear_all_reminders":
-        reminders = db.get_user_reminders(user_id)
+        reminders = await async_db.get_user_reminders(user_id)
 
         if not reminders:
             await query.edit_message_text("📭🧑🏻‍💻 You have no reminders to clear!")
             return
 
-        # Cancel all scheduled jobs
-        for rem in reminders:
-            job_name = f"{user_id}_{rem['task_id']}_{rem['time'].replace(':', '')}"
-            for job in context.job_queue.jobs():
-                if job.name == job_name:
-                    job.schedule_removal()
-
         count = len(reminders)
-        db.clear_all_reminders(user_id)
+        await async_db.clear_all_reminders(user_id)
         await query.edit_message_text(f"🗑️🧑🏻‍💻 Cleared {count} reminder(s)!")
 
-def main() -> None:
-    token = os.getenv("TELEGRAM_TOKEN")
-    if not token:
-        raise ValueError("No TELEGRAM_TOKEN found in .env file!")
+    elif query.data.startswith("tasks:"):
+        _, direction, rowid, created_at = query.data.split(":", 3)
+        page = await async_db.get_task_page(user_id, (created_at, int(rowid)), direction == "prev", PAGE_SIZE)
 
-    # Initialize database
-    db.init_db()
+        # The cursor task may be gone by now; fall back to the first page
+        if not page["tasks"]:
+            page = await async_db.get_task_page(user_id, limit=PAGE_SIZE)
+        if not page["tasks"]:
+            await query.edit_message_text("📭🧑🏻‍💻 You have no tasks yet! Use /add to create one.")
+            return
 
-    # Create the Application
-    application = Application.builder().token(token).build()
+        message, reply_markup = render_task_page(page)
+        await query.edit_message_text(message, reply_markup=reply_markup)
+
+    elif query.data.startswith("history:"):
+        _, direction, archive_id = query.data.split(":", 2)
+        page = await async_db.get_archive_page(user_id, int(archive_id), direction == "prev", PAGE_SIZE)
+
+        if not page["tasks"]:
+            page = await async_db.get_archive_page(user_id, limit=PAGE_SIZE)
+        if not page["tasks"]:
+            await query.edit_message_text("📭🧑🏻‍💻 Your archive is empty! Done tasks move there with /archive.")
+            return
+
+        message, reply_markup = render_history_page(page)
+        await query.edit_message_text(message, reply_markup=reply_markup)
+
+    elif query.data.startswith("reminders:"):
+        _, direction, reminder_id = query.data.split(":", 2)
+        page = await async_db.get_reminder_page(user_id, int(reminder_id), direction == "prev", PAGE_SIZE)
+
+        if not page["reminders"]:
+            page = await async_db.get_reminder_page(user_id, limit=PAGE_SIZE)
+        if not page["reminders"]:
+            await query.edit_message_text("📭🧑🏻‍💻 You have no reminders set!")
+            return
+
+        message, reply_markup = render_reminder_page(page)
+        await query.edit_message_text(message, reply_markup=reply_markup)
+
+async def startup(application: Application) -> None:
+    # Start the outbound message workers and the per-minute reminder dispatcher
+    outbox = Outbox(application.bot)
+    outbox.start()
+    application.bot_data["outbox"] = outbox
+    reminder_dispatcher.start(application.job_queue, outbox)
+    application.job_queue.run_repeating(check_stats, interval=STATS_CHECK_INTERVAL, first=STATS_CHECK_INTERVAL,
+                                        name="stats_check")
+
+    # Queue sizes are read when /metrics is scraped
+    metrics.job_queue_jobs.set_function(lambda: len(application.job_queue.jobs()))
+    metrics.update_queue_size.set_function(application.update_queue.qsize)
+    metrics.outbox_depth.set_function(lambda: outbox.depth)
+    metrics.db_pending_writes.set_function(async_db.pending_writes)
+    if isinstance(application.update_processor, lanes.UserLanes):
+        metrics.update_lanes_pending.set_function(lambda: application.update_processor.pending)
+    # Only the update-handling process serves /metrics, so --reminders-only processes started on the
+    # same host with the same environment don't fight over METRICS_PORT
+    if not application.bot_data.get("reminders_only"):
+        await metrics.start_server()
+
+async def stopping(application: Application) -> None:
+    # Finish the updates already handed to the per-user lanes while their replies can still go out
+    if isinstance(application.update_processor, lanes.UserLanes):
+        await application.update_processor.join()
+    # Let queued messages go out while the bot can still send them
+    outbox = application.bot_data.get("outbox")
+    if outbox is not None:
+        await outbox.close()
+    # Hand our reminder partitions straight to the other workers instead of letting the leases expire
+    if reminder_dispatcher.leases is not None:
+        await reminder_dispatcher.leases.release()
+    await metrics.close_server()
+
+async def shutdown(application: Application) -> None:
+    # Flush queued writes before the process exits
+    await asyncio.to_thread(async_db.close)
+    db.close_db()
+
+def allowed_updates(application: Application) -> list:
+    # Only subscribe to the update types the registered handlers actually use
+    # (commands are read from update.message, so edited messages are left out)
+    types = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, CallbackQueryHandler):
+                types.add(Update.CALLBACK_QUERY)
+            elif isinstance(handler, CommandHandler):
+                types.add(Update.MESSAGE)
+    return sorted(types)
+
+def build_application(token: str, base_url: str = None) -> Application:
+    builder = Application.builder().token(token).post_init(startup).post_stop(stopping).post_shutdown(shutdown)
+    if base_url:
+        builder = builder.base_url(base_url)
+    # With UPDATE_WORKERS > 1, different users' updates run concurrently while each user's
+    # still run one at a time in order, so "/done 1" then "/remove 1" keep their meaning
+    if lanes.WORKERS > 1:
+        builder = builder.concurrent_updates(lanes.UserLanes(lanes.WORKERS))
+    application = builder.build()
 
     # Register command handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("add", add_task))
     application.add_handler(CommandHandler("list", list_tasks))
+    application.add_handler(CommandHandler("search", search_tasks))
     application.add_handler(CommandHandler("done", done_task))
     application.add_handler(CommandHandler("remove", remove_task))
     application.add_handler(CommandHandler("edit", edit_task))
     application.add_handler(CommandHandler("clear", clear_tasks))
+    application.add_handler(CommandHandler("archive", archive_tasks))
+    application.add_handler(CommandHandler("history", history))
     application.add_handler(CommandHandler("reminder", reminder))
     application.add_handler(CommandHandler("listreminders", list_reminders))
     application.add_handler(CommandHandler("removereminder", remove_reminder))
     application.add_handler(CommandHandler("clearreminders", clear_reminders))
+    application.add_handler(CommandHandler("timezone", set_timezone))
+    application.add_handler(CommandHandler("stats", stats))
     application.add_handler(CallbackQueryHandler(button_callback))
 
-    # Reschedule reminders on startup
-    all_reminders = db.get_all_reminders()
-    for rem in all_reminders:
-        now = datetime.now()
-        rem_time = datetime.strptime(rem["time"], "%H:%M").time()
-        target = datetime.combine(now.date(), rem_time)
-        if target < now:
-            target += timedelta(days=1)
-        delay = (target - now).total_seconds()
-        application.job_queue.run_once(
-            send_reminder,
-            when=delay,
-            data={
-                "user_id": rem["user_id"],
-                "task_id": rem["task_id"],
-                "task_text": rem["task_text"],
-                "days_left": rem["days_left"],
-                "time": rem["time"]
-            },
-            name=f"{rem['user_id']}_{rem['task_id']}_{rem['time'].replace(':', '')}"
-        )
+    # Latency histogram for every handler registered above
+    metrics.instrument_handlers(application)
+    return application
+
+async def serve_reminders_only(application: Application) -> None:
+    # Extra worker process: sends its share of reminders, receives no updates
+    async with lifecycle.running(application):
+        await lifecycle.wait_for_stop_signal()
+
+def main() -> None:
+    token = os.getenv("TELEGRAM_TOKEN")
+    if not token:
+        raise ValueError("No TELEGRAM_TOKEN found in .env file!")
+
+    reminders_only = "--reminders-only" in sys.argv[1:]
+    if reminders_only and not REMINDER_LEASES:
+        raise ValueError("--reminders-only needs REMINDER_LEASES=1, or every process would send every reminder")
+
+    # Initialize database
+    db.init_db()
+
+    # Create the Application
+    application = build_application(token)
+    application.bot_data["reminders_only"] = reminders_only
+    if not reminders_only:
+        archiver.start(application.job_queue)
 
     # Get stats and start bot
-    users, tasks, reminders = db.get_stats()
+    totals = db.get_stats()
     print(f"🧑🏻‍💻 Bot is running...")
-    print(f"📊 Loaded: {users} user(s), {tasks} task(s), {reminders} reminder(s)")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    print(f"📊 Loaded: {totals['users']} user(s), {totals['tasks']} task(s), {totals['reminders']} reminder(s)")
+
+    # Webhook mode when a public URL is configured, long polling otherwise
+    webhook_url = os.getenv("WEBHOOK_URL")
+    if reminders_only:
+        asyncio.run(serve_reminders_only(application))
+    elif webhook_url:
+        webhook.run(application, webhook_url, allowed_updates(application))
+    else:
+        application.run_polling(allowed_updates=allowed_updates(application))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+
+MAX_ROWS = 200_000   # total cached rows across all users (the memory cap)
+VERSION_SLOTS = 4096
+
+
+class UserCache: # Bounded LRU of per-user row lists, kept in step with db.py writes
+    def __init__(self, max_rows=MAX_ROWS):
+        self.max_rows = max_rows
+        self.rows = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> list of row dicts, least recently used first
+        self._lock = threading.Lock()
+        # Bumped on every write to a key (striped, so unrelated keys may share a slot).
+        # A reader remembers the version before querying and may only store its result
+        # if no write happened meanwhile, so a slow read can never re-cache stale rows.
+        self._versions = [0] * VERSION_SLOTS
+        # Bumped on every store. A read that lands between a write's commit and its patch
+        # caches rows that already hold the write, so patch() drops the key instead when
+        # anything was stored since the writer's mark()
+        self._stores = [0] * VERSION_SLOTS
+
+    def _slot(self, key):
+        return hash(key) % VERSION_SLOTS
+
+    def lookup(self, key): # (copy of cached rows or None, version to pass to store())
+        with self._lock:
+            rows = self._entries.get(key)
+            if rows is None:
+                self.misses += 1
+                return None, self._versions[self._slot(key)]
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return [dict(row) for row in rows], None
+
+    def store(self, key, rows, version): # Cache rows fetched from the database
+        with self._lock:
+            if self._versions[self._slot(key)] != version or len(rows) >= self.max_rows:
+                return
+            self._drop(key)
+            self._stores[self._slot(key)] += 1
+            self._entries[key] = [dict(row) for row in rows]
+            self.rows += len(rows)
+            self._evict()
+
+    def invalidate(self, key): # Forget a key after a committed write
+        with self._lock:
+            self._versions[self._slot(key)] += 1
+            self._drop(key)
+
+    def mark(self, key): # Taken before a write and passed to patch() after its commit
+        with self._lock:
+            return self._stores[self._slot(key)]
+
+    def patch(self, key, change, mark): # Apply change(rows) in place after a committed write, if cached
+        with self._lock:
+            slot = self._slot(key)
+            self._versions[slot] += 1
+            if self._stores[slot] != mark:
+                self._drop(key)
+                return
+            rows = self._entries.get(key)
+            if rows is not None:
+                before = len(rows)
+                change(rows)
+                self.rows += len(rows) - before
+                self._evict()
+
+    def clear(self): # Drop everything and reset the counters
+        with self._lock:
+            self._versions = [v + 1 for v in self._versions]
+            self._entries.clear()
+            self.rows = self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._entries), "rows": self.rows, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+    def _evict(self): # Drop least recently used users until under the row cap
+        while self.rows > self.max_rows:
+            self.evictions += 1
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        rows = self._entries.pop(key, None)
+        if rows is not None:
+            self.rows -= len(rows)
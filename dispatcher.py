@@ -0,0 +1,146 @@
+import asyncio
+import time
+from datetime import timedelta
+from functools import partial
+
+import async_db
+import metrics
+import schedule
+
+# Reminders are streamed from the database this many at a time...
+CHUNK_SIZE = 500
+# ...and the next chunk is only pulled once the outbox backlog is below this
+MAX_OUTBOX_DEPTH = 5000
+
+
+# Telegram rejects longer messages; a digest that would not fit is split into several
+MAX_MESSAGE_LENGTH = 4096
+DIGEST_HEADER = "⏰🧑🏻‍💻 Reminders:"
+
+
+def message_length(text): # As Telegram counts it: UTF-16 code units, so emoji and other astral characters count twice
+    return len(text.encode("utf-16-le")) // 2
+
+
+def titled(prefix, rem, suffix, room): # prefix + task title + suffix, the title cut short to fit in room
+    title, room = rem["task_text"], room - message_length(prefix + suffix)
+    if message_length(title) > room:
+        # A surrogate pair split by the cut is dropped whole
+        title = title.encode("utf-16-le")[:2 * (room - 1)].decode("utf-16-le", "ignore") + "…"
+    return prefix + title + suffix
+
+
+def reminder_text(rem):
+    return titled("⏰🧑🏻‍💻 Reminder: ", rem, f"\n({rem['days_left']} day(s) remaining)!", MAX_MESSAGE_LENGTH)
+
+
+def digest_line(rem): # Short enough to fit in a digest of its own
+    return titled("• ", rem, f" ({rem['days_left']} day(s) remaining)",
+                  MAX_MESSAGE_LENGTH - message_length(DIGEST_HEADER + "\n"))
+
+
+def reminder_messages(rems): # [(text, reminders it covers)] for one user's reminders firing together
+    if len(rems) == 1:
+        return [(reminder_text(rems[0]), rems)]
+    messages, text, covered = [], DIGEST_HEADER, []
+    for rem in rems:
+        line = digest_line(rem)
+        if covered and message_length(text + "\n" + line) > MAX_MESSAGE_LENGTH:
+            messages.append((text, covered))
+            text, covered = DIGEST_HEADER, []
+        text += "\n" + line
+        covered.append(rem)
+    messages.append((text, covered))
+    return messages
+
+
+def record_lag(scheduled, future): # Done callback: how late a delivered reminder went out
+    if not future.cancelled() and future.exception() is None and future.result():
+        metrics.reminder_lag.observe(None, time.time() - scheduled)
+
+
+class ReminderDispatcher: # One job-queue job that wakes every minute and sends whatever has come due
+    def __init__(self, leases=None, clock=schedule.utcnow):
+        self.outbox = None
+        # With a LeaseManager only its partitions are sent, so several processes can share the database
+        self.leases = leases
+        self.clock = clock
+        # Fire times up to here have been dispatched; None until the first tick, which catches up
+        # on everything that came due while the bot was down
+        self._dispatched_until = None
+        self._tasks = set()
+        self._streaming = asyncio.Lock()
+
+    def start(self, job_queue, outbox): # Catch up now, then tick just after every minute boundary
+        self.outbox = outbox
+        now = self.clock()
+        first = (now.replace(second=0, microsecond=0) + timedelta(minutes=1) - now).total_seconds() + 0.5
+        if self.leases is not None:
+            self.leases.start(job_queue)
+        else:
+            job_queue.run_once(self.tick, 0.1, name="reminder_catch_up")
+        job_queue.run_repeating(self.tick, interval=60, first=first, name="reminder_dispatcher")
+
+    def _spawn(self, coro): # Run in the background, keeping a reference until done
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def tick(self, context): # Job callback: returns at once, a busy minute never delays the next tick
+        now = schedule.format_utc(self.clock())
+        if self.leases is None:
+            after, self._dispatched_until = self._dispatched_until, now
+            self._spawn(self._dispatch(after, now))
+            return
+
+        # Each leased partition resumes from its own progress (a newly claimed one catches up).
+        # Waits out a renewal in flight, which may hand back partitions not busy when it began
+        async with self.leases.lock:
+            # Failed renewals leave owned as it was; past the ttl those leases are someone else's
+            self.leases.expire()
+            groups = {}
+            for partition, after in self.leases.owned.items():
+                self.leases.owned[partition] = now
+                groups.setdefault(after, []).append(partition)
+            for after, partitions in groups.items():
+                for partition in partitions:
+                    self.leases.busy[partition] = self.leases.busy.get(partition, 0) + 1
+                self._spawn(self._dispatch_leased(after, now, partitions))
+
+    async def _dispatch_leased(self, after, until, partitions): # Keep the partitions busy until every send is done
+        try:
+            deliveries = await self._dispatch(after, until, partitions)
+            await asyncio.gather(*deliveries)
+        finally:
+            for partition in partitions:
+                self.leases.busy[partition] -= 1
+
+    async def _dispatch(self, after, until, partitions=None): # Stream due reminders chunk by chunk into the outbox
+        deliveries = []
+        partition_count = self.leases.partitions if partitions is not None else 1
+        # One stream at a time, so a backed-up outbox pins at most one reader connection
+        async with self._streaming:
+            async for chunk in async_db.iter_due_reminders(until, after, CHUNK_SIZE, partitions, partition_count):
+                deliveries.append(self._spawn(self._deliver(chunk, until)))
+                while self.outbox.depth > MAX_OUTBOX_DEPTH:
+                    await asyncio.sleep(0.5)
+        return deliveries
+
+    async def _deliver(self, due, fired_at): # Wait for a chunk to go out, then write back in one transaction
+        # One message per user and fire time however many reminders share it (chunks never split one)
+        groups = {}
+        for rem in due:
+            groups.setdefault((rem["user_id"], rem["next_fire_at"]), []).append(rem)
+        sends = []
+        for (user_id, next_fire_at), rems in groups.items():
+            for text, covered in reminder_messages(rems):
+                future = self.outbox.send(user_id, text)
+                future.add_done_callback(partial(record_lag, schedule.parse_utc(next_fire_at).timestamp()))
+                sends.append((future, covered))
+        results = await asyncio.gather(*(future for future, _ in sends), return_exceptions=True)
+        # Delivered and dead-lettered sends both use up their day; the dead letter records the loss
+        finished = [rem["id"] for (_, covered), result in zip(sends, results) if isinstance(result, bool)
+                    for rem in covered]
+        if finished:
+            await async_db.advance_reminders(finished, fired_at)
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+# Handlers running at once across different users; 1 keeps python-telegram-bot's
+# default of one update at a time
+WORKERS = int(os.getenv("UPDATE_WORKERS", "1"))
+# Updates handed to the lanes but not finished yet; beyond this the update fetcher waits,
+# so the backlog stays in application.update_queue (and the webhook answers 503)
+MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "1000"))
+# Updates one user may have waiting; more are dropped so a flood cannot hold MAX_PENDING
+MAX_PENDING_PER_USER = int(os.getenv("UPDATE_MAX_PENDING_PER_USER", "50"))
+
+
+def lane_key(update): # Updates with the same key run in arrival order: the user, else the chat
+    if isinstance(update, Update):
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+    return None
+
+
+class UserLanes(BaseUpdateProcessor): # One FIFO lane per user, lanes served round-robin by a pool of workers
+    def __init__(self, workers=WORKERS, max_pending=MAX_PENDING, max_pending_per_user=MAX_PENDING_PER_USER):
+        # The application hands updates over one at a time and only waits while MAX_PENDING is
+        # reached; the concurrency lives in the workers
+        super().__init__(1)
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_pending_per_user = max_pending_per_user
+        self._lanes = {}     # key -> deque of (coroutine, queued_at) for users with work in flight
+        self._ready = None   # keys whose next update can start, oldest turn first
+        self._slots = None   # one per pending update, up to max_pending
+        self._idle = None    # set while nothing is pending
+        self._tasks = []
+
+        # Counters
+        self.pending = 0
+        self.processed = 0
+        self.dropped = 0
+        self.wait_max = 0.0
+
+    @property
+    def running(self): # Updates being handled right now
+        return self.pending - sum(len(lane) for lane in self._lanes.values())
+
+    async def initialize(self): # Spawn the workers on the application's event loop
+        self._ready = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def do_process_update(self, update, coroutine):
+        key = lane_key(update)
+        lane = self._lanes.get(key)
+        if lane is not None and len(lane) >= self.max_pending_per_user:
+            coroutine.close()
+            self.dropped += 1
+            metrics.updates_dropped.inc()
+            return
+        await self._slots.acquire()
+        self.pending += 1
+        self._idle.clear()
+        lane = self._lanes.get(key)
+        if lane is None:
+            # No update of this user is queued or running: it may start as soon as a worker is free
+            self._lanes[key] = deque([(coroutine, time.monotonic())])
+            self._ready.put_nowait(key)
+        else:
+            lane.append((coroutine, time.monotonic()))
+
+    async def _worker(self):
+        while True:
+            key = await self._ready.get()
+            lane = self._lanes[key]
+            coroutine, queued_at = lane.popleft()
+            wait = time.monotonic() - queued_at
+            self.wait_max = max(self.wait_max, wait)
+            metrics.update_wait.observe(None, wait)
+            try:
+                await coroutine
+            except Exception:
+                pass  # Application.process_update has already passed it to the error handlers
+            finally:
+                self.processed += 1
+                self.pending -= 1
+                self._slots.release()
+                # The user's next update waits behind everyone else who is ready, so a busy
+                # user gets one update per round rather than the whole pool
+                if lane:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._lanes[key]
+                if not self.pending:
+                    self._idle.set()
+
+    async def join(self): # Wait for every update handed over so far to finish
+        if self._idle is not None:
+            await self._idle.wait()
+
+    async def shutdown(self): # Stop the workers; anything still queued is discarded
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for lane in self._lanes.values():
+            for coroutine, _ in lane:
+                coroutine.close()
+        self._lanes.clear()
@@ -0,0 +1,57 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+
+import async_db
+
+# Reminders are split into this many partitions by user (user id % PARTITIONS, so one
+# process sends each user's digest); every worker process sharing the database
+# dispatches only the partitions it leases
+PARTITIONS = int(os.getenv("REMINDER_PARTITIONS", "16"))
+# A lease not renewed for this many seconds is up for grabs, so a dead worker's
+# partitions fail over within LEASE_TTL plus one heartbeat
+LEASE_TTL = float(os.getenv("REMINDER_LEASE_TTL", "30"))
+
+
+class LeaseManager: # Holds this process's fair share of reminder partitions through heartbeats
+    def __init__(self, worker_id=None, partitions=PARTITIONS, ttl=LEASE_TTL):
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.partitions = partitions
+        self.ttl = ttl
+        # partition -> fire time this process has dispatched it up to (None: nothing yet). Sent
+        # reminders move their own next_fire_at on, so a new owner needs no progress handed over
+        self.owned = {}
+        self.busy = {}  # partition -> dispatches in flight; a busy partition is never handed back
+        # Held across a renewal, and by the dispatcher while it marks partitions busy, so no
+        # dispatch starts on a partition between reading busy and handing the surplus back
+        self.lock = asyncio.Lock()
+        # Monotonic time the last successful renewal started; every lease runs out ttl after it
+        self.renewed_at = None
+
+    def start(self, job_queue): # Heartbeat a few times per TTL, starting right away
+        # (first=0 would read as "not given" and wait a whole interval)
+        job_queue.run_repeating(self.heartbeat, interval=self.ttl / 3, first=0.1, name="reminder_leases")
+
+    async def heartbeat(self, context=None): # Renew, claim or release partitions; refresh self.owned
+        async with self.lock:
+            started = time.monotonic()
+            busy = [p for p, count in self.busy.items() if count]
+            try:
+                held = await async_db.renew_leases(self.worker_id, self.partitions, self.ttl, busy)
+            except Exception:
+                self.expire()
+                raise
+            self.renewed_at = started
+            # A newly claimed partition first catches up on everything overdue in it
+            self.owned = {partition: self.owned.get(partition) for partition in held}
+
+    def expire(self): # Drop every partition once ttl has passed without a renewal; another worker may hold it
+        if self.renewed_at is None or time.monotonic() - self.renewed_at >= self.ttl:
+            self.owned = {}
+
+    async def release(self): # Hand every partition back so the other workers take over at once
+        async with self.lock:
+            self.owned = {}
+            await async_db.release_leases(self.worker_id)
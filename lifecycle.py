@@ -0,0 +1,27 @@
+import asyncio
+import signal
+from contextlib import asynccontextmanager
+
+
+async def wait_for_stop_signal(): # Return on SIGINT or SIGTERM
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+@asynccontextmanager
+async def running(application): # Start the application with its hooks, as run_polling would, and stop it after
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        try:
+            yield application
+        finally:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)
@@ -0,0 +1,206 @@
+import asyncio
+import bisect
+import os
+import threading
+import time
+from functools import wraps
+from http import HTTPStatus
+
+from webhook import serve_http
+
+# Prometheus text endpoint, only started when METRICS_PORT is set
+LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+PORT = os.getenv("METRICS_PORT")
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROW_BUCKETS = (0, 1, 5, 20, 100, 500, 2000)
+LAG_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 900, 3600)
+
+_registry = []
+
+
+def _labels(name, value, extra=""): # {name="value",extra} or "" for an unlabelled series
+    pairs = [f'{name}="{value}"'] if name else []
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter: # Monotonic count per label value
+    def __init__(self, name, help, label=None):
+        self.name, self.help, self.label = name, help, label
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, label=None, amount=1):
+        with self._lock:
+            self._values[label] = self._values.get(label, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label, value in sorted(self._values.items(), key=lambda item: str(item[0])):
+            yield f"{self.name}{_labels(self.label, label)} {value}"
+
+
+class Histogram: # Cumulative-bucket histogram per label value; observe() is one bisect and a locked increment
+    def __init__(self, name, help, label=None, buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.label = name, help, label
+        self.buckets = tuple(buckets)
+        self._series = {}  # label value -> [bucket counts (last one is +Inf), sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, label, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = {label: (list(counts), total) for label, (counts, total) in self._series.items()}
+        for label, (counts, total) in sorted(series.items(), key=lambda item: str(item[0])):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.label, label, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label, label)} {total}"
+            yield f"{self.name}_count{_labels(self.label, label)} {cumulative}"
+
+
+class Gauge: # Current value read from a callback at scrape time, so it costs nothing in between
+    def __init__(self, name, help):
+        self.name, self.help = name, help
+        self.read = None
+        _registry.append(self)
+
+    def set_function(self, read):
+        self.read = read
+
+    def render(self):
+        if self.read is None:
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {self.read()}"
+
+
+handler_seconds = Histogram("havoc_handler_seconds", "Time spent in each update handler", "handler")
+handler_errors = Counter("havoc_handler_errors_total", "Handler calls that raised", "handler")
+db_seconds = Histogram("havoc_db_seconds", "Time spent in each db function on its database thread", "function")
+db_rows = Histogram("havoc_db_rows", "Rows returned by each db function call", "function", ROW_BUCKETS)
+db_group_commit_writes = Histogram("havoc_db_group_commit_writes", "Writes committed together by one group commit",
+                                   buckets=ROW_BUCKETS)
+reminder_lag = Histogram("havoc_reminder_lag_seconds", "Reminder delivery time minus its scheduled HH:MM",
+                         buckets=LAG_BUCKETS)
+messages = Counter("havoc_messages_total", "Outbound messages by final result", "result")
+send_errors = Counter("havoc_send_errors_total", "Failed Bot API send attempts by error type", "error")
+job_queue_jobs = Gauge("havoc_job_queue_jobs", "Jobs scheduled on the job queue")
+update_queue_size = Gauge("havoc_update_queue_size", "Updates waiting for the handlers")
+update_wait = Histogram("havoc_update_wait_seconds", "Time an update waited in its user's lane before its handler ran")
+updates_dropped = Counter("havoc_updates_dropped_total", "Updates dropped because the user already had too many waiting")
+update_lanes_pending = Gauge("havoc_update_lanes_pending", "Updates queued or running in the per-user lanes")
+outbox_depth = Gauge("havoc_outbox_depth", "Outbound messages queued or being sent")
+db_pending_writes = Gauge("havoc_db_pending_writes", "Writes waiting for the database writer threads")
+
+
+def render(): # Every metric in the Prometheus text exposition format
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+def timed_handler(callback): # Wrap a handler callback to record its latency and failures
+    name = callback.__name__
+
+    @wraps(callback)
+    async def call(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(name, time.perf_counter() - start)
+    return call
+
+
+def instrument_handlers(application): # Time every registered handler's callback
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = timed_handler(handler.callback)
+
+
+def row_count(result): # Rows returned: list length, the list inside a page dict, or 0/1
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict):
+        lists = [value for value in result.values() if isinstance(value, list)]
+        return len(lists[0]) if lists else 1
+    return 0 if result is None else 1
+
+
+def timed_query(func): # Wrap a db function to record its duration and row count
+    name = func.__name__
+
+    @wraps(func)
+    def call(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            db_seconds.observe(name, time.perf_counter() - start)
+        db_rows.observe(name, row_count(result))
+        return result
+    return call
+
+
+def timed_stream(func): # Like timed_query for a generator of chunks, timing each chunk pulled
+    name = func.__name__
+
+    @wraps(func)
+    def call(*args, **kwargs):
+        chunks = func(*args, **kwargs)
+        try:
+            while True:
+                start = time.perf_counter()
+                chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                db_seconds.observe(name, time.perf_counter() - start)
+                db_rows.observe(name, len(chunk))
+                yield chunk
+        finally:
+            chunks.close()
+    return call
+
+
+_server = None
+
+
+async def _respond(method, target, headers, body):
+    if method != "GET" or target.split("?", 1)[0] != "/metrics":
+        return HTTPStatus.NOT_FOUND, b""
+    return HTTPStatus.OK, render().encode(), "text/plain; version=0.0.4; charset=utf-8"
+
+
+async def start_server(host=LISTEN, port=PORT): # Serve /metrics if a port is configured
+    global _server
+    if port and _server is None:
+        _server = await asyncio.start_server(
+            lambda reader, writer: serve_http(reader, writer, _respond), host, int(port))
+
+
+async def close_server():
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
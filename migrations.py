@@ -0,0 +1,314 @@
+# Schema migrations, applied in order on startup.
+#
+# PRAGMA user_version records how many entries of MIGRATIONS a database file has
+# already applied, so an existing tasks.db is upgraded in place by running only
+# the ones it is missing. Append new migrations to the end; never edit old ones.
+
+import sqlite3
+import time
+
+import schedule
+
+# Seconds to wait for another process's migration or VACUUM, which can outlast busy_timeout
+LOCK_WAIT = 600
+
+
+def _schedule_existing_reminders(conn): # Fill next_fire_at for reminders created before the column existed
+    now = schedule.utcnow()
+    rows = conn.execute("SELECT id, time FROM reminders").fetchall()
+    conn.executemany("UPDATE reminders SET next_fire_at = ? WHERE id = ?",
+                     [(schedule.next_fire_at(hhmm, None, now), reminder_id) for reminder_id, hhmm in rows])
+
+
+# Keep tasks_fts in step with tasks; recreated whenever the tasks table is rebuilt
+_FTS_TRIGGERS = (
+    '''CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+        INSERT INTO tasks_fts (rowid, user_id, task) VALUES (new.rowid, new.user_id, new.task);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, user_id, task) VALUES ('delete', old.rowid, old.user_id, old.task);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF user_id, task ON tasks BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, user_id, task) VALUES ('delete', old.rowid, old.user_id, old.task);
+        INSERT INTO tasks_fts (rowid, user_id, task) VALUES (new.rowid, new.user_id, new.task);
+    END''',
+)
+
+
+# Keep user_stats and the one-row stats table in step with tasks and reminders, so counts
+# are read without scanning; recreated whenever tasks or reminders are rebuilt
+_STATS_TRIGGERS = (
+    '''CREATE TRIGGER IF NOT EXISTS stats_task_insert AFTER INSERT ON tasks BEGIN
+        INSERT INTO user_stats (user_id, tasks, done) VALUES (new.user_id, 1, ifnull(new.done, 0) != 0)
+            ON CONFLICT (user_id) DO UPDATE SET tasks = tasks + 1, done = done + excluded.done;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_task_delete AFTER DELETE ON tasks BEGIN
+        UPDATE user_stats SET tasks = tasks - 1, done = done - (ifnull(old.done, 0) != 0) WHERE user_id = old.user_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_task_done AFTER UPDATE OF done ON tasks
+        WHEN old.user_id IS new.user_id AND (ifnull(old.done, 0) != 0) != (ifnull(new.done, 0) != 0) BEGIN
+        UPDATE user_stats SET done = done + (ifnull(new.done, 0) != 0) - (ifnull(old.done, 0) != 0)
+        WHERE user_id = new.user_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_task_move AFTER UPDATE OF user_id ON tasks
+        WHEN old.user_id IS NOT new.user_id BEGIN
+        UPDATE user_stats SET tasks = tasks - 1, done = done - (ifnull(old.done, 0) != 0) WHERE user_id = old.user_id;
+        INSERT INTO user_stats (user_id, tasks, done) VALUES (new.user_id, 1, ifnull(new.done, 0) != 0)
+            ON CONFLICT (user_id) DO UPDATE SET tasks = tasks + 1, done = done + excluded.done;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_reminder_insert AFTER INSERT ON reminders BEGIN
+        INSERT INTO user_stats (user_id, reminders) VALUES (new.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET reminders = reminders + 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_reminder_delete AFTER DELETE ON reminders BEGIN
+        UPDATE user_stats SET reminders = reminders - 1 WHERE user_id = old.user_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_reminder_update AFTER UPDATE OF user_id ON reminders
+        WHEN old.user_id IS NOT new.user_id BEGIN
+        UPDATE user_stats SET reminders = reminders - 1 WHERE user_id = old.user_id;
+        INSERT INTO user_stats (user_id, reminders) VALUES (new.user_id, 1)
+            ON CONFLICT (user_id) DO UPDATE SET reminders = reminders + 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_user_insert AFTER INSERT ON user_stats BEGIN
+        UPDATE stats SET users = users + (new.tasks > 0), tasks = tasks + new.tasks,
+                         done = done + new.done, reminders = reminders + new.reminders;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_user_update AFTER UPDATE ON user_stats BEGIN
+        UPDATE stats SET users = users + (new.tasks > 0) - (old.tasks > 0), tasks = tasks + new.tasks - old.tasks,
+                         done = done + new.done - old.done, reminders = reminders + new.reminders - old.reminders;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS stats_user_delete AFTER DELETE ON user_stats BEGIN
+        UPDATE stats SET users = users - (old.tasks > 0), tasks = tasks - old.tasks,
+                         done = done - old.done, reminders = reminders - old.reminders;
+    END''',
+)
+
+# Per-user counts straight from tasks and reminders, for users that have any
+FRESH_USER_STATS = """
+    SELECT user_id, SUM(tasks) AS tasks, SUM(done) AS done, SUM(reminders) AS reminders FROM (
+        SELECT user_id, COUNT(*) AS tasks, SUM(ifnull(done, 0) != 0) AS done, 0 AS reminders
+        FROM tasks GROUP BY user_id
+        UNION ALL
+        SELECT user_id, 0, 0, COUNT(*) FROM reminders GROUP BY user_id
+    ) GROUP BY user_id"""
+
+
+def rebuild_stats(conn): # Recount user_stats and stats from scratch
+    # Without the stats row the user_stats triggers have nothing to update while the rows go in
+    conn.execute("DELETE FROM stats")
+    conn.execute("DELETE FROM user_stats")
+    conn.execute(f"INSERT INTO user_stats (user_id, tasks, done, reminders) {FRESH_USER_STATS}")
+    conn.execute("""INSERT INTO stats (id, users, tasks, done, reminders)
+                    SELECT 1, COUNT(*) FILTER (WHERE tasks > 0), ifnull(SUM(tasks), 0), ifnull(SUM(done), 0),
+                           ifnull(SUM(reminders), 0)
+                    FROM user_stats""")
+
+
+MIGRATIONS = [
+    # 1: original tables
+    (
+        '''CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            task TEXT NOT NULL,
+            done INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS reminders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            task_id TEXT NOT NULL,
+            time TEXT NOT NULL,
+            days_left INTEGER NOT NULL,
+            FOREIGN KEY (task_id) REFERENCES tasks(id) ON DELETE CASCADE
+        )''',
+    ),
+    # 2: per-user listing in creation order, per-user reminders, task -> reminders cascade
+    (
+        "CREATE INDEX IF NOT EXISTS idx_tasks_user_created ON tasks(user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_reminders_user ON reminders(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_reminders_task ON reminders(task_id)",
+    ),
+    # 3: zero-pad stored times ("9:5" -> "09:05") and index them for the per-minute dispatcher
+    (
+        """UPDATE reminders SET time = printf('%02d:%02d',
+               CAST(substr(time, 1, instr(time, ':') - 1) AS INTEGER),
+               CAST(substr(time, instr(time, ':') + 1) AS INTEGER))""",
+        "CREATE INDEX IF NOT EXISTS idx_reminders_time ON reminders(time)",
+    ),
+    # 4: messages the outbox gave up on
+    (
+        '''CREATE TABLE IF NOT EXISTS dead_letters (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT NOT NULL,
+            text TEXT NOT NULL,
+            error TEXT NOT NULL,
+            failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+    ),
+    # 5: reminder partition leases for several worker processes sharing the database
+    (
+        '''CREATE TABLE IF NOT EXISTS leases (
+            partition INTEGER PRIMARY KEY,
+            owner TEXT,
+            expires_at REAL NOT NULL DEFAULT 0,
+            dispatched_until TEXT
+        )''',
+        '''CREATE TABLE IF NOT EXISTS lease_workers (
+            worker TEXT PRIMARY KEY,
+            heartbeat_at REAL NOT NULL
+        )''',
+    ),
+    # 6: absolute UTC fire times, so the dispatcher asks "what is due before T" with one
+    # range scan; per-user timezones; progress now lives in next_fire_at, not in leases
+    (
+        "ALTER TABLE reminders ADD COLUMN next_fire_at TEXT",
+        "ALTER TABLE reminders ADD COLUMN last_fired_at TEXT",
+        _schedule_existing_reminders,
+        "CREATE INDEX IF NOT EXISTS idx_reminders_next_fire ON reminders(next_fire_at)",
+        "DROP INDEX IF EXISTS idx_reminders_time",
+        '''CREATE TABLE IF NOT EXISTS user_settings (
+            user_id TEXT PRIMARY KEY,
+            timezone TEXT
+        )''',
+        "ALTER TABLE leases DROP COLUMN dispatched_until",
+    ),
+    # 7: full-text index over task titles for /search. External content, so titles are not
+    # stored twice; user_id is indexed too, so a search only walks the user's own postings.
+    # Prefix indexes up to 5 letters keep a half-typed word from merging every matching term
+    # (2-5 letter prefixes 4-10x faster); they cost about a quarter of the indexed insert rate
+    (
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+            user_id, task,
+            content='tasks', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3 4 5'
+        )''',
+        *_FTS_TRIGGERS,
+        "INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')",
+    ),
+    # 8: integer task keys instead of random 8-char hex TEXT ones. tasks.id becomes the old
+    # rowid, so /list order and the FTS index carry over untouched, and reminders.task_id
+    # follows it. The copy references tasks_new until the renames, so dropping the old
+    # tasks table cannot cascade into the copied reminders
+    (
+        "DROP TRIGGER tasks_fts_insert",
+        "DROP TRIGGER tasks_fts_delete",
+        "DROP TRIGGER tasks_fts_update",
+        '''CREATE TABLE tasks_new (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            task TEXT NOT NULL,
+            done INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        """INSERT INTO tasks_new (id, user_id, task, done, created_at)
+           SELECT rowid, user_id, task, done, created_at FROM tasks""",
+        '''CREATE TABLE reminders_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            task_id INTEGER NOT NULL,
+            time TEXT NOT NULL,
+            days_left INTEGER NOT NULL,
+            next_fire_at TEXT,
+            last_fired_at TEXT,
+            FOREIGN KEY (task_id) REFERENCES tasks_new(id) ON DELETE CASCADE
+        )''',
+        """INSERT INTO reminders_new (id, user_id, task_id, time, days_left, next_fire_at, last_fired_at)
+           SELECT r.id, r.user_id, t.rowid, r.time, r.days_left, r.next_fire_at, r.last_fired_at
+           FROM reminders r JOIN tasks t ON t.id = r.task_id""",
+        "DROP TABLE reminders",
+        "DROP TABLE tasks",
+        "ALTER TABLE tasks_new RENAME TO tasks",
+        "ALTER TABLE reminders_new RENAME TO reminders",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_user_created ON tasks(user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_reminders_user ON reminders(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_reminders_task ON reminders(task_id)",
+        "CREATE INDEX IF NOT EXISTS idx_reminders_next_fire ON reminders(next_fire_at)",
+        *_FTS_TRIGGERS,
+    ),
+    # 9: due reminders in (fire time, user) order straight off the index, so a user's reminders
+    # for one minute arrive together and go out as one digest
+    (
+        "DROP INDEX IF EXISTS idx_reminders_next_fire",
+        "CREATE INDEX IF NOT EXISTS idx_reminders_due ON reminders(next_fire_at, user_id)",
+    ),
+    # 10: task, done and reminder counts per user and in total, kept by triggers, so startup and
+    # /stats read them instead of counting every row
+    (
+        '''CREATE TABLE IF NOT EXISTS user_stats (
+            user_id TEXT PRIMARY KEY,
+            tasks INTEGER NOT NULL DEFAULT 0,
+            done INTEGER NOT NULL DEFAULT 0,
+            reminders INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            users INTEGER NOT NULL,
+            tasks INTEGER NOT NULL,
+            done INTEGER NOT NULL,
+            reminders INTEGER NOT NULL
+        )''',
+        *_STATS_TRIGGERS,
+        rebuild_stats,
+    ),
+    # 11: completion times, and an archive that done tasks move to once they are old enough, so
+    # the hot tasks table and its indexes only hold what users still work with. Tasks already
+    # done count as completed now. The partial index finds archivable tasks without a scan
+    (
+        "ALTER TABLE tasks ADD COLUMN done_at TEXT",
+        "UPDATE tasks SET done_at = CURRENT_TIMESTAMP WHERE done",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_done_at ON tasks(done_at) WHERE done",
+        '''CREATE TABLE IF NOT EXISTS task_archive (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            task TEXT NOT NULL,
+            created_at TIMESTAMP,
+            done_at TEXT,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        "CREATE INDEX IF NOT EXISTS idx_task_archive_user ON task_archive(user_id)",
+    ),
+]
+
+
+def schema_version(conn): # Number of migrations already applied to this database
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def is_busy(exc): # Whether an OperationalError only means another connection holds the lock
+    return getattr(exc, "sqlite_errorcode", None) in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+
+def begin_immediate(conn, wait=LOCK_WAIT): # Take the write lock, however long another process holds it
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as exc:
+            if not is_busy(exc) or time.monotonic() > deadline:
+                raise
+
+
+def migrate(conn, target=None): # Apply pending migrations, one transaction each
+    target = len(MIGRATIONS) if target is None else target
+    while True:
+        # Processes starting together on a shared file each get here; the version is read
+        # under the write lock, so only the first applies a migration and the rest skip it
+        begin_immediate(conn)
+        version = schema_version(conn) + 1
+        if version > target:
+            conn.rollback()
+            break
+        try:
+            for step in MIGRATIONS[version - 1]:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {version}")
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    return schema_version(conn)
@@ -0,0 +1,153 @@
+import asyncio
+import time
+from datetime import timedelta
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+import async_db
+import metrics
+
+GLOBAL_RATE = 28        # messages per second across all chats, just under Telegram's ~30/s
+PER_CHAT_INTERVAL = 1.0 # seconds between messages to the same chat
+WORKERS = 16
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0      # seconds, doubled after each network failure
+
+
+class TokenBucket: # Global send rate limit shared by all outbox workers
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class Outbox: # Rate-limited outbound message queue with retries and a dead-letter table
+    def __init__(self, bot, rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL, workers=WORKERS,
+                 max_attempts=MAX_ATTEMPTS, backoff_base=BACKOFF_BASE, dead_letter=None):
+        self.bot = bot
+        self.per_chat_interval = per_chat_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self._bucket = TokenBucket(rate)
+        self._dead_letter = dead_letter or async_db.add_dead_letter
+        self._queue = asyncio.Queue()
+        self._worker_count = workers
+        self._workers = []
+        self._chat_next = {}     # chat_id -> earliest monotonic time of its next send
+        self._paused_until = 0.0 # set by RetryAfter, holds back every worker
+
+        # Counters
+        self.sent = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.in_flight = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def depth(self): # Messages waiting to be sent or currently being sent
+        return self._queue.qsize() + self.in_flight
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "sent": self.sent,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "latency_avg": self.latency_total / self.sent if self.sent else 0.0,
+            "latency_max": self.latency_max,
+        }
+
+    def start(self): # Spawn the worker tasks on the running event loop
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._worker_count)]
+
+    async def close(self, timeout=10): # Give queued messages a chance to go out, then stop
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def send(self, chat_id, text): # Queue a message; the future resolves True once delivered, False if dead-lettered
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((chat_id, text, future, time.monotonic()))
+        return future
+
+    async def _wait_turn(self, chat_id): # Per-chat pacing, flood pauses, then a global token
+        now = time.monotonic()
+        if len(self._chat_next) > 10000:
+            self._chat_next = {chat: t for chat, t in self._chat_next.items() if t > now}
+        slot = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = slot + self.per_chat_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+        while self._paused_until > time.monotonic():
+            await asyncio.sleep(self._paused_until - time.monotonic())
+        await self._bucket.acquire()
+
+    async def _deliver(self, chat_id, text): # Returns None on success, or the error that ended the attempts
+        for attempt in range(1, self.max_attempts + 1):
+            await self._wait_turn(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return None
+            except RetryAfter as exc:
+                metrics.send_errors.inc("RetryAfter")
+                delay = exc.retry_after
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                error = exc
+            except BadRequest as exc:  # A NetworkError subclass, but the same request fails the same way again
+                metrics.send_errors.inc(type(exc).__name__)
+                return exc
+            except NetworkError as exc:  # TimedOut, connection errors
+                metrics.send_errors.inc(type(exc).__name__)
+                error = exc
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(self.backoff_base * 2 ** (attempt - 1))
+            except Exception as exc:  # Forbidden, ...: retrying will not help
+                metrics.send_errors.inc(type(exc).__name__)
+                return exc
+            if attempt < self.max_attempts:
+                self.retried += 1
+        return error
+
+    async def _worker(self):
+        while True:
+            chat_id, text, future, queued_at = await self._queue.get()
+            self.in_flight += 1
+            try:
+                error = await self._deliver(chat_id, text)
+                if error is None:
+                    latency = time.monotonic() - queued_at
+                    self.sent += 1
+                    self.latency_total += latency
+                    self.latency_max = max(self.latency_max, latency)
+                    metrics.messages.inc("sent")
+                else:
+                    self.dead_lettered += 1
+                    metrics.messages.inc("dead_lettered")
+                    await self._dead_letter(chat_id, text, repr(error))
+                if not future.done():
+                    future.set_result(error is None)
+            except Exception as exc:
+                if not future.done():
+                    future.set_exception(exc)
+            finally:
+                self.in_flight -= 1
+                self._queue.task_done()
@@ -0,0 +1,130 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+READER_COUNT = 4
+
+# Applied to every connection when it is opened
+PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA synchronous = NORMAL",    # safe with WAL, fsync only on checkpoint
+    "PRAGMA cache_size = -16000",     # ~16 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",   # 256 MB memory-mapped reads
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA auto_vacuum = INCREMENTAL", # takes effect on a new file; init() converts an existing one
+)
+
+# Inside group_commit(), the pools this thread has joined and the callbacks waiting for the commit
+_group = threading.local()
+
+
+def connect(path): # Open a tuned connection that may be handed between threads
+    conn = sqlite3.connect(path, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+@contextmanager
+def group_commit(): # Every pool.write() on this thread inside the block shares one transaction per pool
+    pools, callbacks = [], []
+    _group.pools, _group.callbacks = pools, callbacks
+    try:
+        yield
+        for pool in pools:
+            pool._writer.commit()
+    except BaseException:
+        for pool in pools:
+            pool._writer.rollback()
+        raise
+    finally:
+        del _group.pools, _group.callbacks
+        for pool in pools:
+            pool._write_lock.release()
+    for callback, args in callbacks:
+        callback(*args)
+
+
+def after_commit(callback, *args): # Run now, or once the enclosing group_commit() has committed
+    callbacks = getattr(_group, "callbacks", None)
+    if callbacks is None:
+        callback(*args)
+    else:
+        callbacks.append((callback, args))
+
+
+class ConnectionPool: # One long-lived writer plus a small pool of readers
+    def __init__(self, path, readers=READER_COUNT):
+        self.path = path
+        self._writer = connect(path)
+        self._writer.execute("PRAGMA journal_mode = WAL")
+        self._write_lock = threading.Lock()
+
+        # An in-memory database is private to its connection, so reads share the writer
+        if path == ":memory:":
+            readers = 0
+        self._readers = queue.LifoQueue()
+        for _ in range(readers):
+            self._readers.put(connect(path))
+        self._reader_count = readers
+
+    @contextmanager
+    def write(self): # Serialized write transaction, committed on success
+        pools = getattr(_group, "pools", None)
+        if pools is not None:
+            yield from self._grouped_write(pools)
+            return
+        with self._write_lock:
+            # sqlite3 would only BEGIN before the first INSERT/UPDATE/DELETE, leaving the reads that
+            # resolve a /done number outside the transaction; IMMEDIATE takes the write lock up front
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+            except BaseException:
+                self._writer.rollback()
+                raise
+            else:
+                self._writer.commit()
+
+    def _grouped_write(self, pools): # Inside group_commit(): a savepoint, so one failed write leaves the rest
+        if self not in pools:
+            # Held until the group commits; an explicit BEGIN keeps RELEASE from committing
+            self._write_lock.acquire()
+            pools.append(self)
+            self._writer.execute("BEGIN IMMEDIATE")
+        self._writer.execute("SAVEPOINT write")
+        try:
+            yield self._writer
+        except BaseException:
+            self._writer.execute("ROLLBACK TO write")
+            self._writer.execute("RELEASE write")
+            raise
+        self._writer.execute("RELEASE write")
+
+    @contextmanager
+    def maintenance(self): # The writer outside any transaction, for migrations and VACUUM that run their own
+        with self._write_lock:
+            yield self._writer
+
+    @contextmanager
+    def read(self): # Borrow a reader connection for the duration of the block
+        if not self._reader_count:
+            with self._write_lock:
+                yield self._writer
+            return
+
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            conn.rollback()  # never hand back a connection holding a read snapshot
+            self._readers.put(conn)
+
+    def close(self): # Close every connection owned by the pool
+        with self._write_lock:
+            for _ in range(self._reader_count):
+                self._readers.get().close()
+            self._reader_count = 0
+            self._writer.close()
@@ -0,0 +1,47 @@
+import os
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Reminders are set as a wall-clock HH:MM in the user's timezone (/timezone), or in
+# DEFAULT_TIMEZONE for users who never set one; empty means the server's local time
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE") or None
+
+# Fire times are stored in UTC in the same shape as CURRENT_TIMESTAMP, so they sort as text
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+def format_utc(moment): # Aware datetime -> stored UTC timestamp
+    return moment.astimezone(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def parse_utc(text): # Stored UTC timestamp -> aware datetime
+    return datetime.strptime(text, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+
+
+def valid_timezone(name): # Whether name is an IANA zone such as Europe/Berlin
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def _zone(name): # None is the server's local time, which naive datetimes already use
+    name = name or DEFAULT_TIMEZONE
+    return ZoneInfo(name) if name else None
+
+
+def next_fire_at(hhmm, timezone_name, after): # First HH:MM in the zone strictly after the aware datetime after
+    zone = _zone(timezone_name)
+    at = time(int(hhmm[:2]), int(hhmm[3:]))
+    day = after.astimezone(zone).date()
+    while True:
+        # Computed from the wall clock each time, so a late send never shifts the next one
+        candidate = datetime.combine(day, at, tzinfo=zone).astimezone(timezone.utc)
+        if candidate > after:
+            return format_utc(candidate)
+        day += timedelta(days=1)
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import os
+import secrets
+from http import HTTPStatus
+
+from telegram import Update
+
+import lifecycle
+
+LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8443"))
+PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Updates waiting for the handlers; beyond this Telegram is told to retry later
+MAX_QUEUE = int(os.getenv("WEBHOOK_MAX_QUEUE", "1000"))
+MAX_BODY = 1 << 20
+MAX_HEADERS = 100
+# Slow or idle clients are cut off, so they cannot pin connections on a public port
+IDLE_TIMEOUT = 60  # seconds a keep-alive connection may wait for its next request
+READ_TIMEOUT = 10  # seconds to receive the rest of a request once its first line arrived
+
+
+async def read_request(reader): # (method, path, headers, body) of the next HTTP/1.1 request, None at EOF
+    line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+    if not line:
+        return None
+    return await asyncio.wait_for(_read_message(reader, line), READ_TIMEOUT)
+
+
+async def _read_message(reader, request_line): # Headers and body following the request line
+    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    for _ in range(MAX_HEADERS + 1):
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    else:
+        raise ValueError("too many headers")
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY:
+        raise ValueError("request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method, target, headers, body
+
+
+def write_response(writer, status, body=b"", content_type="application/json"):
+    status = HTTPStatus(status)
+    writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                 f"Content-Type: {content_type}\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+
+
+async def serve_http(reader, writer, respond):
+    # Keep-alive loop: respond(method, path, headers, body) -> (status, body[, content_type])
+    try:
+        while True:
+            request = await read_request(reader)
+            if request is None:
+                break
+            status, body, *content_type = await respond(*request)
+            write_response(writer, status, body, *content_type)
+            await writer.drain()
+            if request[2].get("connection", "").lower() == "close":
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+class WebhookServer: # Accepts Telegram's webhook POSTs straight into the application's update queue
+    def __init__(self, application, path=PATH, secret=None, max_queue=MAX_QUEUE):
+        self.application = application
+        self.path = path
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.max_queue = max_queue
+        self.accepted = 0
+        self.rejected = 0
+        self._server = None
+
+    async def start(self, host=LISTEN, port=PORT):
+        self._server = await asyncio.start_server(
+            lambda reader, writer: serve_http(reader, writer, self._respond), host, port)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _respond(self, method, target, headers, body):
+        if method != "POST" or target != self.path:
+            return HTTPStatus.NOT_FOUND, b""
+        token = headers.get("x-telegram-bot-api-secret-token", "").encode("latin-1")
+        if not secrets.compare_digest(token, self.secret.encode("latin-1")):
+            return HTTPStatus.FORBIDDEN, b""
+
+        queue = self.application.update_queue
+        if queue.qsize() >= self.max_queue:
+            # Telegram keeps the update and redelivers it, so shedding load here loses nothing
+            self.rejected += 1
+            return HTTPStatus.SERVICE_UNAVAILABLE, b""
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, KeyError, TypeError):
+            return HTTPStatus.BAD_REQUEST, b""
+        queue.put_nowait(update)
+        self.accepted += 1
+        return HTTPStatus.OK, b""
+
+
+async def serve(application, url, allowed_updates, secret=None): # Run the bot on webhooks until SIGINT/SIGTERM
+    server = WebhookServer(application, secret=secret or os.getenv("WEBHOOK_SECRET"))
+    async with lifecycle.running(application):
+        await server.start()
+        await application.bot.set_webhook(url.rstrip("/") + server.path, secret_token=server.secret,
+                                          allowed_updates=allowed_updates)
+        try:
+            await lifecycle.wait_for_stop_signal()
+        finally:
+            await server.close()
+
+
+def run(application, url, allowed_updates): # Blocking entry point used by bot.main()
+    asyncio.run(serve(application, url, allowed_updates))